@@ -1,19 +1,19 @@
 from fastapi import APIRouter, HTTPException, status
-from app.db.supabase import supabase_client
+from app.db.supabase import get_auth_client
 from app.models.user import UserCreate, UserLogin, UserResponse, TokenResponse
 from gotrue.errors import AuthApiError
 
 router = APIRouter()
 
 @router.post("/auth/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def signup(user_credentials: UserCreate):
+async def signup(user_credentials: UserCreate):
     """
     Creates a new user in Supabase Auth.
     """
     try:
         # Supabase sign_up requires email and password.
         # We store additional data like 'name' in the 'data' field of options.
-        session = supabase_client.auth.sign_up({
+        session = await get_auth_client().sign_up({
             "email": user_credentials.email,
             "password": user_credentials.password,
             "options": {
@@ -48,12 +48,12 @@ def signup(user_credentials: UserCreate):
         )
 
 @router.post("/auth/signin", response_model=TokenResponse)
-def signin(user_credentials: UserLogin):
+async def signin(user_credentials: UserLogin):
     """
     Authenticates a user and returns a session token.
     """
     try:
-        session = supabase_client.auth.sign_in_with_password({
+        session = await get_auth_client().sign_in_with_password({
             "email": user_credentials.email,
             "password": user_credentials.password
         })
@@ -1,116 +1,125 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import HTTPAuthorizationCredentials
+from typing import List, Optional
 from gotrue.types import User
 
-from app.db.supabase import supabase_client
-from app.models.chatbot import Chatbot, ChatbotCreate, ChatbotUpdate
-from app.api.dependencies import get_current_user
+from app.models.chatbot import Chatbot, ChatbotCreate, ChatbotSummary, ChatbotUpdate
+from app.api.dependencies import get_chatbot_repository, get_current_user, get_current_user_strict, token_auth_scheme
+from app.core.cache import dashboard_stats_cache, widget_config_cache
+from app.core.pagination import NEXT_CURSOR_HEADER, fetch_page_or_all
+from app.core.serialization import model_list_response
+from app.db.repositories import ChatbotRepository
+from app.services.answer_cache import answer_cache
+from app.services.bootstrap import bootstrap_bundles
+from app.services.routing import chat_router
+from app.services.search import search_indexes
+from app.services.storage_gc import storage_gc
+from app.services.transcripts import transcript_store
+from app.services.vectors import vector_store
 
 router = APIRouter()
-token_auth_scheme = HTTPBearer()
 
-def check_chatbot_owner(chatbot_id: str, user_id: str):
-    """Helper function to verify chatbot ownership."""
-    response = supabase_client.table('chatbots').select('id').eq('id', chatbot_id).eq('user_id', user_id).execute()
-    if not response.data:
+async def require_chatbot(chatbots: ChatbotRepository, chatbot_id: str, columns: str = "id") -> dict:
+    """Helper function to fetch a chatbot the caller owns, or fail with 404."""
+    chatbot = await chatbots.get(chatbot_id, columns)
+    if chatbot is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot not found or you do not have permission to access it.")
+    return chatbot
 
-@router.get("/chatbots", response_model=List[Chatbot], response_model_by_alias=False)
-def get_chatbots_for_user(
+@router.get("/chatbots", response_model=List[ChatbotSummary], response_model_by_alias=False)
+async def get_chatbots_for_user(
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
-    token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository)
 ):
     """
-    Retrieves all chatbots associated with the current authenticated user.
+    Retrieves the current user's chatbots, most recently updated first. With
+    `limit` or `cursor` they come one page at a time; when more remain, the
+    `X-Next-Cursor` header holds the `cursor` for the next page. Without
+    either, every chatbot is returned.
     """
-    supabase_client.postgrest.auth(token.credentials)
-    response = supabase_client.table('chatbots').select('*').eq('user_id', current_user.id).order('last_updated', desc=True).execute()
-
-    if response.data is None:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not fetch chatbots.")
-    
-    return [Chatbot.model_validate(item) for item in response.data]
+    rows, next_cursor = await fetch_page_or_all(chatbots.list, limit, cursor)
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return model_list_response(ChatbotSummary, rows, headers)
 
 @router.get("/chatbots/{chatbot_id}", response_model=Chatbot, response_model_by_alias=False)
-def get_chatbot_details(
+async def get_chatbot_details(
     chatbot_id: str,
     current_user: User = Depends(get_current_user),
-    token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository)
 ):
     """
     Retrieves the details of a specific chatbot.
     """
-    supabase_client.postgrest.auth(token.credentials)
-    check_chatbot_owner(chatbot_id, current_user.id)
-    
-    response = supabase_client.table('chatbots').select('*').eq('id', chatbot_id).single().execute()
-    
-    if not response.data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot not found.")
-        
-    return Chatbot.model_validate(response.data)
+    return Chatbot.model_validate(await require_chatbot(chatbots, chatbot_id, "*"))
 
 @router.post("/chatbots", response_model=Chatbot, status_code=status.HTTP_201_CREATED, response_model_by_alias=False)
-def create_chatbot(
+async def create_chatbot(
     chatbot_data: ChatbotCreate,
     current_user: User = Depends(get_current_user),
-    token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository)
 ):
     """
     Creates a new chatbot for the authenticated user.
     """
-    supabase_client.postgrest.auth(token.credentials)
-    new_chatbot_dict = chatbot_data.model_dump()
-    new_chatbot_dict["user_id"] = current_user.id
-    
-    response = supabase_client.table('chatbots').insert(new_chatbot_dict).execute()
-    
-    if not response.data:
+    chatbot = await chatbots.create(chatbot_data.model_dump())
+
+    if chatbot is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to create chatbot.")
-    
-    return Chatbot.model_validate(response.data[0])
+
+    dashboard_stats_cache.invalidate(current_user.id)
+    return Chatbot.model_validate(chatbot)
 
 @router.patch("/chatbots/{chatbot_id}", response_model=Chatbot, response_model_by_alias=False)
-def update_chatbot_details(
+async def update_chatbot_details(
     chatbot_id: str,
     chatbot_update: ChatbotUpdate,
     current_user: User = Depends(get_current_user),
-    token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository)
 ):
     """
     Updates the settings of a specific chatbot.
     """
-    supabase_client.postgrest.auth(token.credentials)
-    check_chatbot_owner(chatbot_id, current_user.id)
-    
     update_data = chatbot_update.model_dump(by_alias=True, exclude_unset=True)
     if not update_data:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No update data provided.")
-    
-    response = supabase_client.table('chatbots').update(update_data).eq('id', chatbot_id).execute()
 
-    if not response.data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot not found or update failed.")
+    chatbot = await chatbots.update(chatbot_id, update_data)
+
+    if chatbot is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot not found or you do not have permission to access it.")
 
-    return Chatbot.model_validate(response.data[0])
+    widget_config_cache.invalidate(chatbot_id)
+    answer_cache.invalidate(chatbot_id)
+    await bootstrap_bundles.rebuild(chatbot_id, chatbot)
+    return Chatbot.model_validate(chatbot)
 
 
 @router.delete("/chatbots/{chatbot_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_chatbot(
+async def delete_chatbot(
     chatbot_id: str,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_strict),
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository),
     token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)
 ):
     """
-    Deletes a specific chatbot.
+    Deletes a specific chatbot. Its documents go with it; their files are
+    removed from storage in the background.
     """
-    supabase_client.postgrest.auth(token.credentials)
-    check_chatbot_owner(chatbot_id, current_user.id)
-    
-    response = supabase_client.table('chatbots').delete().eq('id', chatbot_id).execute()
-    
-    if not response.data:
-         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot not found or delete failed.")
-         
-    return None
\ No newline at end of file
+    deleted = await chatbots.delete(chatbot_id)
+
+    if deleted is None:
+         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot not found or you do not have permission to access it.")
+
+    storage_gc.enqueue([f"{current_user.id}/{chatbot_id}/"], token.credentials)
+    widget_config_cache.invalidate(chatbot_id)
+    bootstrap_bundles.invalidate(chatbot_id)
+    answer_cache.invalidate(chatbot_id)
+    dashboard_stats_cache.invalidate(current_user.id)
+    search_indexes.drop(chatbot_id)
+    chat_router.drop(chatbot_id)
+    await run_in_threadpool(vector_store.drop, chatbot_id)
+    await run_in_threadpool(transcript_store.drop, chatbot_id)
+    return None
@@ -0,0 +1,72 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Optional
+from gotrue.types import User
+
+from app.models.conversation import ConversationSummary, TranscriptMessage
+from app.api.dependencies import get_chatbot_repository, get_current_user
+from app.api.chatbots import require_chatbot
+from app.core.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from app.core.serialization import model_list_response
+from app.db.repositories import ChatbotRepository
+from app.services.transcripts import transcript_store
+
+router = APIRouter()
+
+def _invalid_conversation() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversation not found.")
+
+@router.get("/chatbots/{chatbot_id}/conversations", response_model=List[ConversationSummary])
+async def list_conversations(
+    chatbot_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository)
+):
+    """
+    Lists a chatbot's conversations, most recently active first, one page at a
+    time. When more remain, the `X-Next-Cursor` header holds the `cursor` for
+    the next page.
+    """
+    await require_chatbot(chatbots, chatbot_id)
+    after = None
+    if cursor is not None:
+        last_at, conversation_id = decode_cursor(cursor)
+        try:
+            after = (float(last_at), conversation_id)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+    rows, next_after = await run_in_threadpool(transcript_store.list_conversations, chatbot_id, limit, after)
+    headers = {NEXT_CURSOR_HEADER: encode_cursor(repr(next_after[0]), next_after[1])} if next_after else None
+    return model_list_response(ConversationSummary, rows, headers)
+
+@router.get("/chatbots/{chatbot_id}/conversations/{conversation_id}/messages", response_model=List[TranscriptMessage])
+async def get_conversation_messages(
+    chatbot_id: str,
+    conversation_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository)
+):
+    """
+    Retrieves a conversation's transcript, newest page first; each page is in
+    chronological order. When older messages remain, the `X-Next-Cursor` header
+    holds the `cursor` for the previous page.
+    """
+    await require_chatbot(chatbots, chatbot_id)
+    before = None
+    if cursor is not None:
+        if not cursor.isdigit():
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+        before = int(cursor)
+    try:
+        page = await run_in_threadpool(transcript_store.history, chatbot_id, conversation_id, limit, before)
+    except ValueError:
+        raise _invalid_conversation()
+    if page is None:
+        raise _invalid_conversation()
+    messages, next_before = page
+    headers = {NEXT_CURSOR_HEADER: str(next_before)} if next_before is not None else None
+    return model_list_response(TranscriptMessage, messages, headers)
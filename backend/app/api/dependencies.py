@@ -1,22 +1,82 @@
+import jwt
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.db.supabase import supabase_client
+from postgrest import AsyncPostgrestClient
+from storage3 import AsyncStorageClient
+from app.db.repositories import ChatbotRepository, DocumentRepository
+from app.db.supabase import get_auth_client, get_postgrest_client, get_storage_client
+from app.core.security import token_verifier
 from gotrue.errors import AuthApiError
 
 # This scheme will extract the token from the "Authorization: Bearer <token>" header
 token_auth_scheme = HTTPBearer()
 
-def get_current_user(token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)):
+async def _get_remote_user(access_token: str):
+    """Asks Supabase Auth to validate the token. Costs a network round trip."""
+    try:
+        user_response = await get_auth_client().get_user(access_token)
+    except AuthApiError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+        )
+    if not user_response or not user_response.user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+        )
+    token_verifier.remember(access_token, user_response.user)
+    return user_response.user
+
+async def get_current_user(token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)):
+    """
+    Resolves the user from a locally verified access token. Supabase Auth is
+    only contacted when the token cannot be verified in-process.
+    """
     if not token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Authentication token is missing",
         )
+    user = token_verifier.get_cached(token.credentials)
+    if user is not None:
+        return user
     try:
-        user_response = supabase_client.auth.get_user(token.credentials)
-        return user_response.user  # ✅ Only return the user data
-    except AuthApiError:
+        # A cache miss may need to (re)fetch the JWKS, which is blocking I/O.
+        return await run_in_threadpool(token_verifier.verify, token.credentials)
+    except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired token",
         )
+    except jwt.PyJWTError:
+        return await _get_remote_user(token.credentials)
+
+async def get_current_user_strict(token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)):
+    """
+    Always validates the token with Supabase Auth, so signed-out sessions are
+    rejected immediately. Use on revocation-sensitive routes.
+    """
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication token is missing",
+        )
+    return await _get_remote_user(token.credentials)
+
+def get_db(token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)) -> AsyncPostgrestClient:
+    """PostgREST client scoped to the caller's token, so RLS applies to every query."""
+    return get_postgrest_client(token.credentials)
+
+def get_storage(token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)) -> AsyncStorageClient:
+    """Storage client scoped to the caller's token."""
+    return get_storage_client(token.credentials)
+
+def get_chatbot_repository(current_user = Depends(get_current_user), db: AsyncPostgrestClient = Depends(get_db)) -> ChatbotRepository:
+    """The caller's chatbots. FastAPI caches dependencies per request, so lookups are memoized request-wide."""
+    return ChatbotRepository(db, current_user.id)
+
+def get_document_repository(current_user = Depends(get_current_user), db: AsyncPostgrestClient = Depends(get_db)) -> DocumentRepository:
+    """The caller's documents."""
+    return DocumentRepository(db, current_user.id)
@@ -1,61 +1,130 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import HTTPAuthorizationCredentials
+from typing import Dict, List, Optional
 from gotrue.types import User
+from storage3 import AsyncStorageClient
+from urllib.parse import urlparse
+import logging
 import uuid
 
-from app.db.supabase import supabase_client
-from app.models.document import Document, DocumentCreate
-from app.api.dependencies import get_current_user
-from app.api.chatbots import check_chatbot_owner
+from app.models.document import (
+    BulkDeleteDocumentsRequest,
+    BulkDocumentResult,
+    BulkDocumentsResponse,
+    BulkUrlDocumentsRequest,
+    Document,
+    DocumentCreate,
+    DocumentRefreshResponse,
+)
+from app.api.dependencies import get_current_user, get_current_user_strict, get_document_repository, get_storage, token_auth_scheme
+from app.db.repositories import DocumentRepository
+from app.core.config import settings
+from app.core.pagination import NEXT_CURSOR_HEADER, fetch_page_or_all
+from app.core.security import is_uuid
+from app.core.serialization import model_list_response
+from app.core.uploads import hash_upload, iter_upload
+from app.db.storage import BUCKET_NAME, stream_upload
+from app.services.answer_cache import answer_cache
+from app.services.bootstrap import bootstrap_bundles
+from app.services.crawler import CrawlSession
+from app.services.ingestion import IngestionJob, ingestion_pipeline
+from app.services.search import search_indexes
+from app.services.storage_gc import storage_gc
+from app.services.vectors import vector_store
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
-token_auth_scheme = HTTPBearer()
-# **THE FIX IS HERE**
-# Update the bucket name to match what you created in Supabase
-BUCKET_NAME = "documents-storage"
+def raise_chatbot_not_found():
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot not found or you do not have permission to access it.")
+
+def ensure_ingestion_capacity(count: int = 1):
+    """Sheds new documents while the ingestion queue has no room for them."""
+    if not ingestion_pipeline.has_room_for(count):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Document processing is busy. Please try again shortly.",
+            headers={"Retry-After": "30"},
+        )
+
+def ensure_bulk_size(count: int):
+    if count > settings.BULK_DOCUMENTS_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.BULK_DOCUMENTS_MAX_ITEMS} items can be sent per request.",
+        )
+
+def batched(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def is_http_url(url: str) -> bool:
+    parsed = urlparse(url)
+    return parsed.scheme in ("http", "https") and bool(parsed.netloc)
 
 @router.get("/chatbots/{chatbot_id}/documents", response_model=List[Document], response_model_by_alias=False)
-def get_documents_for_chatbot(
+async def get_documents_for_chatbot(
     chatbot_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
-    token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)
+    documents: DocumentRepository = Depends(get_document_repository)
 ):
-    """Retrieves all documents for a specific chatbot."""
-    supabase_client.postgrest.auth(token.credentials)
-    check_chatbot_owner(chatbot_id, current_user.id)
-    
-    response = supabase_client.table('documents').select('*').eq('chatbot_id', chatbot_id).order('created_at', desc=True).execute()
-    return [Document.model_validate(item) for item in response.data]
+    """
+    Retrieves a chatbot's documents, newest first. With `limit` or `cursor` they
+    come one page at a time; when more remain, the `X-Next-Cursor` header holds
+    the `cursor` for the next page. Without either, every document is returned.
+    """
+    rows, next_cursor = await fetch_page_or_all(
+        lambda size, after: documents.list_for_chatbot(chatbot_id, size, after), limit, cursor
+    )
+    if rows is None:
+        raise_chatbot_not_found()
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return model_list_response(Document, rows, headers)
 
 @router.post("/chatbots/{chatbot_id}/documents/file", response_model=Document, status_code=status.HTTP_201_CREATED, response_model_by_alias=False)
 async def upload_document_file(
     chatbot_id: str,
+    response: Response,
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
+    documents: DocumentRepository = Depends(get_document_repository),
+    storage: AsyncStorageClient = Depends(get_storage),
     token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)
 ):
-    """Uploads a file to Supabase Storage and creates a document record."""
-    supabase_client.postgrest.auth(token.credentials)
-    check_chatbot_owner(chatbot_id, current_user.id)
-    
-    file_bytes = await file.read()
+    """
+    Streams a file to Supabase Storage and creates a document record.
+    The upload is hashed first; if the chatbot already has a document with the
+    same content, that document is returned (200) instead of storing a copy.
+    Text extraction is queued and runs in the background.
+    """
+    ensure_ingestion_capacity()
+
+    content_hash, _ = await hash_upload(file, settings.MAX_UPLOAD_SIZE_BYTES, settings.UPLOAD_CHUNK_SIZE_BYTES)
+
+    owns_chatbot, existing = await documents.find_by_hash(chatbot_id, content_hash)
+    if not owns_chatbot:
+        raise_chatbot_not_found()
+    if existing is not None:
+        response.status_code = status.HTTP_200_OK
+        return Document.model_validate(existing)
+
     file_extension = ""
     if "." in file.filename:
         file_extension = file.filename.rsplit('.', 1)[1].lower()
 
     storage_path = f"{current_user.id}/{chatbot_id}/{uuid.uuid4()}.{file_extension}"
-    
+
     try:
-        supabase_client.storage.from_(BUCKET_NAME).upload(
-            path=storage_path, 
-            file=file_bytes,
-            file_options={
-                "content-type": file.content_type,
-                "metadata": {
-                    "owner": current_user.id
-                }
-            }
+        await stream_upload(
+            storage,
+            BUCKET_NAME,
+            storage_path,
+            iter_upload(file, settings.UPLOAD_CHUNK_SIZE_BYTES),
+            content_type=file.content_type,
+            metadata={"owner": current_user.id},
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload file to storage: {e}")
@@ -64,71 +133,229 @@ async def upload_document_file(
         source_type="file",
         source_name=file.filename,
         storage_path=storage_path,
+        content_hash=content_hash,
         chatbot_id=chatbot_id,
         user_id=current_user.id
     )
-    
-    response = supabase_client.table('documents').insert(doc_data.model_dump()).execute()
-    
-    if not response.data:
-        supabase_client.storage.from_(BUCKET_NAME).remove([storage_path])
+
+    created = await documents.create(doc_data.model_dump())
+
+    if created is None:
+        await storage.from_(BUCKET_NAME).remove([storage_path])
         raise HTTPException(status_code=500, detail="Failed to create document record in database.")
-        
-    return Document.model_validate(response.data[0])
+
+    document = Document.model_validate(created)
+    await ingestion_pipeline.enqueue(IngestionJob(
+        document_id=document.id,
+        chatbot_id=chatbot_id,
+        source_type="file",
+        source_name=file.filename,
+        storage_path=storage_path,
+        bucket=BUCKET_NAME,
+        content_type=file.content_type,
+        access_token=token.credentials,
+        user_id=current_user.id,
+    ))
+    return document
 
 @router.post("/chatbots/{chatbot_id}/documents/url", response_model=Document, status_code=status.HTTP_201_CREATED, response_model_by_alias=False)
-def add_document_url(
+async def add_document_url(
     chatbot_id: str,
     url: str = Form(...),
+    depth: int = Form(0, ge=0, le=settings.CRAWLER_MAX_DEPTH),
     current_user: User = Depends(get_current_user),
+    documents: DocumentRepository = Depends(get_document_repository),
     token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)
 ):
-    """Adds a URL as a new document for a chatbot."""
-    supabase_client.postgrest.auth(token.credentials)
-    check_chatbot_owner(chatbot_id, current_user.id)
-    
+    """
+    Adds a URL as a new document for a chatbot. Its text is fetched and extracted
+    in the background. With `depth` > 0 the crawl also follows links to other
+    pages of the same site, that many levels deep, adding each as a document.
+    """
+    url = url.strip()
+    if not is_http_url(url):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not an http(s) URL.")
+    ensure_ingestion_capacity()
+
     doc_data = DocumentCreate(
         source_type="url",
         source_name=url,
         chatbot_id=chatbot_id,
         user_id=current_user.id
     )
-    
-    response = supabase_client.table('documents').insert(doc_data.model_dump()).execute()
-    
-    if not response.data:
-        raise HTTPException(status_code=500, detail="Failed to create document record.")
-        
-    return Document.model_validate(response.data[0])
+
+    # Returns None for chatbots the caller does not own.
+    created = await documents.create(doc_data.model_dump())
+
+    if created is None:
+        raise_chatbot_not_found()
+
+    document = Document.model_validate(created)
+    await ingestion_pipeline.enqueue(IngestionJob(
+        document_id=document.id,
+        chatbot_id=chatbot_id,
+        source_type="url",
+        source_name=url,
+        access_token=token.credentials,
+        user_id=current_user.id,
+        crawl=CrawlSession(url, settings.CRAWLER_MAX_PAGES) if depth else None,
+        crawl_depth=depth,
+    ))
+    return document
+
+@router.post("/chatbots/{chatbot_id}/documents/urls", response_model=BulkDocumentsResponse, response_model_by_alias=False)
+async def add_document_urls(
+    chatbot_id: str,
+    payload: BulkUrlDocumentsRequest,
+    current_user: User = Depends(get_current_user),
+    documents: DocumentRepository = Depends(get_document_repository),
+    token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)
+):
+    """
+    Adds many URLs as documents of a chatbot: one insert per batch instead of a
+    request per URL. Every URL gets a result, in request order: `created` (with
+    the new document), `invalid` (not an http(s) URL) or `duplicate` (repeated
+    earlier in the request).
+    """
+    ensure_bulk_size(len(payload.urls))
+
+    results: List[BulkDocumentResult] = []
+    pending: Dict[str, int] = {}
+    for url in payload.urls:
+        source = url.strip()
+        if not is_http_url(source):
+            results.append(BulkDocumentResult(item=url, status="invalid", detail="Not an http(s) URL."))
+        elif source in pending:
+            results.append(BulkDocumentResult(item=url, status="duplicate"))
+        else:
+            pending[source] = len(results)
+            results.append(BulkDocumentResult(item=url, status="created"))
+
+    ensure_ingestion_capacity(len(pending))
+
+    for batch in batched(list(pending), settings.BULK_DOCUMENTS_BATCH_SIZE):
+        # Returns None for chatbots the caller does not own.
+        created = await documents.create_many([
+            DocumentCreate(source_type="url", source_name=url, chatbot_id=chatbot_id, user_id=current_user.id).model_dump()
+            for url in batch
+        ])
+        if created is None:
+            raise_chatbot_not_found()
+
+        for row in created:
+            document = Document.model_validate(row)
+            results[pending[document.source_name]].document = document
+            await ingestion_pipeline.enqueue(IngestionJob(
+                document_id=document.id,
+                chatbot_id=chatbot_id,
+                source_type="url",
+                source_name=document.source_name,
+                access_token=token.credentials,
+                user_id=current_user.id,
+            ))
+    return BulkDocumentsResponse(results=results)
+
+@router.post("/chatbots/{chatbot_id}/documents/refresh", response_model=DocumentRefreshResponse, status_code=status.HTTP_202_ACCEPTED)
+async def refresh_url_documents(
+    chatbot_id: str,
+    current_user: User = Depends(get_current_user),
+    documents: DocumentRepository = Depends(get_document_repository),
+    token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)
+):
+    """
+    Re-crawls all of a chatbot's URL documents in the background. Fetches are
+    conditional on each page's `ETag` / `Last-Modified`, so pages that have not
+    changed since the last crawl are not downloaded; pages whose text has not
+    changed are not re-indexed, and changed pages only re-embed changed chunks.
+    """
+    rows = await documents.url_documents(chatbot_id)
+    if rows is None:
+        raise_chatbot_not_found()
+
+    queued = ingestion_pipeline.enqueue_later([
+        IngestionJob(
+            document_id=row["id"],
+            chatbot_id=chatbot_id,
+            source_type="url",
+            source_name=row["source_name"],
+            access_token=token.credentials,
+            user_id=current_user.id,
+            etag=row.get("etag"),
+            last_modified=row.get("last_modified"),
+            text_hash=row.get("text_hash"),
+            status=row.get("status"),
+        )
+        for row in rows
+    ], key=f"refresh:{chatbot_id}")
+    if not queued:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A refresh of this chatbot is already in progress.")
+    return DocumentRefreshResponse(queued=len(rows))
 
 
 @router.delete("/documents/{document_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_document(
+async def delete_document(
     document_id: str,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_strict),
+    documents: DocumentRepository = Depends(get_document_repository),
     token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)
 ):
-    """Deletes a document record and its corresponding file in storage."""
-    supabase_client.postgrest.auth(token.credentials)
-    
-    doc_response = supabase_client.table('documents').select('id, storage_path, user_id').eq('id', document_id).single().execute()
-    if not doc_response.data:
+    """
+    Deletes a document record. Its file is queued for removal from storage in
+    the background.
+    """
+    doc_to_delete = await documents.delete(document_id) if is_uuid(document_id) else None
+    if doc_to_delete is None:
         raise HTTPException(status_code=404, detail="Document not found.")
 
-    doc_to_delete = doc_response.data
-    
-    if doc_to_delete['user_id'] != current_user.id:
-        raise HTTPException(status_code=403, detail="Permission denied.")
-
     if doc_to_delete.get("storage_path"):
-        try:
-            supabase_client.storage.from_(BUCKET_NAME).remove([doc_to_delete["storage_path"]])
-        except Exception as e:
-            print(f"Warning: could not delete file from storage: {e}")
-
-    response = supabase_client.table('documents').delete().eq('id', document_id).execute()
-    
-    if not response.data:
-        raise HTTPException(status_code=500, detail="Failed to delete document record.")
-        
-    return None
\ No newline at end of file
+        storage_gc.enqueue([doc_to_delete["storage_path"]], token.credentials)
+
+    search_indexes.remove_document(doc_to_delete["chatbot_id"], document_id)
+    await run_in_threadpool(vector_store.remove_document, doc_to_delete["chatbot_id"], document_id)
+    bootstrap_bundles.invalidate(doc_to_delete["chatbot_id"])
+    answer_cache.invalidate(doc_to_delete["chatbot_id"])
+    return None
+
+@router.post("/documents/bulk-delete", response_model=BulkDocumentsResponse, response_model_by_alias=False)
+async def delete_documents(
+    payload: BulkDeleteDocumentsRequest,
+    current_user: User = Depends(get_current_user_strict),
+    documents: DocumentRepository = Depends(get_document_repository),
+    token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)
+):
+    """
+    Deletes many documents, one filtered delete per batch; their files are
+    queued for removal from storage in the background. Every id gets a result,
+    in request order: `deleted`, `not_found` (missing or not the caller's) or
+    `duplicate`.
+    """
+    ensure_bulk_size(len(payload.document_ids))
+
+    results: List[BulkDocumentResult] = []
+    pending: Dict[str, int] = {}
+    for document_id in payload.document_ids:
+        if document_id in pending:
+            results.append(BulkDocumentResult(item=document_id, status="duplicate"))
+        elif not is_uuid(document_id):
+            # A malformed id would fail the whole batch's query.
+            results.append(BulkDocumentResult(item=document_id, status="not_found"))
+        else:
+            pending[document_id] = len(results)
+            results.append(BulkDocumentResult(item=document_id, status="not_found"))
+
+    for batch in batched(list(pending), settings.BULK_DOCUMENTS_BATCH_SIZE):
+        deleted = await documents.delete_many(batch)
+
+        storage_gc.enqueue([row["storage_path"] for row in deleted if row.get("storage_path")], token.credentials)
+
+        by_chatbot: Dict[str, List[str]] = {}
+        for row in deleted:
+            results[pending[row["id"]]].status = "deleted"
+            by_chatbot.setdefault(row["chatbot_id"], []).append(row["id"])
+        for chatbot_id, document_ids in by_chatbot.items():
+            for document_id in document_ids:
+                search_indexes.remove_document(chatbot_id, document_id)
+            await run_in_threadpool(vector_store.remove_documents, chatbot_id, document_ids)
+            bootstrap_bundles.invalidate(chatbot_id)
+            answer_cache.invalidate(chatbot_id)
+    return BulkDocumentsResponse(results=results)
@@ -0,0 +1,180 @@
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.security import HTTPAuthorizationCredentials
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+import asyncio
+import json
+
+from app.api.dependencies import get_current_user
+from app.api.widget import authorize_widget_request
+from app.core.security import conversation_signer, is_uuid
+from app.db.supabase import get_postgrest_client
+from app.services.analytics import analytics_buffer
+from app.services.transcripts import transcript_store
+from app.services.live_chat import (
+    CLOSE_POLICY_VIOLATION,
+    CLOSE_TRY_AGAIN_LATER,
+    Connection,
+    live_chat,
+)
+
+router = APIRouter()
+
+MAX_MESSAGE_LENGTH = 2000
+
+
+def _error(detail: str) -> str:
+    return json.dumps({"type": "error", "detail": detail}, separators=(",", ":"))
+
+def _message_text(event: dict) -> Optional[str]:
+    text = event.get("text")
+    if not isinstance(text, str) or not text.strip() or len(text) > MAX_MESSAGE_LENGTH:
+        return None
+    return text
+
+async def _relay(connection: Connection, conversation_id: str, event: dict):
+    """Publishes a chat message or typing indicator from `connection` to a conversation."""
+    if event.get("type") == "message":
+        text = _message_text(event)
+        if text is None:
+            live_chat.send(connection, _error(f"Messages must be 1-{MAX_MESSAGE_LENGTH} characters."))
+            return
+        analytics_buffer.record_event(connection.chatbot_id, f"live_{connection.role}_messages")
+        await transcript_store.record(connection.chatbot_id, conversation_id, [(connection.role, text)])
+        await live_chat.publish(connection.chatbot_id, conversation_id, {
+            "type": "message",
+            "conversationId": conversation_id,
+            "from": connection.role,
+            "text": text,
+            "sentAt": datetime.now(timezone.utc).isoformat(),
+        })
+    elif event.get("type") == "typing":
+        is_typing = bool(event.get("isTyping", True))
+        if live_chat.allow_typing(connection, is_typing):
+            await live_chat.publish(connection.chatbot_id, conversation_id, {
+                "type": "typing",
+                "conversationId": conversation_id,
+                "from": connection.role,
+                "isTyping": is_typing,
+            }, exclude=connection)
+    else:
+        live_chat.send(connection, _error("Unknown event type."))
+
+async def _serve(websocket: WebSocket, connection: Connection, handle: Callable[[dict], Awaitable[None]]):
+    """Registers the connection and feeds its JSON events to `handle` until it disconnects."""
+    live_chat.register(connection)
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            live_chat.touch(connection)
+            try:
+                event = json.loads(raw)
+            except ValueError:
+                event = None
+            if not isinstance(event, dict):
+                live_chat.send(connection, _error("Events must be JSON objects."))
+                continue
+            if event.get("type") == "ping":
+                live_chat.send(connection, '{"type":"pong"}', ephemeral=True)
+            elif event.get("type") != "pong":
+                await handle(event)
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the manager already closed the socket (idle eviction, slow consumer).
+        pass
+    finally:
+        live_chat.unregister(connection)
+
+
+@router.websocket("/widget/{bot_id}/live")
+async def visitor_live_chat(
+    websocket: WebSocket,
+    bot_id: str,
+    conversation_id: Optional[str] = None,
+    conversation_token: Optional[str] = None,
+):
+    """
+    Live chat socket for a widget visitor. Subject to the same origin check as the
+    widget config; a visitor belongs to exactly one conversation. A new
+    conversation is started unless the visitor rejoins one with the id and
+    token from its `ready` event.
+    """
+    try:
+        _, config_data, _ = await authorize_widget_request(bot_id, websocket)
+    except HTTPException:
+        await websocket.close(code=CLOSE_POLICY_VIOLATION)
+        return
+    if conversation_id and not conversation_signer.verify(bot_id, conversation_id, conversation_token):
+        await websocket.close(code=CLOSE_POLICY_VIOLATION)
+        return
+    if live_chat.is_full:
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+        return
+
+    await websocket.accept()
+    if not conversation_id:
+        conversation_id, conversation_token = conversation_signer.issue(bot_id)
+        analytics_buffer.record_conversation(bot_id)
+    connection = Connection(websocket, "visitor", bot_id, conversation_id, config_data.get("enableTyping") is not False)
+    live_chat.send(connection, json.dumps({
+        "type": "ready",
+        "conversationId": conversation_id,
+        "conversationToken": conversation_token,
+    }))
+
+    async def handle(event: dict):
+        await _relay(connection, conversation_id, event)
+
+    await live_chat.publish(bot_id, conversation_id, {
+        "type": "presence",
+        "conversationId": conversation_id,
+        "conversationToken": conversation_token,
+        "status": "joined",
+    }, exclude=connection)
+    await _serve(websocket, connection, handle)
+    await live_chat.publish(bot_id, conversation_id, {"type": "presence", "conversationId": conversation_id, "status": "left"})
+
+
+@router.websocket("/chatbots/{chatbot_id}/live")
+async def agent_live_chat(websocket: WebSocket, chatbot_id: str, token: str):
+    """
+    Live chat socket for the chatbot's owner. Browsers cannot set headers on a
+    WebSocket, so the access token is passed as the `token` query parameter.
+    The agent receives every conversation of the chatbot and replies by
+    `conversationId`, which must be one this server issued: either with the
+    `conversationToken` of the visitor's `joined` event, or to a conversation
+    that already has a transcript.
+    """
+    try:
+        current_user = await get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+    except HTTPException:
+        await websocket.close(code=CLOSE_POLICY_VIOLATION)
+        return
+    # PostgREST rejects a malformed uuid with an error rather than no rows.
+    if not is_uuid(chatbot_id):
+        await websocket.close(code=CLOSE_POLICY_VIOLATION)
+        return
+
+    response = await get_postgrest_client(token).table('chatbots').select('id, enable_typing').eq('id', chatbot_id).eq('user_id', current_user.id).execute()
+    if not response.data:
+        await websocket.close(code=CLOSE_POLICY_VIOLATION)
+        return
+    if live_chat.is_full:
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+        return
+
+    await websocket.accept()
+    connection = Connection(websocket, "agent", chatbot_id, None, response.data[0].get("enable_typing") is not False)
+
+    async def handle(event: dict):
+        conversation_id = event.get("conversationId")
+        if not isinstance(conversation_id, str) or not conversation_id:
+            live_chat.send(connection, _error("conversationId is required."))
+            return
+        if not conversation_signer.verify(chatbot_id, conversation_id, event.get("conversationToken")) and not (
+            is_uuid(conversation_id) and await asyncio.to_thread(transcript_store.exists, chatbot_id, conversation_id)
+        ):
+            live_chat.send(connection, _error("Conversation not found."))
+            return
+        await _relay(connection, conversation_id, event)
+
+    await _serve(websocket, connection, handle)
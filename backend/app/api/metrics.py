@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from typing import Optional
+import secrets
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_bearer = HTTPBearer(auto_error=False)
+
+def require_metrics_token(credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)):
+    """The metrics routes only exist when METRICS_TOKEN is configured, and require it."""
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not secrets.compare_digest(credentials.credentials, settings.METRICS_TOKEN):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="A valid metrics token is required.")
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+async def get_metrics():
+    """Request, upstream and component metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@router.get("/metrics/slow", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+async def get_slow_requests():
+    """The slowest sampled requests, slowest first, with the Supabase calls each made."""
+    if metrics.slow_request_seconds is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Slow request sampling is disabled (set METRICS_SLOW_REQUEST_SECONDS).")
+    return {"thresholdSeconds": metrics.slow_request_seconds, "requests": metrics.slowest_requests()}
@@ -0,0 +1,125 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List
+from gotrue.types import User
+
+from app.models.routing import AgentState, AgentUpdate, RoutingAssignment, RoutingRequest, RoutingSnapshot
+from app.api.dependencies import get_chatbot_repository, get_current_user
+from app.api.chatbots import require_chatbot
+from app.core.config import settings
+from app.db.repositories import ChatbotRepository
+from app.services.live_chat import live_chat
+from app.services.routing import Agent, Assignment, chat_router
+
+def require_routing_enabled():
+    """Routing is disabled in multi-worker deployments, since its state is per process."""
+    if not settings.ROUTING_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Routing is not enabled.")
+
+router = APIRouter(dependencies=[Depends(require_routing_enabled)])
+
+def _agent_state(agent: Agent) -> AgentState:
+    return AgentState(
+        id=agent.id,
+        departments=list(agent.departments),
+        capacity=agent.capacity,
+        status=agent.status,
+        load=agent.load,
+        activeConversations=sorted(agent.conversations),
+    )
+
+async def _announce(chatbot_id: str, assignments: List[Assignment]):
+    """Tells the visitor and the chatbot's agents which agent took each conversation."""
+    for assignment in assignments:
+        await live_chat.publish(chatbot_id, assignment.conversation_id, {
+            "type": "assigned",
+            "conversationId": assignment.conversation_id,
+            "agentId": assignment.agent_id,
+        })
+
+@router.get("/chatbots/{chatbot_id}/routing", response_model=RoutingSnapshot)
+async def get_routing(
+    chatbot_id: str,
+    current_user: User = Depends(get_current_user),
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository)
+):
+    """
+    Retrieves the chatbot's agents with their current load, and how many
+    conversations wait in each department.
+    """
+    await require_chatbot(chatbots, chatbot_id)
+    return RoutingSnapshot(
+        agents=[_agent_state(agent) for agent in chat_router.agents(chatbot_id)],
+        waiting=chat_router.waiting_by_department(chatbot_id),
+    )
+
+@router.put("/chatbots/{chatbot_id}/routing/agents/{agent_id}", response_model=AgentState)
+async def set_routing_agent(
+    chatbot_id: str,
+    agent_id: str,
+    update: AgentUpdate,
+    current_user: User = Depends(get_current_user),
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository)
+):
+    """
+    Adds an agent to the chatbot's routing, or changes its departments, capacity
+    or status. An agent coming online picks up waiting conversations at once;
+    an agent going offline hands its conversations back to be rerouted.
+    """
+    await require_chatbot(chatbots, chatbot_id)
+    assignments = chat_router.set_agent(chatbot_id, agent_id, update.departments, update.capacity, update.status)
+    await _announce(chatbot_id, assignments)
+    return _agent_state(chat_router.agent(chatbot_id, agent_id))
+
+@router.delete("/chatbots/{chatbot_id}/routing/agents/{agent_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def remove_routing_agent(
+    chatbot_id: str,
+    agent_id: str,
+    current_user: User = Depends(get_current_user),
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository)
+):
+    """
+    Removes an agent from the chatbot's routing; its conversations are rerouted.
+    """
+    await require_chatbot(chatbots, chatbot_id)
+    assignments = chat_router.remove_agent(chatbot_id, agent_id)
+    if assignments is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agent not found.")
+    await _announce(chatbot_id, assignments)
+    return None
+
+@router.post("/chatbots/{chatbot_id}/routing/conversations", response_model=RoutingAssignment)
+async def route_conversation(
+    chatbot_id: str,
+    request: RoutingRequest,
+    current_user: User = Depends(get_current_user),
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository)
+):
+    """
+    Hands a conversation to the least loaded available agent of its department,
+    or queues it until one is free. Waiting conversations are served by how
+    long they have waited, boosted by priority and the visitor's plan.
+    """
+    await require_chatbot(chatbots, chatbot_id)
+    assignment = chat_router.enqueue(chatbot_id, request.conversationId, request.department, request.priority, request.plan)
+    if assignment is None:
+        return RoutingAssignment(conversationId=request.conversationId, status="waiting")
+    await _announce(chatbot_id, [assignment])
+    return RoutingAssignment(conversationId=request.conversationId, status="assigned", agentId=assignment.agent_id)
+
+@router.delete("/chatbots/{chatbot_id}/routing/conversations/{conversation_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def release_conversation(
+    chatbot_id: str,
+    conversation_id: str,
+    current_user: User = Depends(get_current_user),
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository)
+):
+    """
+    Ends a routed conversation, or withdraws it from its queue. Its agent picks
+    up the next waiting conversation.
+    """
+    await require_chatbot(chatbots, chatbot_id)
+    assignments = chat_router.release(chatbot_id, conversation_id)
+    if assignments is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversation is not being routed.")
+    await _announce(chatbot_id, assignments)
+    return None
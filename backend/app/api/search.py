@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from typing import Literal
+from gotrue.types import User
+from postgrest import AsyncPostgrestClient
+
+from app.models.search import SearchResponse, SearchResult
+from app.api.dependencies import get_chatbot_repository, get_current_user, get_db
+from app.api.chatbots import require_chatbot
+from app.db.repositories import ChatbotRepository
+from app.services.search import search_indexes
+from app.services.vectors import vector_store
+
+router = APIRouter()
+
+@router.get("/chatbots/{chatbot_id}/search", response_model=SearchResponse)
+async def search_chatbot_knowledge_base(
+    chatbot_id: str,
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(5, ge=1, le=50),
+    mode: Literal["lexical", "semantic"] = "lexical",
+    current_user: User = Depends(get_current_user),
+    chatbots: ChatbotRepository = Depends(get_chatbot_repository),
+    db: AsyncPostgrestClient = Depends(get_db)
+):
+    """
+    Ranks the chunks of a chatbot's processed documents against the query, with
+    BM25 (`lexical`) or by embedding similarity (`semantic`).
+    """
+    await require_chatbot(chatbots, chatbot_id)
+
+    if mode == "semantic":
+        hits = await run_in_threadpool(vector_store.search, chatbot_id, q, limit)
+    else:
+        index = await search_indexes.get(chatbot_id, db)
+        hits = index.search(q, limit)
+    return SearchResponse(
+        query=q,
+        mode=mode,
+        results=[
+            SearchResult(documentId=hit.document_id, chunkIndex=hit.chunk_index, text=hit.text, score=hit.score)
+            for hit in hits
+        ],
+    )
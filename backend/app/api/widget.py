@@ -1,11 +1,31 @@
-from fastapi import APIRouter, HTTPException, status, Request
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+from starlette.requests import HTTPConnection
+from postgrest.exceptions import APIError
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from urllib.parse import urlparse 
+import hashlib
+import json
+import logging
+import time
+import uuid
 
 # Import the new public client
-from app.db.supabase import supabase_public_client
+from app.db.supabase import get_postgrest_client
+from app.core.admission import admit_widget_request
+from app.core.cache import widget_config_cache
+from app.core.config import settings
+from app.core.security import conversation_signer
+from app.services.answer_cache import answer_cache
+from app.services.answers import compose_answer, retrieve_passages, stream_text
+from app.services.analytics import analytics_buffer
+from app.services.bootstrap import Bundle, bootstrap_bundles, choose_encoding, version_revision, widget_config_data
+from app.services.stats import record_rating
+from app.services.transcripts import transcript_store
+from app.services.vectors import vector_store
 
+logger = logging.getLogger(__name__)
 
 class WidgetConfigResponse(BaseModel):
     name: str
@@ -18,16 +38,64 @@ class WidgetConfigResponse(BaseModel):
     enableTyping: Optional[bool]
     initialMessages: Optional[List[str]]
 
-router = APIRouter()
+class WidgetMessageRequest(BaseModel):
+    message: str = Field(..., min_length=1, max_length=2000)
+    conversationId: Optional[str] = None
+    conversationToken: Optional[str] = Field(None, max_length=100)
 
-@router.get("/widget/{bot_id}/config", response_model=WidgetConfigResponse)
-def get_widget_config(bot_id: str, request: Request):
+class WidgetRatingRequest(BaseModel):
+    conversationId: str = Field(..., min_length=1, max_length=100)
+    conversationToken: str = Field(..., min_length=1, max_length=100)
+    rating: int = Field(..., ge=1, le=5)
+
+router = APIRouter(dependencies=[Depends(admit_widget_request)])
+
+WIDGET_CONFIG_COLUMNS = "name, greeting, placeholder, primary_color, position, size, show_avatar, enable_typing, allowed_domain, initial_messages"
+
+async def _load_widget_config(bot_id: str):
     """
-    Public endpoint for the widget.js script to fetch a chatbot's configuration.
-    It performs a security check against the whitelisted domain.
-    This endpoint uses a separate, unauthenticated Supabase client.
+    Returns `(allowed_domain, config_data, etag)` for an active chatbot, served from
+    the in-process cache when possible. Returns None if no active chatbot exists.
     """
+    cached = widget_config_cache.get(bot_id)
+    if cached is not None:
+        return cached
+
+    # ** THE FIX IS HERE **
+    # Use an unauthenticated (anon key) client for this query.
+    response = await (
+        get_postgrest_client().table('chatbots')
+        .select(WIDGET_CONFIG_COLUMNS)
+        .eq('id', bot_id)
+        .eq('status', 'active')
+        .limit(1)
+        .execute()
+    )
+
+    # `.single()` would raise for a missing bot instead of letting us answer 404.
+    if not response.data:
+        return None
+
+    chatbot = response.data[0]
+    config_data = widget_config_data(chatbot)
+    digest = hashlib.sha256(json.dumps(config_data, sort_keys=True).encode()).hexdigest()
+    entry = (chatbot.get("allowed_domain"), config_data, f'"{digest[:32]}"')
+    widget_config_cache.set(bot_id, entry)
+    return entry
 
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+async def authorize_widget_request(bot_id: str, request: HTTPConnection):
+    """
+    Loads an active chatbot's widget config and checks the calling page against
+    its `allowed_domain`, using the Origin header or, failing that, the Referer.
+    Returns the `(allowed_domain, config_data, etag)` entry.
+    """
     origin = request.headers.get("origin")
     referer = request.headers.get("referer")
 
@@ -45,37 +113,186 @@ def get_widget_config(bot_id: str, request: Request):
             request_domain = request_domain[4:]
     except:
         request_domain = None
-    
-    # ** THE FIX IS HERE **
-    # Use the dedicated public client for this query.
-    response = (
-        supabase_public_client.table('chatbots')
-        .select("name, greeting, placeholder, primary_color, position, size, show_avatar, enable_typing, allowed_domain, initial_messages")
-        .eq('id', bot_id)
-        .eq('status', 'active')
-        .single()
-        .execute()
-    )
 
-    if not response.data:
+    entry = await _load_widget_config(bot_id)
+    if entry is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Active chatbot not found.")
 
-    chatbot = response.data
-    
-    if chatbot.get("allowed_domain") and chatbot["allowed_domain"].strip() != "":
-        if not request_domain or request_domain != chatbot["allowed_domain"].strip():
+    allowed_domain = entry[0]
+    if allowed_domain and allowed_domain.strip() != "":
+        if not request_domain or request_domain != allowed_domain.strip():
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="This chatbot is not authorized for this domain.")
-        
-    config_data = {
-        "name": chatbot.get("name"),
-        "greeting": chatbot.get("greeting"),
-        "placeholder": chatbot.get("placeholder"),
-        "primaryColor": chatbot.get("primary_color"),
-        "position": chatbot.get("position"),
-        "size": chatbot.get("size"),
-        "showAvatar": chatbot.get("show_avatar"),
-        "enableTyping": chatbot.get("enable_typing"),
-        "initialMessages": chatbot.get("initial_messages", [])
+
+    return entry
+
+@router.get("/widget/{bot_id}/config", response_model=WidgetConfigResponse)
+async def get_widget_config(bot_id: str, request: Request, response: Response):
+    """
+    Public endpoint for the widget.js script to fetch a chatbot's configuration.
+    It performs a security check against the whitelisted domain.
+    This endpoint uses an unauthenticated Supabase client.
+    Config rows are cached in-process and responses carry an ETag, so repeat
+    visitors can be answered with a 304 without touching the database.
+    """
+    _, config_data, etag = await authorize_widget_request(bot_id, request)
+
+    cache_headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.WIDGET_CONFIG_MAX_AGE_SECONDS}",
+        "Vary": "Origin, Referer",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+
+    response.headers.update(cache_headers)
+    return WidgetConfigResponse(**config_data)
+
+def _bundle_response(bot_id: str, bundle: Bundle, request: Request, cache_control: str) -> Response:
+    etag = f'"{bundle.version}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Content-Location": f"/api/widget/{bot_id}/bootstrap/{bundle.version}",
+        "Vary": "Accept-Encoding, Origin, Referer",
     }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    encoding = choose_encoding(request.headers.get("accept-encoding"), bundle.bodies)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(bundle.bodies[encoding], media_type="application/json", headers=headers)
+
+async def _authorized_bundle(bot_id: str, request: Request) -> Bundle:
+    await authorize_widget_request(bot_id, request)
+    bundle = await bootstrap_bundles.get(bot_id)
+    if bundle is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Active chatbot not found.")
+    return bundle
+
+@router.get("/widget/{bot_id}/bootstrap")
+async def get_widget_bootstrap(bot_id: str, request: Request):
+    """
+    Everything the widget needs to start in one response: its config and the
+    precomputed answers to the chatbot's FAQ questions. The body is stored
+    pre-serialized and pre-compressed and is served in the best encoding the
+    client accepts. This URL is cached briefly; `Content-Location` names the
+    immutable, versioned URL of the same bundle.
+    """
+    bundle = await _authorized_bundle(bot_id, request)
+    return _bundle_response(bot_id, bundle, request, f"public, max-age={settings.BOOTSTRAP_MAX_AGE_SECONDS}")
+
+@router.get("/widget/{bot_id}/bootstrap/{version}")
+async def get_widget_bootstrap_version(bot_id: str, version: str, request: Request):
+    """
+    A specific version of the bootstrap bundle, cacheable forever. A version
+    that is no longer current redirects to the current one. A version this
+    worker does not have yet, from a save handled by another worker, is
+    loaded from the database first; the redirect never goes to an older
+    revision than the one asked for.
+    """
+    bundle = await _authorized_bundle(bot_id, request)
+    requested = version_revision(version)
+    if version != bundle.version and requested is not None and requested >= bundle.revision:
+        bundle = await bootstrap_bundles.reload(bot_id)
+        if bundle is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Active chatbot not found.")
+    if version != bundle.version:
+        if requested is not None and requested > bundle.revision:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="This version of the bootstrap bundle is not available yet.",
+                headers={"Retry-After": "1", "Cache-Control": "no-store"},
+            )
+        return RedirectResponse(
+            f"/api/widget/{bot_id}/bootstrap/{bundle.version}",
+            status_code=status.HTTP_302_FOUND,
+            headers={"Cache-Control": "no-cache"},
+        )
+    return _bundle_response(bot_id, bundle, request, "public, max-age=31536000, immutable")
 
-    return WidgetConfigResponse(**config_data)
\ No newline at end of file
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/widget/{bot_id}/messages")
+async def post_widget_message(bot_id: str, message: WidgetMessageRequest, request: Request):
+    """
+    Public endpoint for the widget to ask a question. The answer is streamed as
+    Server-Sent Events: `start` goes out before any retrieval so the widget can
+    show progress at once, followed by `sources`, a series of `token` events
+    carrying the answer text, and `done`. Work stops as soon as the visitor
+    disconnects. Repeated (or nearly identical) questions are answered from
+    the per-chatbot answer cache. The question and answer are added to the
+    conversation's transcript. A conversation is continued by passing the
+    `conversationId` and `conversationToken` of its `start` event; anything
+    else is 404.
+    """
+    await authorize_widget_request(bot_id, request)
+
+    message_id = str(uuid.uuid4())
+    if message.conversationId:
+        if not conversation_signer.verify(bot_id, message.conversationId, message.conversationToken):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversation not found.")
+        conversation_id, conversation_token = message.conversationId, message.conversationToken
+    else:
+        conversation_id, conversation_token = conversation_signer.issue(bot_id)
+
+    async def events():
+        yield _sse("start", {"messageId": message_id, "conversationId": conversation_id, "conversationToken": conversation_token})
+        if not message.conversationId:
+            analytics_buffer.record_conversation(bot_id)
+        analytics_buffer.record_event(bot_id, "messages")
+        knowledge = vector_store.version(bot_id)
+        cached = answer_cache.lookup(bot_id, message.message, knowledge)
+        if cached is not None:
+            sources, answer = cached.sources, cached.answer
+        else:
+            generation = answer_cache.generation(bot_id)
+            started = time.perf_counter()
+            try:
+                passages = await retrieve_passages(bot_id, message.message, settings.WIDGET_ANSWER_PASSAGES)
+            except Exception as e:
+                logger.error("Retrieval for chatbot %s failed: %s", bot_id, e)
+                yield _sse("error", {"detail": "Could not generate an answer."})
+                return
+            sources = [{"documentId": p.document_id, "chunkIndex": p.chunk_index, "score": p.score} for p in passages]
+            answer = compose_answer(message.message, passages, settings.WIDGET_ANSWER_MAX_SENTENCES)
+            answer_cache.store(bot_id, generation, knowledge, message.message, answer, sources, time.perf_counter() - started)
+        await transcript_store.record(bot_id, conversation_id, [("visitor", message.message), ("bot", answer)])
+
+        if await request.is_disconnected():
+            return
+        if not sources:
+            analytics_buffer.record_event(bot_id, "unanswered")
+        yield _sse("sources", sources)
+
+        for piece in stream_text(answer, settings.WIDGET_ANSWER_WORDS_PER_EVENT):
+            if await request.is_disconnected():
+                logger.info("Visitor disconnected from message %s; stopping.", message_id)
+                return
+            yield _sse("token", {"text": piece})
+        yield _sse("done", {"messageId": message_id})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.post("/widget/{bot_id}/ratings", status_code=status.HTTP_204_NO_CONTENT)
+async def rate_widget_conversation(bot_id: str, rating: WidgetRatingRequest, request: Request):
+    """
+    Public endpoint for the widget to record a visitor's 1-5 rating of a
+    conversation. Ratings feed the dashboard's satisfaction rate. Only
+    conversations this server started can be rated, identified by the id and
+    token from the `start` event of their first message.
+    """
+    await authorize_widget_request(bot_id, request)
+    if not conversation_signer.verify(bot_id, rating.conversationId, rating.conversationToken):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversation not found.")
+    try:
+        await record_rating(bot_id, rating.conversationId, rating.rating)
+    except APIError as e:
+        logger.error("Could not record a rating for chatbot %s: %s", bot_id, e)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not record rating.")
+    return None
@@ -0,0 +1,214 @@
+"""
+Admission control for the public widget routes.
+
+The widget endpoints are unauthenticated, so they are protected in two ways:
+
+- Rate limits: a token bucket per bot id and one per calling origin
+  (hostname of the Origin or Referer header; callers sending neither are
+  keyed by their client address). Buckets live in a size-bounded LRU map, so idle keys are
+  evicted; an evicted bucket simply starts full again. Exceeding a bucket is
+  answered with 429 and a `Retry-After` for when a token will be available.
+- Load shedding: while too many widget requests are in flight, or their
+  recent latency is above a threshold, new requests get 503 and a
+  `Retry-After`. Bots listed in `ADMISSION_PRIORITY_BOTS` skip both the
+  shedding (up to a reserved number of extra in-flight requests) and their
+  per-bot bucket, so protected customers keep working during an incident.
+
+Requests are admitted by a router dependency and released by
+`AdmissionMiddleware` once the response has been sent in full. A yield
+dependency's exit runs before a streamed body goes out, so releasing there
+would leave the Server-Sent Events answers out of `in_flight` and the latency
+average.
+
+Everything runs on the event loop with no awaits between reading and
+updating state, so checks need no locks.
+"""
+import math
+import time
+from collections import OrderedDict
+from typing import Iterable
+from urllib.parse import urlparse
+
+from fastapi import HTTPException, Request, status
+
+from app.core.config import settings
+
+
+class TokenBuckets:
+    """Token buckets keyed by string, bounded to `maxsize` keys (least recently used evicted first)."""
+
+    def __init__(self, rate: float, burst: float, maxsize: int):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        # key -> (tokens, last refill time)
+        self._buckets: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
+
+    def take(self, key: str, now: float) -> float:
+        """Takes a token for `key`. Returns 0 if one was available, else seconds until one will be."""
+        entry = self._buckets.get(key)
+        if entry is None:
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, entry[0] + (now - entry[1]) * self.rate)
+            self._buckets.move_to_end(key)
+
+        if tokens >= 1.0:
+            self._buckets[key] = (tokens - 1.0, now)
+            wait = 0.0
+        else:
+            self._buckets[key] = (tokens, now)
+            wait = (1.0 - tokens) / self.rate
+
+        if len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        bot_rate: float,
+        bot_burst: float,
+        origin_rate: float,
+        origin_burst: float,
+        max_buckets: int,
+        max_in_flight: int,
+        priority_reserve: int,
+        latency_threshold: float,
+        shed_retry_after: int,
+        priority_bots: Iterable[str] = (),
+    ):
+        self.bots = TokenBuckets(bot_rate, bot_burst, max_buckets)
+        self.origins = TokenBuckets(origin_rate, origin_burst, max_buckets)
+        self.max_in_flight = max_in_flight
+        self.priority_reserve = priority_reserve
+        self.latency_threshold = latency_threshold
+        self.shed_retry_after = shed_retry_after
+        self.priority_bots = frozenset(priority_bots)
+        self.in_flight = 0
+        self._latency = 0.0
+        self._latency_at = time.monotonic()
+        self.admitted = 0
+        self.rate_limited = 0
+        self.shed = 0
+
+    def latency(self, now: float) -> float:
+        """
+        Moving average of request latency. It halves for every second without
+        samples, so shedding cannot lock itself in by starving the average.
+        """
+        return self._latency * 0.5 ** (now - self._latency_at)
+
+    def overloaded(self, now: float) -> bool:
+        return self.in_flight >= self.max_in_flight or self.latency(now) > self.latency_threshold
+
+    def _reject(self, status_code: int, retry_after: float, detail: str):
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def admit(self, bot_id: str, origin: str) -> float:
+        """Admits a request or raises 429/503. Returns the admission time, to pass to `release`."""
+        now = time.monotonic()
+        priority = bot_id in self.priority_bots
+
+        if priority:
+            if self.in_flight >= self.max_in_flight + self.priority_reserve:
+                self.shed += 1
+                self._reject(status.HTTP_503_SERVICE_UNAVAILABLE, self.shed_retry_after, "The service is busy. Please try again shortly.")
+        elif self.overloaded(now):
+            self.shed += 1
+            self._reject(status.HTTP_503_SERVICE_UNAVAILABLE, self.shed_retry_after, "The service is busy. Please try again shortly.")
+
+        wait = self.origins.take(origin, now)
+        if not wait and not priority:
+            wait = self.bots.take(bot_id, now)
+        if wait:
+            self.rate_limited += 1
+            self._reject(status.HTTP_429_TOO_MANY_REQUESTS, wait, "Too many requests. Please slow down.")
+
+        self.admitted += 1
+        self.in_flight += 1
+        return now
+
+    def release(self, admitted_at: float) -> None:
+        now = time.monotonic()
+        self.in_flight -= 1
+        self._latency = self.latency(now) * 0.9 + (now - admitted_at) * 0.1
+        self._latency_at = now
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "latency_seconds": self.latency(time.monotonic()),
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "shed": self.shed,
+            "bot_buckets": len(self.bots),
+            "origin_buckets": len(self.origins),
+        }
+
+
+def request_origin(request: Request) -> str:
+    """
+    The calling page's hostname from Origin or Referer. Callers with neither
+    are keyed by client address, so they do not all share one bucket.
+    """
+    source = request.headers.get("origin")
+    if not source or source == "null":
+        source = request.headers.get("referer")
+    try:
+        hostname = urlparse(source).hostname if source else None
+    except ValueError:
+        hostname = None
+    if hostname:
+        return hostname
+    return f"client:{request.client.host}" if request.client else ""
+
+
+widget_admission = AdmissionController(
+    bot_rate=settings.ADMISSION_BOT_RATE,
+    bot_burst=settings.ADMISSION_BOT_BURST,
+    origin_rate=settings.ADMISSION_ORIGIN_RATE,
+    origin_burst=settings.ADMISSION_ORIGIN_BURST,
+    max_buckets=settings.ADMISSION_MAX_BUCKETS,
+    max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+    priority_reserve=settings.ADMISSION_PRIORITY_RESERVE,
+    latency_threshold=settings.ADMISSION_LATENCY_THRESHOLD_SECONDS,
+    shed_retry_after=settings.ADMISSION_RETRY_AFTER_SECONDS,
+    priority_bots=settings.ADMISSION_PRIORITY_BOTS,
+)
+
+
+# Request state key holding the admission time of an admitted widget request.
+ADMITTED_AT_STATE = "widget_admitted_at"
+
+
+async def admit_widget_request(request: Request):
+    """Router dependency: admits the request for its `bot_id` and origin. `AdmissionMiddleware` releases it."""
+    admitted_at = widget_admission.admit(request.path_params.get("bot_id", ""), request_origin(request))
+    setattr(request.state, ADMITTED_AT_STATE, admitted_at)
+
+
+class AdmissionMiddleware:
+    """Releases admitted requests after the last byte of their response, streamed or not, has been sent."""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admitted_at = scope.get("state", {}).get(ADMITTED_AT_STATE)
+            if admitted_at is not None:
+                self.controller.release(admitted_at)
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from app.core.config import settings
+
+
+class TTLCache:
+    """
+    A size-bounded LRU cache whose entries expire after a time-to-live.
+
+    Every entry carries its own expiry, so callers can either rely on the
+    cache-wide default `ttl` or pass an explicit `expires_at` (e.g. the `exp`
+    claim of a token). Hit and miss counters are kept for diagnostics.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, expires_at: Optional[float] = None) -> None:
+        if expires_at is None:
+            if self.ttl is None:
+                raise ValueError("An explicit expiry is required when the cache has no default TTL.")
+            expires_at = time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+# Projected `chatbots` rows served by the public widget config endpoint, keyed by bot id.
+widget_config_cache = TTLCache(
+    maxsize=settings.WIDGET_CONFIG_CACHE_SIZE,
+    ttl=settings.WIDGET_CONFIG_CACHE_TTL_SECONDS,
+)
+
+# Dashboard stats per user id. Short-lived: the rollup row is already O(1) to read.
+dashboard_stats_cache = TTLCache(
+    maxsize=settings.DASHBOARD_STATS_CACHE_SIZE,
+    ttl=settings.DASHBOARD_STATS_CACHE_TTL_SECONDS,
+)
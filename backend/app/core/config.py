@@ -1,10 +1,192 @@
+from typing import Dict, List, Literal, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     SUPABASE_URL: str
     SUPABASE_KEY: str
+    # Used by background jobs that run after the caller's request has finished.
+    # Without it they fall back to the token of the user who queued them, and
+    # widget analytics are not recorded.
+    SUPABASE_SERVICE_ROLE_KEY: Optional[str] = None
+
+    # Pooled HTTP connections to Supabase (PostgREST, Storage and Auth)
+    SUPABASE_MAX_CONNECTIONS: int = 200
+    SUPABASE_MAX_KEEPALIVE_CONNECTIONS: int = 100
+    SUPABASE_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    SUPABASE_TIMEOUT_SECONDS: float = 20.0
+
+    # Local access-token verification. Legacy projects sign with the shared
+    # HS256 JWT secret; newer ones publish asymmetric keys at the JWKS endpoint.
+    SUPABASE_JWT_SECRET: Optional[str] = None
+    SUPABASE_JWT_AUDIENCE: str = "authenticated"
+    JWKS_CACHE_TTL_SECONDS: int = 600
+    AUTH_TOKEN_CACHE_SIZE: int = 4096
+
+    # Signs the conversation ids handed to widget visitors. Falls back to a key
+    # derived from SUPABASE_JWT_SECRET; without either, a random key is used
+    # and ids stop verifying after a restart or in another worker.
+    CONVERSATION_SECRET: Optional[str] = None
+
+    # Metrics. `/metrics` requires `Authorization: Bearer <METRICS_TOKEN>`, and
+    # answers 404 while no token is set. Requests slower than METRICS_SLOW_REQUEST_SECONDS are sampled
+    # with their Supabase calls for `/metrics/slow`; unset turns sampling off.
+    METRICS_TOKEN: Optional[str] = None
+    METRICS_SLOW_REQUEST_SECONDS: Optional[float] = None
+    METRICS_SLOW_REQUEST_SAMPLES: int = 50
+
+    # Public widget config caching
+    WIDGET_CONFIG_CACHE_TTL_SECONDS: int = 60
+    WIDGET_CONFIG_CACHE_SIZE: int = 10000
+    WIDGET_CONFIG_MAX_AGE_SECONDS: int = 60
+
+    # Widget bootstrap bundles: config plus precomputed answers to up to
+    # BOOTSTRAP_MAX_FAQS FAQ questions, rebuilt when the chatbot is saved.
+    # The unversioned URL is cached by browsers for BOOTSTRAP_MAX_AGE_SECONDS;
+    # versioned URLs are immutable. Other workers pick up a save within
+    # BOOTSTRAP_TTL_SECONDS, the same as the widget config cache.
+    BOOTSTRAP_CACHE_SIZE: int = 10000
+    BOOTSTRAP_TTL_SECONDS: int = 60
+    BOOTSTRAP_MAX_AGE_SECONDS: int = 60
+    BOOTSTRAP_MAX_FAQS: int = 10
+
+    # Admission control for the public widget routes: token buckets (requests
+    # per second and burst) per bot and per calling origin, and load shedding
+    # while too many widget requests are in flight or they are too slow.
+    # Priority bots (a JSON list of ids) skip shedding, up to the reserve.
+    ADMISSION_BOT_RATE: float = 50.0
+    ADMISSION_BOT_BURST: float = 100.0
+    ADMISSION_ORIGIN_RATE: float = 20.0
+    ADMISSION_ORIGIN_BURST: float = 40.0
+    ADMISSION_MAX_BUCKETS: int = 100000
+    ADMISSION_MAX_IN_FLIGHT: int = 500
+    ADMISSION_PRIORITY_RESERVE: int = 100
+    ADMISSION_LATENCY_THRESHOLD_SECONDS: float = 2.0
+    ADMISSION_RETRY_AFTER_SECONDS: int = 5
+    ADMISSION_PRIORITY_BOTS: List[str] = []
+
+    # Document uploads
+    MAX_UPLOAD_SIZE_BYTES: int = 50 * 1024 * 1024
+    UPLOAD_CHUNK_SIZE_BYTES: int = 1024 * 1024
+
+    # Background document ingestion
+    INGESTION_QUEUE_SIZE: int = 1000
+    INGESTION_CONCURRENCY: int = 8
+    INGESTION_PROCESSES: int = 2
+    INGESTION_MAX_RETRIES: int = 3
+    INGESTION_RETRY_BACKOFF_SECONDS: float = 2.0
+    INGESTION_JOB_TIMEOUT_SECONDS: float = 120.0
+
+    # URL crawling. Fetches are bounded overall and per host; links and
+    # redirects are only followed within the starting site, up to the
+    # requested depth. Hosts resolving to loopback, private or link-local
+    # addresses are refused unless CRAWLER_ALLOW_PRIVATE_ADDRESSES is set.
+    CRAWLER_MAX_CONCURRENCY: int = 32
+    CRAWLER_PER_HOST_CONCURRENCY: int = 4
+    CRAWLER_MAX_DEPTH: int = 3
+    CRAWLER_MAX_PAGES: int = 5000
+    CRAWLER_TIMEOUT_SECONDS: float = 30.0
+    CRAWLER_ALLOW_PRIVATE_ADDRESSES: bool = False
+
+    # Bulk document endpoints: items accepted per request, and rows per
+    # insert, delete and storage removal.
+    BULK_DOCUMENTS_MAX_ITEMS: int = 500
+    BULK_DOCUMENTS_BATCH_SIZE: int = 100
+
+    # Knowledge-base retrieval
+    SEARCH_CHUNK_WORDS: int = 200
+    SEARCH_INDEX_MAX_CHATBOTS: int = 500
+    SEARCH_INDEX_TTL_SECONDS: float = 300.0
+
+    # Semantic retrieval. EMBEDDING_FUNCTION is an optional "module:callable"
+    # taking a list of texts and returning a float32 matrix; the default is a
+    # local hashing embedder that needs no model download. Indexes record the
+    # function and EMBEDDING_VERSION; bump the version when the model behind
+    # the function changes, and stored indexes are re-embedded.
+    VECTOR_INDEX_DIR: str = "./data/vectors"
+    EMBEDDING_FUNCTION: Optional[str] = None
+    EMBEDDING_VERSION: str = "1"
+    EMBEDDING_DIMENSIONS: int = 384
+    EMBEDDING_BATCH_SIZE: int = 64
+    VECTOR_INDEX_MAX_OPEN: int = 256
+
+    # Dashboard stats are read from the user_stats rollup and cached per user.
+    DASHBOARD_STATS_CACHE_TTL_SECONDS: float = 30.0
+    DASHBOARD_STATS_CACHE_SIZE: int = 10000
+
+    # Analytics write-behind: pending increments are flushed in bulk every
+    # interval, or sooner once the threshold is reached.
+    ANALYTICS_FLUSH_INTERVAL_SECONDS: float = 1.0
+    ANALYTICS_FLUSH_THRESHOLD: int = 5000
+    ANALYTICS_BATCH_SIZE: int = 500
+
+    # Widget answers: passages retrieved per question, sentences kept in the
+    # extractive answer and words sent per streamed event.
+    WIDGET_ANSWER_PASSAGES: int = 4
+    WIDGET_ANSWER_MAX_SENTENCES: int = 4
+    WIDGET_ANSWER_WORDS_PER_EVENT: int = 4
+
+    # Widget answer cache, per chatbot: exact matches of the normalized
+    # question first, then the most similar cached question whose cosine
+    # similarity reaches ANSWER_CACHE_SIMILARITY (set above 1 to disable), or
+    # ANSWER_CACHE_SHORT_QUESTION_SIMILARITY for questions of at most
+    # ANSWER_CACHE_SHORT_QUESTION_WORDS words, and that has the same negations.
+    # Other workers see document changes through the vector index, but not
+    # before their lexical index refreshes, so keep the TTL at most
+    # SEARCH_INDEX_TTL_SECONDS.
+    ANSWER_CACHE_TTL_SECONDS: float = 300.0
+    ANSWER_CACHE_MAX_CHATBOTS: int = 1000
+    ANSWER_CACHE_MAX_ENTRIES: int = 256
+    ANSWER_CACHE_MAX_BYTES_PER_CHATBOT: int = 1024 * 1024
+    ANSWER_CACHE_SIMILARITY: float = 0.9
+    ANSWER_CACHE_SHORT_QUESTION_WORDS: int = 6
+    ANSWER_CACHE_SHORT_QUESTION_SIMILARITY: float = 0.97
+    ANSWER_CACHE_DIMENSIONS: int = 256
+
+    # Live chat WebSockets. LIVE_CHAT_BROKER is an optional "module:callable"
+    # returning a cross-worker Broker; the default delivers within the process.
+    LIVE_CHAT_BROKER: Optional[str] = None
+    LIVE_CHAT_MAX_CONNECTIONS: int = 50000
+    LIVE_CHAT_SEND_QUEUE_SIZE: int = 64
+    LIVE_CHAT_OVERFLOW_POLICY: Literal["drop_oldest", "close"] = "drop_oldest"
+    LIVE_CHAT_SEND_TIMEOUT_SECONDS: float = 5.0
+    LIVE_CHAT_HEARTBEAT_SECONDS: float = 20.0
+    LIVE_CHAT_IDLE_TIMEOUT_SECONDS: float = 90.0
+
+    # Conversation transcripts, on local disk. Every TRANSCRIPT_BLOCK_MESSAGES
+    # messages of a conversation are sealed into a compressed block;
+    # conversations quiet for TRANSCRIPT_COMPACT_AFTER_SECONDS are rewritten
+    # into blocks of TRANSCRIPT_COMPACT_BLOCK_MESSAGES.
+    TRANSCRIPT_DIR: str = "./data/transcripts"
+    TRANSCRIPT_BLOCK_MESSAGES: int = 32
+    TRANSCRIPT_COMPACT_BLOCK_MESSAGES: int = 512
+    TRANSCRIPT_COMPACT_AFTER_SECONDS: float = 3600.0
+    TRANSCRIPT_COMPACT_INTERVAL_SECONDS: float = 300.0
+
+    # Routing of live chats to agents. Waiting chats are served in order of
+    # arrival, moved earlier by the boost per priority level above "low" and
+    # by the boost of the visitor's plan (a JSON object of plan -> seconds).
+    ROUTING_PRIORITY_BOOST_SECONDS: float = 120.0
+    ROUTING_PLAN_BOOST_SECONDS: Dict[str, float] = {"free": 0.0, "pro": 60.0, "enterprise": 300.0}
+    # Routing state lives in one process. With routing enabled, a second
+    # worker on the host fails to start while another holds ROUTING_LOCK_FILE;
+    # multi-worker and multi-host deployments must disable routing.
+    ROUTING_ENABLED: bool = True
+    ROUTING_LOCK_FILE: str = "./data/routing.lock"
+
+    # Deferred removal of deleted documents' files. Paths are journaled, one
+    # STORAGE_GC_JOURNAL.<pid> file per worker, and removed in batches by a
+    # background sweeper, with retries. With the service role key, one worker
+    # also reconciles the bucket against documents.storage_path to find
+    # orphans (0 disables it).
+    STORAGE_GC_JOURNAL: str = "./data/storage_gc.jsonl"
+    STORAGE_GC_BATCH_SIZE: int = 500
+    STORAGE_GC_SWEEP_INTERVAL_SECONDS: float = 5.0
+    STORAGE_GC_MAX_ATTEMPTS: int = 5
+    STORAGE_GC_RETRY_BACKOFF_SECONDS: float = 10.0
+    STORAGE_GC_RECONCILE_INTERVAL_SECONDS: float = 6 * 3600.0
+    STORAGE_GC_RECONCILE_GRACE_SECONDS: float = 3600.0
 
     class Config:
         env_file = ".env"
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
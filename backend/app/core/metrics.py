@@ -0,0 +1,286 @@
+"""
+In-process metrics, exposed in the Prometheus text format at `/metrics`.
+
+- `MetricsMiddleware` records a latency histogram and an in-flight gauge per
+  route template (`/api/chatbots/{chatbot_id}`, not the concrete path) and
+  status class.
+- `InstrumentedTransport` wraps the pooled Supabase transport and records
+  every Auth, PostgREST and Storage call by service, table (or bucket, or
+  auth endpoint) and operation.
+- Components with a `stats()` method (ingestion, analytics, caches, ...) are
+  registered as collectors and exported as gauges.
+- With `METRICS_SLOW_REQUEST_SECONDS` set, requests slower than that are
+  sampled with their upstream calls, and the slowest are kept for
+  `/metrics/slow`.
+
+Metrics are per worker process and only touched from the event loop.
+"""
+import bisect
+import heapq
+import itertools
+import logging
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import httpx
+from starlette.routing import Match
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Upstream calls made while serving the current request, when slow requests are sampled.
+_request_calls: ContextVar[Optional[list]] = ContextVar("request_calls", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """A labeled histogram family with fixed buckets."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._bounds = [f'le="{bound}"' for bound in self.buckets] + ['le="+Inf"']
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self._bounds, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, bound)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Counter:
+    """A labeled counter family; also used as a gauge by passing negative amounts."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], kind: str = "counter"):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+def _flatten(prefix: str, stats: dict) -> Iterable[Tuple[str, float]]:
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+        elif isinstance(value, bool):
+            yield name, int(value)
+
+
+class MetricsRegistry:
+    def __init__(self, namespace: str = "chatflow", slow_request_seconds: Optional[float] = None, slow_request_samples: int = 50):
+        self.namespace = namespace
+        self.request_duration = Histogram(
+            f"{namespace}_http_request_duration_seconds",
+            "Time from receiving a request until its response is complete.",
+            ("method", "route", "status"),
+        )
+        self.requests_in_flight = Counter(
+            f"{namespace}_http_requests_in_flight", "Requests currently being served.", ("method", "route"), kind="gauge"
+        )
+        self.upstream_duration = Histogram(
+            f"{namespace}_upstream_request_duration_seconds",
+            "Time until Supabase answered a call (response headers received).",
+            ("service", "table", "op"),
+        )
+        self.upstream_errors = Counter(
+            f"{namespace}_upstream_errors_total",
+            "Supabase calls that failed or answered with a 5xx status.",
+            ("service", "table", "op"),
+        )
+        self._collectors: Dict[str, Callable[[], dict]] = {}
+        self.slow_request_seconds = slow_request_seconds
+        self.slow_request_samples = slow_request_samples
+        self._slowest: List[tuple] = []
+        self._sequence = itertools.count()
+
+    def register_collector(self, name: str, stats: Callable[[], dict]) -> None:
+        """Exports the numeric values of `stats()` as `<namespace>_<name>_<key>` gauges."""
+        self._collectors[name] = stats
+
+    def record_slow_request(self, duration: float, record: dict) -> None:
+        entry = (duration, next(self._sequence), record)
+        if len(self._slowest) < self.slow_request_samples:
+            heapq.heappush(self._slowest, entry)
+        elif duration > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+        logger.info("Slow request %s %s: %.3fs", record["method"], record["path"], duration)
+
+    def slowest_requests(self) -> List[dict]:
+        return [record for _, _, record in sorted(self._slowest, reverse=True)]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for family in (self.request_duration, self.requests_in_flight, self.upstream_duration, self.upstream_errors):
+            lines.extend(family.render())
+        for name, stats in self._collectors.items():
+            try:
+                values = list(_flatten(f"{self.namespace}_{name}", stats()))
+            except Exception as e:
+                logger.warning("Metrics collector %s failed: %s", name, e)
+                continue
+            for metric, value in values:
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _route_template(routes: Sequence, scope) -> str:
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Times every HTTP request and counts it in flight, labeled by route template."""
+
+    def __init__(self, app, registry: MetricsRegistry, routes: Sequence):
+        self.app = app
+        self.registry = registry
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        registry = self.registry
+        method = scope["method"]
+        route = _route_template(self.routes, scope)
+        status_code = 500
+        started = time.perf_counter()
+        calls_token = _request_calls.set([]) if registry.slow_request_seconds is not None else None
+        registry.requests_in_flight.inc((method, route))
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started
+            registry.requests_in_flight.inc((method, route), -1)
+            registry.request_duration.observe((method, route, f"{status_code // 100}xx"), duration)
+            if calls_token is not None:
+                calls = _request_calls.get()
+                _request_calls.reset(calls_token)
+                if duration >= registry.slow_request_seconds:
+                    registry.record_slow_request(duration, {
+                        "method": method,
+                        "path": scope["path"],
+                        "route": route,
+                        "status": status_code,
+                        "seconds": round(duration, 6),
+                        "upstream_seconds": round(sum(call["seconds"] for call in calls), 6),
+                        "upstream_calls": calls,
+                    })
+
+
+def classify_upstream(request: httpx.Request) -> Tuple[str, str, str]:
+    """Labels a Supabase call as `(service, table, op)`."""
+    segments = [segment for segment in request.url.path.split("/") if segment]
+    method = request.method
+    if len(segments) >= 2 and segments[0] == "rest":
+        rest = segments[2:]
+        if rest[:1] == ["rpc"]:
+            return "postgrest", rest[1] if len(rest) > 1 else "", "rpc"
+        op = {"GET": "select", "HEAD": "count", "POST": "insert", "PATCH": "update", "PUT": "upsert", "DELETE": "delete"}.get(method, method.lower())
+        if method == "POST" and "resolution=merge-duplicates" in request.headers.get("prefer", ""):
+            op = "upsert"
+        return "postgrest", rest[0] if rest else "", op
+    if len(segments) >= 2 and segments[0] == "storage":
+        rest = segments[2:]
+        if rest[:1] == ["object"]:
+            rest = rest[1:]
+        if rest and rest[0] in ("list", "sign", "public", "authenticated", "info", "move", "copy"):
+            return "storage", rest[1] if len(rest) > 1 else "", rest[0]
+        op = {"GET": "download", "POST": "upload", "PUT": "update", "DELETE": "remove"}.get(method, method.lower())
+        return "storage", rest[0] if rest else "", op
+    if len(segments) >= 2 and segments[0] == "auth":
+        endpoint = "/".join(segments[2:]) or "root"
+        return "auth", endpoint, method.lower()
+    return "other", "", method.lower()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    Times calls through the wrapped transport. Closing it does not close the
+    wrapped transport, which is shared and closed at shutdown.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, registry: "MetricsRegistry"):
+        self.transport = transport
+        self.registry = registry
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        labels = classify_upstream(request)
+        started = time.perf_counter()
+        failed = True
+        try:
+            response = await self.transport.handle_async_request(request)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            duration = time.perf_counter() - started
+            self.registry.upstream_duration.observe(labels, duration)
+            if failed:
+                self.registry.upstream_errors.inc(labels)
+            calls = _request_calls.get()
+            if calls is not None:
+                service, table, op = labels
+                calls.append({"service": service, "table": table, "op": op, "seconds": round(duration, 6)})
+
+    async def aclose(self) -> None:
+        pass
+
+
+metrics = MetricsRegistry(
+    slow_request_seconds=settings.METRICS_SLOW_REQUEST_SECONDS,
+    slow_request_samples=settings.METRICS_SLOW_REQUEST_SAMPLES,
+)
@@ -0,0 +1,75 @@
+"""
+Keyset (cursor) pagination for listings ordered newest first.
+
+A cursor encodes the sort key and id of the last row of a page. The next page
+asks for rows strictly after that position, `(key, id) < (cursor_key, cursor_id)`,
+so every page costs the same index range scan however deep the client has
+paged. OFFSET would have the database skip all the earlier rows again.
+
+Listings stay unpaged for clients that pass neither `limit` nor `cursor`:
+they get every row, read in pages of `UNPAGED_PAGE_SIZE`.
+"""
+import base64
+import json
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+DEFAULT_PAGE_SIZE = 100
+# Pages are fetched with one extra row, which must stay within PostgREST's
+# default max-rows of 1000.
+UNPAGED_PAGE_SIZE = 999
+
+PageFetcher = Callable[[int, Optional[str]], Awaitable[Tuple[Optional[List[dict]], Optional[str]]]]
+
+
+def encode_cursor(sort_value: str, row_id: str) -> str:
+    raw = json.dumps([sort_value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        if not isinstance(sort_value, str) or not isinstance(row_id, str):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+    return sort_value, row_id
+
+
+def _quote(value: str) -> str:
+    # Timestamps contain characters PostgREST treats as syntax inside or=(...).
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def after_cursor(column: str, cursor: str) -> str:
+    """PostgREST `or` filter selecting the rows that follow `cursor` in `column desc, id desc` order."""
+    sort_value, row_id = decode_cursor(cursor)
+    value, identifier = _quote(sort_value), _quote(row_id)
+    return f"{column}.lt.{value},and({column}.eq.{value},id.lt.{identifier})"
+
+
+def next_page(rows: List[dict], limit: int, column: str) -> Tuple[List[dict], Optional[str]]:
+    """Trims a `limit + 1` fetch to one page and returns the cursor of the next page, if any."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][column], rows[-1]["id"])
+
+
+async def fetch_page_or_all(fetch: PageFetcher, limit: Optional[int], cursor: Optional[str]) -> Tuple[Optional[List[dict]], Optional[str]]:
+    """
+    Fetches the requested page, or, when neither `limit` nor `cursor` is given,
+    follows the cursors through every page and returns all rows with no next
+    cursor. Rows are None if `fetch` returns None for the first page.
+    """
+    if limit is not None or cursor is not None:
+        return await fetch(limit or DEFAULT_PAGE_SIZE, cursor)
+    rows, next_cursor = await fetch(UNPAGED_PAGE_SIZE, None)
+    while rows is not None and next_cursor:
+        page, next_cursor = await fetch(UNPAGED_PAGE_SIZE, next_cursor)
+        rows += page or []
+    return rows, None
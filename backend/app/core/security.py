@@ -0,0 +1,170 @@
+import hashlib
+import hmac
+import logging
+import secrets
+import uuid
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+import jwt
+from gotrue.types import User
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_ALGORITHMS = ["HS256", "RS256", "ES256"]
+
+
+def user_from_claims(claims: dict) -> User:
+    """Builds a gotrue `User` from the claims of a verified Supabase access token."""
+    # Access tokens do not carry the account creation date, so the issue time stands in for it.
+    issued_at = datetime.fromtimestamp(claims.get("iat", 0), tz=timezone.utc)
+    return User(
+        id=claims["sub"],
+        aud=claims.get("aud") or "",
+        role=claims.get("role"),
+        email=claims.get("email"),
+        phone=claims.get("phone"),
+        app_metadata=claims.get("app_metadata") or {},
+        user_metadata=claims.get("user_metadata") or {},
+        is_anonymous=claims.get("is_anonymous", False),
+        created_at=issued_at,
+    )
+
+
+class TokenVerifier:
+    """
+    Verifies Supabase access tokens in-process.
+
+    HS256 tokens are checked against the project's JWT secret, asymmetric ones
+    against the signing keys published at the JWKS endpoint (fetched once and
+    cached for `jwks_ttl` seconds). Verified tokens are remembered by their
+    SHA-256 in a bounded LRU until they expire, so repeated requests with the
+    same token skip signature checks entirely.
+    """
+
+    def __init__(self, jwks_url: str, jwt_secret: Optional[str], audience: str, cache_size: int, jwks_ttl: int, api_key: str):
+        self.jwt_secret = jwt_secret
+        self.audience = audience
+        self.cache = TTLCache(maxsize=cache_size)
+        self.local_verifications = 0
+        self.remote_verifications = 0
+        self._jwks_client = jwt.PyJWKClient(
+            jwks_url,
+            cache_jwk_set=True,
+            lifespan=jwks_ttl,
+            headers={"apikey": api_key},
+        )
+
+    @staticmethod
+    def _cache_key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get_cached(self, token: str) -> Optional[User]:
+        return self.cache.get(self._cache_key(token))
+
+    def verify(self, token: str) -> User:
+        """
+        Checks the token's signature, expiry and audience locally.
+        Raises `jwt.PyJWTError` when the token cannot be verified.
+        """
+        algorithm = jwt.get_unverified_header(token).get("alg")
+        if algorithm not in ALLOWED_ALGORITHMS:
+            raise jwt.InvalidAlgorithmError(f"Unsupported token algorithm: {algorithm}")
+
+        if algorithm == "HS256":
+            if not self.jwt_secret:
+                raise jwt.InvalidKeyError("No JWT secret configured for HS256 tokens.")
+            key = self.jwt_secret
+        else:
+            key = self._jwks_client.get_signing_key_from_jwt(token).key
+
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            audience=self.audience,
+            options={"require": ["exp", "sub"]},
+        )
+        user = user_from_claims(claims)
+        self.local_verifications += 1
+        self.cache.set(self._cache_key(token), user, expires_at=claims["exp"])
+        return user
+
+    def remember(self, token: str, user: User) -> None:
+        """Caches a user that Supabase Auth confirmed remotely, until the token expires."""
+        self.remote_verifications += 1
+        try:
+            claims = jwt.decode(token, options={"verify_signature": False})
+        except jwt.PyJWTError:
+            return
+        if "exp" in claims:
+            self.cache.set(self._cache_key(token), user, expires_at=claims["exp"])
+
+    def stats(self) -> dict:
+        return {
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "cache_size": len(self.cache),
+            "local_verifications": self.local_verifications,
+            "remote_verifications": self.remote_verifications,
+        }
+
+
+token_verifier = TokenVerifier(
+    jwks_url=f"{settings.SUPABASE_URL}/auth/v1/.well-known/jwks.json",
+    jwt_secret=settings.SUPABASE_JWT_SECRET,
+    audience=settings.SUPABASE_JWT_AUDIENCE,
+    cache_size=settings.AUTH_TOKEN_CACHE_SIZE,
+    jwks_ttl=settings.JWKS_CACHE_TTL_SECONDS,
+    api_key=settings.SUPABASE_KEY,
+)
+
+
+def is_uuid(value: str) -> bool:
+    """True for a UUID in its canonical lowercase, hyphenated form."""
+    try:
+        return str(uuid.UUID(value)) == value
+    except (ValueError, TypeError, AttributeError):
+        return False
+
+
+class ConversationSigner:
+    """
+    Issues conversation ids to widget visitors and checks them when they come
+    back. Each id is a UUID handed out with a token, an HMAC of the chatbot id
+    and the conversation id, so a visitor can only continue, rate or join a
+    conversation this server started for that chatbot.
+    """
+
+    def __init__(self, key: bytes):
+        self._key = key
+
+    def sign(self, chatbot_id: str, conversation_id: str) -> str:
+        message = f"{chatbot_id}/{conversation_id}".encode()
+        return hmac.new(self._key, message, hashlib.sha256).hexdigest()[:32]
+
+    def issue(self, chatbot_id: str) -> Tuple[str, str]:
+        """Starts a conversation; returns its id and token."""
+        conversation_id = str(uuid.uuid4())
+        return conversation_id, self.sign(chatbot_id, conversation_id)
+
+    def verify(self, chatbot_id: str, conversation_id: Optional[str], token: Optional[str]) -> bool:
+        if not conversation_id or not token or not is_uuid(conversation_id):
+            return False
+        return hmac.compare_digest(self.sign(chatbot_id, conversation_id), token)
+
+
+def _conversation_key() -> bytes:
+    if settings.CONVERSATION_SECRET:
+        return settings.CONVERSATION_SECRET.encode()
+    if settings.SUPABASE_JWT_SECRET:
+        # Derived, so conversation tokens can never double as access-token signatures.
+        return hmac.new(settings.SUPABASE_JWT_SECRET.encode(), b"conversation-ids", hashlib.sha256).digest()
+    logger.warning("Neither CONVERSATION_SECRET nor SUPABASE_JWT_SECRET is set; conversation ids only verify in this process.")
+    return secrets.token_bytes(32)
+
+
+conversation_signer = ConversationSigner(_conversation_key())
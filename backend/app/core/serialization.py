@@ -0,0 +1,35 @@
+"""
+Fast-path JSON responses for list endpoints.
+
+A route that returns models has them validated and serialized a second time
+by FastAPI against its `response_model`, then encoded by the response class.
+List routes instead validate their rows once with a cached `TypeAdapter` and
+return the JSON bytes pydantic-core writes directly, skipping the second pass
+and `jsonable_encoder`. Such routes keep `response_model` for the OpenAPI
+schema only. See `benchmarks/bench_serialization.py` for the difference.
+"""
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Type
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+
+
+@lru_cache(maxsize=None)
+def list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+
+def model_list_response(
+    model: Type[BaseModel],
+    rows: Iterable[Any],
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    Validates `rows` (database rows or model instances) as a list of `model` and
+    returns them as JSON, using field names rather than aliases, like routes
+    declared with `response_model_by_alias=False`.
+    """
+    adapter = list_adapter(model)
+    items = adapter.validate_python(rows)
+    return Response(content=adapter.dump_json(items, by_alias=False), media_type="application/json", headers=headers)
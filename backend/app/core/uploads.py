@@ -0,0 +1,73 @@
+import hashlib
+from typing import AsyncIterator, Tuple
+
+from fastapi import HTTPException, UploadFile, status
+from starlette.responses import JSONResponse
+
+# Room for multipart boundaries and part headers on top of the file itself.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Uploaded file is too large.")
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects multipart request bodies larger than `max_bytes` before they are
+    parsed. Declared sizes are checked against Content-Length up front; chunked
+    bodies are counted as they arrive and cut off once they pass the limit.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_body_bytes = max_bytes + MULTIPART_OVERHEAD_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        content_length = headers.get(b"content-length")
+        if content_length is not None and int(content_length) > self.max_body_bytes:
+            response = JSONResponse({"detail": "Uploaded file is too large."}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # FastAPI re-raises HTTPExceptions hit while parsing the body.
+                    raise _too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def hash_upload(file: UploadFile, max_bytes: int, chunk_size: int) -> Tuple[str, int]:
+    """
+    Reads the upload in chunks and returns its SHA-256 and size, raising 413 as
+    soon as it grows past `max_bytes`. The file is rewound afterwards.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := await file.read(chunk_size):
+        size += len(chunk)
+        if size > max_bytes:
+            raise _too_large()
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.hexdigest(), size
+
+
+async def iter_upload(file: UploadFile, chunk_size: int) -> AsyncIterator[bytes]:
+    """Yields the upload chunk by chunk, so it never has to sit in memory whole."""
+    while chunk := await file.read(chunk_size):
+        yield chunk
@@ -0,0 +1,225 @@
+"""
+Data access for chatbots and documents, scoped to one user.
+
+Every query carries the owner filter (`eq('user_id', ...)`) itself, so
+ownership is checked by the same round trip that reads or writes the rows
+instead of by a separate lookup first; RLS enforces the same rule again on
+the database side. Inserts are the exception: a document insert cannot
+carry an owner filter on its chatbot, so chatbot ownership is checked
+explicitly first, unless an earlier query of the same request already
+proved it. Repositories are created per request (see
+`app.api.dependencies`), and chatbot lookups are memoized for the lifetime
+of the request.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+
+from postgrest import AsyncPostgrestClient
+from postgrest.exceptions import APIError
+
+from app.core.pagination import after_cursor, next_page
+
+# PostgreSQL errors that mean a document's chatbot is not there for the user:
+# insufficient_privilege (rejected by RLS), foreign_key_violation (no such
+# chatbot) and invalid_text_representation (not a UUID).
+RLS_VIOLATION = "42501"
+FOREIGN_KEY_VIOLATION = "23503"
+INVALID_TEXT_REPRESENTATION = "22P02"
+MISSING_CHATBOT_ERRORS = {RLS_VIOLATION, FOREIGN_KEY_VIOLATION, INVALID_TEXT_REPRESENTATION}
+
+# List projections: everything the list views show, without `analytics` or `content`.
+CHATBOT_LIST_COLUMNS = "id, name, status, description, conversations, accuracy, last_updated"
+DOCUMENT_LIST_COLUMNS = "id, chatbot_id, source_type, source_name, status, storage_path, content_hash, created_at, last_updated"
+
+
+class ChatbotRepository:
+    def __init__(self, db: AsyncPostgrestClient, user_id: str):
+        self.db = db
+        self.user_id = user_id
+        self._memo: Dict[Tuple[str, str], Optional[dict]] = {}
+
+    def _remember(self, chatbot_id: str, columns: str, row: Optional[dict]) -> None:
+        self._memo[(chatbot_id, columns)] = row
+
+    def _forget(self, chatbot_id: str) -> None:
+        for key in [key for key in self._memo if key[0] == chatbot_id]:
+            del self._memo[key]
+
+    async def get(self, chatbot_id: str, columns: str = "*") -> Optional[dict]:
+        """Returns the user's chatbot, or None if it does not exist or belongs to someone else."""
+        for key in ((chatbot_id, columns), (chatbot_id, "*")):
+            if key in self._memo:
+                return self._memo[key]
+        response = await (
+            self.db.table('chatbots').select(columns)
+            .eq('id', chatbot_id).eq('user_id', self.user_id)
+            .limit(1).execute()
+        )
+        row = response.data[0] if response.data else None
+        self._remember(chatbot_id, columns, row)
+        return row
+
+    async def list(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """Returns a page of the user's chatbots, most recently updated first, and the next cursor."""
+        query = self.db.table('chatbots').select(CHATBOT_LIST_COLUMNS).eq('user_id', self.user_id)
+        if cursor:
+            query = query.or_(after_cursor('last_updated', cursor))
+        response = await query.order('last_updated', desc=True).order('id', desc=True).limit(limit + 1).execute()
+        return next_page(response.data or [], limit, 'last_updated')
+
+    async def create(self, data: dict) -> Optional[dict]:
+        response = await self.db.table('chatbots').insert({**data, "user_id": self.user_id}).execute()
+        if not response.data:
+            return None
+        row = response.data[0]
+        self._remember(row["id"], "*", row)
+        return row
+
+    async def update(self, chatbot_id: str, data: dict) -> Optional[dict]:
+        """Updates the user's chatbot; returns None if there was no such chatbot to update."""
+        response = await self.db.table('chatbots').update(data).eq('id', chatbot_id).eq('user_id', self.user_id).execute()
+        self._forget(chatbot_id)
+        row = response.data[0] if response.data else None
+        if row is not None:
+            self._remember(chatbot_id, "*", row)
+        return row
+
+    async def delete(self, chatbot_id: str) -> Optional[dict]:
+        """Deletes the user's chatbot; returns the deleted row, or None if nothing matched."""
+        response = await self.db.table('chatbots').delete().eq('id', chatbot_id).eq('user_id', self.user_id).execute()
+        self._forget(chatbot_id)
+        self._remember(chatbot_id, "*", None)
+        return response.data[0] if response.data else None
+
+
+class DocumentRepository:
+    def __init__(self, db: AsyncPostgrestClient, user_id: str):
+        self.db = db
+        self.user_id = user_id
+        # Chatbots this request has already seen the user own.
+        self._owned: Set[str] = set()
+
+    async def owns_chatbot(self, chatbot_id: str) -> bool:
+        if chatbot_id in self._owned:
+            return True
+        try:
+            response = await (
+                self.db.table('chatbots').select('id')
+                .eq('id', chatbot_id).eq('user_id', self.user_id)
+                .limit(1).execute()
+            )
+        except APIError as e:
+            if e.code in MISSING_CHATBOT_ERRORS:
+                return False
+            raise
+        if not response.data:
+            return False
+        self._owned.add(chatbot_id)
+        return True
+
+    async def list_for_chatbot(
+        self, chatbot_id: str, limit: int, cursor: Optional[str] = None
+    ) -> Tuple[Optional[List[dict]], Optional[str]]:
+        """
+        Returns a page of the chatbot's documents, newest first, and the next
+        cursor; the page is None if the user does not own the chatbot. Embedding
+        the documents in the chatbot select answers both in a single request.
+        """
+        query = (
+            self.db.table('chatbots').select(f'id, documents({DOCUMENT_LIST_COLUMNS})')
+            .eq('id', chatbot_id).eq('user_id', self.user_id)
+        )
+        if cursor:
+            query = query.or_(after_cursor('created_at', cursor), reference_table='documents')
+        response = await (
+            query.order('created_at', desc=True, foreign_table='documents')
+            .order('id', desc=True, foreign_table='documents')
+            .limit(limit + 1, foreign_table='documents')
+            .limit(1).execute()
+        )
+        if not response.data:
+            return None, None
+        self._owned.add(chatbot_id)
+        return next_page(response.data[0]["documents"], limit, 'created_at')
+
+    async def url_documents(self, chatbot_id: str, page_size: int = 1000) -> Optional[List[dict]]:
+        """
+        Returns the chatbot's URL documents with their status, the validators of
+        their last crawl and the hash of their indexed text, or None if the user
+        does not own the chatbot. Read in pages by id so large sites stay under
+        PostgREST's row limit.
+        """
+        documents: List[dict] = []
+        while True:
+            query = (
+                self.db.table('chatbots').select('id, documents(id, source_name, status, etag, last_modified, text_hash)')
+                .eq('id', chatbot_id).eq('user_id', self.user_id)
+                .eq('documents.source_type', 'url')
+            )
+            if documents:
+                query = query.gt('documents.id', documents[-1]["id"])
+            response = await (
+                query.order('id', foreign_table='documents')
+                .limit(page_size, foreign_table='documents')
+                .limit(1).execute()
+            )
+            if not response.data:
+                return None
+            self._owned.add(chatbot_id)
+            page = response.data[0]["documents"]
+            documents += page
+            if len(page) < page_size:
+                return documents
+
+    async def find_by_hash(self, chatbot_id: str, content_hash: str) -> Tuple[bool, Optional[dict]]:
+        """
+        Looks up a document by content hash. Returns `(owns_chatbot, document)` so
+        callers learn about ownership from the same round trip.
+        """
+        response = await (
+            self.db.table('chatbots').select('id, documents(*)')
+            .eq('id', chatbot_id).eq('user_id', self.user_id)
+            .eq('documents.content_hash', content_hash)
+            .limit(1, foreign_table='documents')
+            .limit(1).execute()
+        )
+        if not response.data:
+            return False, None
+        self._owned.add(chatbot_id)
+        documents = response.data[0]["documents"]
+        return True, documents[0] if documents else None
+
+    async def create(self, data: dict) -> Optional[dict]:
+        """
+        Inserts a document. Returns None, like a missing chatbot, if the user
+        does not own the document's chatbot.
+        """
+        rows = await self.create_many([data])
+        return rows[0] if rows else None
+
+    async def create_many(self, rows: List[dict]) -> Optional[List[dict]]:
+        """
+        Inserts documents with a single request and returns the created rows. As
+        with `create`, None means the user does not own one of the chatbots, so
+        nothing was inserted. Ownership is checked here and not left to RLS, so
+        it holds on databases without the policy from SUPABASE.md section 9.
+        """
+        for chatbot_id in {data["chatbot_id"] for data in rows}:
+            if not await self.owns_chatbot(chatbot_id):
+                return None
+        try:
+            response = await self.db.table('documents').insert([{**data, "user_id": self.user_id} for data in rows]).execute()
+        except APIError as e:
+            if e.code in MISSING_CHATBOT_ERRORS:
+                return None
+            raise
+        return response.data or []
+
+    async def delete(self, document_id: str) -> Optional[dict]:
+        """Deletes the user's document; returns the deleted row, or None if nothing matched."""
+        response = await self.db.table('documents').delete().eq('id', document_id).eq('user_id', self.user_id).execute()
+        return response.data[0] if response.data else None
+
+    async def delete_many(self, document_ids: List[str]) -> List[dict]:
+        """Deletes those of the given documents the user owns, in one request; returns the deleted rows."""
+        response = await self.db.table('documents').delete().in_('id', document_ids).eq('user_id', self.user_id).execute()
+        return response.data or []
@@ -0,0 +1,37 @@
+import base64
+import json
+from typing import AsyncIterator, Optional
+
+from storage3 import AsyncStorageClient
+from storage3.utils import StorageException
+
+# Uploaded documents live under `{user_id}/{chatbot_id}/` in this bucket.
+BUCKET_NAME = "documents-storage"
+
+
+async def stream_upload(
+    storage: AsyncStorageClient,
+    bucket: str,
+    path: str,
+    chunks: AsyncIterator[bytes],
+    content_type: Optional[str] = None,
+    metadata: Optional[dict] = None,
+) -> None:
+    """
+    Uploads an object by streaming `chunks` as the raw request body.
+
+    storage3's `upload()` needs the whole file as bytes or an on-disk path; this
+    sends the body chunk by chunk over the client's pooled session, so peak
+    memory stays at one chunk regardless of the file size.
+    """
+    headers = {
+        "content-type": content_type or "application/octet-stream",
+        "cache-control": "max-age=3600",
+        "x-upsert": "false",
+    }
+    if metadata:
+        headers["x-metadata"] = base64.b64encode(json.dumps(metadata).encode()).decode()
+
+    response = await storage.session.post(f"/object/{bucket}/{path}", content=chunks, headers=headers)
+    if response.is_error:
+        raise StorageException(f"Storage upload failed with status {response.status_code}: {response.text}")
@@ -1,7 +1,111 @@
-from supabase import create_client, Client
+from typing import Optional
+
+import httpx
+from gotrue import AsyncGoTrueClient
+from postgrest import AsyncPostgrestClient
+from storage3 import AsyncStorageClient
+
 from app.core.config import settings
+from app.core.metrics import InstrumentedTransport, metrics
+
+# One pooled transport is shared by every Supabase client in the worker, so
+# connections to PostgREST, Storage and Auth are kept alive across requests and
+# multiplexed over HTTP/2 instead of being opened per client.
+http_transport = httpx.AsyncHTTPTransport(
+    http2=True,
+    limits=httpx.Limits(
+        max_connections=settings.SUPABASE_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.SUPABASE_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.SUPABASE_KEEPALIVE_EXPIRY_SECONDS,
+    ),
+)
+
+def _pooled_http_client(base_url: str = "", headers: Optional[dict] = None, timeout=None) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers,
+        timeout=timeout if timeout is not None else httpx.Timeout(settings.SUPABASE_TIMEOUT_SECONDS),
+        # Wrapped per client (cheap) so every Supabase call is timed by table and operation.
+        transport=InstrumentedTransport(http_transport, metrics),
+        follow_redirects=True,
+        trust_env=False,
+    )
+
+def _auth_headers(access_token: Optional[str] = None) -> dict:
+    return {
+        "apikey": settings.SUPABASE_KEY,
+        "Authorization": f"Bearer {access_token or settings.SUPABASE_KEY}",
+    }
+
+
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """PostgREST client whose session borrows connections from the shared transport."""
+
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None):
+        return _pooled_http_client(base_url, headers, timeout)
+
+    async def aclose(self) -> None:
+        # The pooled transport outlives request-scoped clients; it is closed at shutdown.
+        pass
+
+
+class PooledStorageClient(AsyncStorageClient):
+    """Storage client whose session borrows connections from the shared transport."""
+
+    def _create_session(self, base_url, headers, timeout, verify=True, proxy=None):
+        return _pooled_http_client(base_url, headers, timeout)
+
+    async def aclose(self) -> None:
+        pass
+
+
+def get_postgrest_client(access_token: Optional[str] = None) -> AsyncPostgrestClient:
+    """
+    Returns a PostgREST client authenticated as the given user (or anonymously).
+    The client is cheap to build and carries its own headers, so no shared
+    state is mutated between concurrent requests.
+    """
+    return PooledPostgrestClient(
+        f"{settings.SUPABASE_URL}/rest/v1",
+        headers={
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            **_auth_headers(access_token),
+        },
+        timeout=settings.SUPABASE_TIMEOUT_SECONDS,
+    )
+
+def get_storage_client(access_token: Optional[str] = None) -> AsyncStorageClient:
+    """Returns a Storage client authenticated as the given user (or anonymously)."""
+    return PooledStorageClient(
+        f"{settings.SUPABASE_URL}/storage/v1/",
+        headers=_auth_headers(access_token),
+        timeout=settings.SUPABASE_TIMEOUT_SECONDS,
+    )
+
+def get_service_postgrest_client(fallback_token: Optional[str] = None) -> AsyncPostgrestClient:
+    """
+    PostgREST client for background work: the service role when it is configured,
+    otherwise the token of the user on whose behalf the work runs.
+    """
+    return get_postgrest_client(settings.SUPABASE_SERVICE_ROLE_KEY or fallback_token)
+
+def get_service_storage_client(fallback_token: Optional[str] = None) -> AsyncStorageClient:
+    """Storage counterpart of `get_service_postgrest_client`."""
+    return get_storage_client(settings.SUPABASE_SERVICE_ROLE_KEY or fallback_token)
 
-# Initialize the Supabase client
-supabase_client: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+def get_auth_client() -> AsyncGoTrueClient:
+    """
+    Returns a GoTrue client for a single auth operation. Sessions are neither
+    persisted nor auto-refreshed, so sign-ins never leak into other requests.
+    """
+    return AsyncGoTrueClient(
+        url=f"{settings.SUPABASE_URL}/auth/v1",
+        headers=_auth_headers(),
+        http_client=_pooled_http_client(),
+        auto_refresh_token=False,
+        persist_session=False,
+    )
 
-supabase_public_client: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+async def close_http_transport() -> None:
+    await http_transport.aclose()
@@ -1,12 +1,53 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.auth import router as auth_router
 from app.api.dashboard import router as dashboard_router 
 from app.api.chatbots import router as chatbots_router 
 from app.api.documents import router as documents_router 
 from app.api.widget import router as widget_router
+from app.api.search import router as search_router
+from app.api.live_chat import router as live_chat_router
+from app.api.metrics import router as metrics_router
+from app.api.conversations import router as conversations_router
+from app.api.routing import router as routing_router
+from app.db.supabase import close_http_transport
+from app.core.admission import AdmissionMiddleware, widget_admission
+from app.core.cache import dashboard_stats_cache, widget_config_cache
+from app.core.config import settings
+from app.core.metrics import MetricsMiddleware, metrics
+from app.core.uploads import UploadSizeLimitMiddleware
+from app.services.analytics import analytics_buffer
+from app.services.answer_cache import answer_cache
+from app.services.bootstrap import bootstrap_bundles
+from app.services.crawler import crawler
+from app.services.ingestion import ingestion_pipeline
+from app.services.live_chat import live_chat
+from app.services.routing import chat_router
+from app.services.storage_gc import storage_gc
+from app.services.transcripts import transcript_store
 
-app = FastAPI(title="ChatFlow API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ingestion_pipeline.start()
+    analytics_buffer.start()
+    await live_chat.start()
+    transcript_store.start()
+    storage_gc.start()
+    if settings.ROUTING_ENABLED:
+        chat_router.start()
+    yield
+    chat_router.stop()
+    await storage_gc.stop()
+    await transcript_store.stop()
+    await live_chat.stop()
+    await ingestion_pipeline.stop()
+    # Drain after the producers stop, and before the HTTP transport closes.
+    await analytics_buffer.stop()
+    await close_http_transport()
+
+app = FastAPI(title="ChatFlow API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Configure CORS
 origins = [
@@ -21,13 +62,36 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=settings.MAX_UPLOAD_SIZE_BYTES)
+app.add_middleware(AdmissionMiddleware, controller=widget_admission)
+# Added last so it is outermost and times everything, including CORS and upload rejections.
+app.add_middleware(MetricsMiddleware, registry=metrics, routes=app.router.routes)
+
+metrics.register_collector("ingestion", ingestion_pipeline.stats)
+metrics.register_collector("analytics", analytics_buffer.stats)
+metrics.register_collector("live_chat", live_chat.stats)
+metrics.register_collector("crawler", crawler.stats)
+metrics.register_collector("widget_admission", widget_admission.stats)
+metrics.register_collector("widget_config_cache", widget_config_cache.stats)
+metrics.register_collector("dashboard_stats_cache", dashboard_stats_cache.stats)
+metrics.register_collector("bootstrap_bundles", bootstrap_bundles.stats)
+metrics.register_collector("answer_cache", answer_cache.stats)
+metrics.register_collector("transcripts", transcript_store.stats)
+metrics.register_collector("routing", chat_router.stats)
+metrics.register_collector("storage_gc", storage_gc.stats)
 
 app.include_router(auth_router, prefix="/api", tags=["Authentication"])
 app.include_router(dashboard_router, prefix="/api", tags=["Dashboard"])
 app.include_router(chatbots_router, prefix="/api", tags=["Chatbots"])
 app.include_router(documents_router, prefix="/api", tags=["Documents"]) 
 app.include_router(widget_router, prefix="/api", tags=["Widget"])
+app.include_router(search_router, prefix="/api", tags=["Search"])
+app.include_router(live_chat_router, prefix="/api", tags=["Live Chat"])
+app.include_router(conversations_router, prefix="/api", tags=["Conversations"])
+app.include_router(routing_router, prefix="/api", tags=["Routing"])
+app.include_router(metrics_router, tags=["Metrics"])
 
 @app.get("/")
 def read_root():
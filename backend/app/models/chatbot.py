@@ -15,6 +15,7 @@ class Chatbot(BaseModel):
     lastUpdated: str  = Field(alias="last_updated")
     greeting: Optional[str] = None
     initialMessages: Optional[List[str]] = Field(default=[], alias="initial_messages")
+    faqQuestions: Optional[List[str]] = Field(default=[], alias="faq_questions")
     placeholder: Optional[str] = None
     primaryColor: Optional[str] = Field(default=None, alias="primary_color")
     position: Optional[str] = None
@@ -25,6 +26,20 @@ class Chatbot(BaseModel):
     allowedDomain: Optional[str] = Field(default=None, alias="allowed_domain")
     analytics: Optional[dict[str, Any]] = None
 
+class ChatbotSummary(BaseModel):
+    """List projection of a chatbot: no widget settings or analytics payload."""
+    model_config = ConfigDict(
+        populate_by_name=True,
+    )
+
+    id: str
+    name: str
+    status: Literal["active", "draft", "archived"]
+    description: Optional[str] = None
+    conversations: int
+    accuracy: int
+    lastUpdated: str = Field(alias="last_updated")
+
 class ChatbotCreate(BaseModel):
     name: str
     description: Optional[str] = None
@@ -38,6 +53,7 @@ class ChatbotUpdate(BaseModel):
     description: Optional[str] = None
     greeting: Optional[str] = None
     initialMessages: Optional[List[str]] = Field(default=None, alias="initial_messages")
+    faqQuestions: Optional[List[str]] = Field(default=None, alias="faq_questions")
     placeholder: Optional[str] = None
     primaryColor: Optional[str] = Field(default=None, alias="primary_color")
     position: Optional[str] = None
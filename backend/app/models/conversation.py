@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+from typing import Literal
+
+class ConversationSummary(BaseModel):
+    id: str
+    messageCount: int
+    lastMessageAt: str
+
+class TranscriptMessage(BaseModel):
+    seq: int
+    role: Literal["visitor", "bot", "agent"]
+    text: str
+    sentAt: str
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional
+from typing import List, Literal, Optional
 
 class Document(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
@@ -10,6 +10,7 @@ class Document(BaseModel):
     source_name: str
     status: str
     storage_path: Optional[str] = None
+    content_hash: Optional[str] = None
     lastUpdated: str = Field(alias="last_updated")
 
 class DocumentCreate(BaseModel):
@@ -17,5 +18,25 @@ class DocumentCreate(BaseModel):
     source_name: str
     storage_path: Optional[str] = None
     content: Optional[str] = None
+    content_hash: Optional[str] = None
     chatbot_id: str
-    user_id: str
\ No newline at end of file
+    user_id: str
+
+class BulkUrlDocumentsRequest(BaseModel):
+    urls: List[str] = Field(min_length=1)
+
+class BulkDeleteDocumentsRequest(BaseModel):
+    document_ids: List[str] = Field(min_length=1)
+
+class BulkDocumentResult(BaseModel):
+    # The URL or document id this result is for, as sent.
+    item: str
+    status: Literal["created", "deleted", "duplicate", "invalid", "not_found"]
+    document: Optional[Document] = None
+    detail: Optional[str] = None
+
+class BulkDocumentsResponse(BaseModel):
+    results: List[BulkDocumentResult]
+
+class DocumentRefreshResponse(BaseModel):
+    queued: int
@@ -0,0 +1,31 @@
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional
+
+class AgentUpdate(BaseModel):
+    departments: List[str] = Field(default=["general"], min_length=1, max_length=20)
+    capacity: int = Field(default=3, ge=1, le=100)
+    status: Literal["online", "away", "offline"] = "online"
+
+class AgentState(BaseModel):
+    id: str
+    departments: List[str]
+    capacity: int
+    status: Literal["online", "away", "offline"]
+    load: float
+    activeConversations: List[str]
+
+class RoutingRequest(BaseModel):
+    conversationId: str = Field(..., min_length=1, max_length=100)
+    department: str = Field(default="general", min_length=1, max_length=100)
+    priority: Literal["low", "normal", "high", "urgent"] = "normal"
+    plan: str = "free"
+
+class RoutingAssignment(BaseModel):
+    conversationId: str
+    status: Literal["assigned", "waiting"]
+    agentId: Optional[str] = None
+
+class RoutingSnapshot(BaseModel):
+    agents: List[AgentState]
+    # department -> conversations waiting
+    waiting: Dict[str, int]
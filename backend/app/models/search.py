@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+from typing import List, Literal
+
+class SearchResult(BaseModel):
+    documentId: str
+    chunkIndex: int
+    text: str
+    score: float
+
+class SearchResponse(BaseModel):
+    query: str
+    mode: Literal["lexical", "semantic"] = "lexical"
+    results: List[SearchResult]
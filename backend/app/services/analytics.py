@@ -0,0 +1,166 @@
+"""
+Write-behind buffering for per-chatbot analytics.
+
+Widget traffic produces a stream of tiny increments (a new conversation, a
+message, an unanswered question). Writing each one would make every busy
+chatbot's row a point of contention, so increments are coalesced in memory
+per chatbot and flushed in bulk through the `record_analytics` function (see
+SUPABASE.md, section 8): once per `flush_interval`, or sooner when
+`flush_threshold` increments are pending. Whatever is pending at shutdown is
+flushed by the lifespan hook.
+
+Only the service role may call `record_analytics`, so without
+`SUPABASE_SERVICE_ROLE_KEY` the buffer is disabled and drops increments.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.db.supabase import get_service_postgrest_client
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingCounts:
+    __slots__ = ("conversations", "events", "first_at")
+
+    def __init__(self, first_at: float):
+        self.conversations = 0
+        self.events: Counter = Counter()
+        self.first_at = first_at
+
+    def merge(self, other: "_PendingCounts") -> None:
+        self.conversations += other.conversations
+        self.events.update(other.events)
+        self.first_at = min(self.first_at, other.first_at)
+
+
+class AnalyticsBuffer:
+    """Coalesces per-chatbot increments and writes them in bulk."""
+
+    def __init__(self, flush_interval: float, flush_threshold: int, batch_size: int, enabled: bool = True):
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.batch_size = batch_size
+        self._pending: Dict[str, _PendingCounts] = {}
+        self._pending_increments = 0
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.flushed_increments = 0
+        self.last_flush_seconds = 0.0
+        self.last_flush_lag_seconds = 0.0
+        self.max_flush_lag_seconds = 0.0
+
+    def _counts(self, chatbot_id: str, increments: int) -> _PendingCounts:
+        counts = self._pending.get(chatbot_id)
+        if counts is None:
+            counts = self._pending[chatbot_id] = _PendingCounts(time.monotonic())
+        self._pending_increments += increments
+        if self._pending_increments >= self.flush_threshold:
+            self._wakeup.set()
+        return counts
+
+    def record_conversation(self, chatbot_id: str) -> None:
+        if self.enabled:
+            self._counts(chatbot_id, 1).conversations += 1
+
+    def record_event(self, chatbot_id: str, name: str, count: int = 1) -> None:
+        if self.enabled:
+            self._counts(chatbot_id, count).events[name] += count
+
+    def start(self) -> None:
+        if not self.enabled:
+            logger.warning("SUPABASE_SERVICE_ROLE_KEY is not set; widget analytics will not be recorded")
+            return
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Writes everything pending. Batches that fail are merged back and retried on the next flush."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            increments, self._pending_increments = self._pending_increments, 0
+
+            started = time.monotonic()
+            lag = started - min(counts.first_at for counts in pending.values())
+            items = list(pending.items())
+            failed: List[tuple] = []
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                try:
+                    await get_service_postgrest_client().rpc('record_analytics', {"p_batch": [
+                        {"chatbot_id": chatbot_id, "conversations": counts.conversations, "events": dict(counts.events)}
+                        for chatbot_id, counts in batch
+                    ]}).execute()
+                except Exception as e:
+                    logger.warning("Analytics flush of %d chatbots failed: %s", len(batch), e)
+                    failed.extend(batch)
+
+            for chatbot_id, counts in failed:
+                current = self._pending.get(chatbot_id)
+                if current is None:
+                    self._pending[chatbot_id] = counts
+                else:
+                    current.merge(counts)
+                self._pending_increments += counts.conversations + sum(counts.events.values())
+
+            self.flushes += 1
+            self.failed_flushes += bool(failed)
+            self.flushed_increments += increments - sum(
+                counts.conversations + sum(counts.events.values()) for _, counts in failed
+            )
+            self.last_flush_seconds = time.monotonic() - started
+            self.last_flush_lag_seconds = lag
+            self.max_flush_lag_seconds = max(self.max_flush_lag_seconds, lag)
+            if lag > 10 * self.flush_interval:
+                logger.warning("Analytics are flushing %.1fs behind (%d chatbots pending retry)", lag, len(failed))
+
+    def stats(self) -> dict:
+        """Flush lag is the age of the oldest increment when its flush started."""
+        now = time.monotonic()
+        oldest = min((counts.first_at for counts in self._pending.values()), default=now)
+        return {
+            "enabled": self.enabled,
+            "pending_chatbots": len(self._pending),
+            "pending_increments": self._pending_increments,
+            "pending_age_seconds": now - oldest,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "flushed_increments": self.flushed_increments,
+            "last_flush_seconds": self.last_flush_seconds,
+            "last_flush_lag_seconds": self.last_flush_lag_seconds,
+            "max_flush_lag_seconds": self.max_flush_lag_seconds,
+        }
+
+
+analytics_buffer = AnalyticsBuffer(
+    flush_interval=settings.ANALYTICS_FLUSH_INTERVAL_SECONDS,
+    flush_threshold=settings.ANALYTICS_FLUSH_THRESHOLD,
+    batch_size=settings.ANALYTICS_BATCH_SIZE,
+    enabled=bool(settings.SUPABASE_SERVICE_ROLE_KEY),
+)
@@ -0,0 +1,241 @@
+"""
+Cache of widget answers per chatbot.
+
+Visitors of one chatbot ask the same few questions over and over. Answers are
+cached per chatbot under the normalized question (lowercased words, without
+punctuation). A lookup tries that exact key first. If there is no exact match,
+it takes the most similar cached question, by cosine similarity of hashed
+question embeddings, if that is at least ANSWER_CACHE_SIMILARITY. Questions
+of at most ANSWER_CACHE_SHORT_QUESTION_WORDS words must reach the stricter
+ANSWER_CACHE_SHORT_QUESTION_SIMILARITY, since one word changes their meaning
+more. The embeddings hash every word of the normalized question, stopwords
+included, and a cached question only matches if it has the same negations:
+"is the Pro plan not refundable" must not get the answer to "is the Pro plan
+refundable".
+
+Each chatbot's cache is an LRU map with a TTL on its entries and a budget of
+entries and bytes. The chatbots themselves are LRU-bounded too. A chatbot's
+entries are dropped whenever its documents or its settings change. Every
+worker process has its own cache, and `invalidate` only reaches the one that
+made the change. So entries are also tagged with the knowledge-base version
+the caller passes in, the chatbot's vector index version, which all workers
+on a host see change. An answer can still draw on another worker's lexical
+index for up to SEARCH_INDEX_TTL_SECONDS, which the TTL matches. Counters
+report the hit ratio and the answer time saved, which is the measured compute
+time of each answer, counted again on every hit.
+"""
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Hashable, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.vectors import HashingEmbedder
+
+_WORD = re.compile(r"\w+")
+# "t" is what is left of "n't" once "don't" is split into words.
+_NEGATIONS = frozenset({"no", "not", "never", "nor", "none", "nothing", "neither", "without", "cannot", "t"})
+
+
+def question_words(question: str) -> List[str]:
+    return _WORD.findall(question.lower())
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question_words(question))
+
+
+def negations(words: List[str]) -> FrozenSet[str]:
+    return frozenset(word for word in words if word in _NEGATIONS)
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    sources: List[dict]
+    # Seconds it took to retrieve and compose the answer.
+    cost: float
+    vector: np.ndarray
+    negations: FrozenSet[str]
+    expires_at: float
+    size: int
+
+
+class _ChatbotAnswers:
+    def __init__(self, knowledge: Hashable):
+        # The knowledge-base version every entry was answered from.
+        self.knowledge = knowledge
+        self.entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self.bytes = 0
+        # Stacked vectors of `entries`, in order; rebuilt lazily after changes.
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: List[str] = []
+
+    def add(self, key: str, entry: CachedAnswer) -> None:
+        self.entries[key] = entry
+        self.bytes += entry.size
+        self._matrix = None
+
+    def remove(self, key: str) -> None:
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+        self._matrix = None
+
+    def most_similar(self, vector: np.ndarray, negations: FrozenSet[str]):
+        """The most similar cached question with the same negations, or None."""
+        if self._matrix is None:
+            self._keys = list(self.entries)
+            self._matrix = np.stack([self.entries[key].vector for key in self._keys])
+        scores = self._matrix @ vector
+        mismatched = [i for i, key in enumerate(self._keys) if self.entries[key].negations != negations]
+        scores[mismatched] = -np.inf
+        best = int(np.argmax(scores))
+        if np.isneginf(scores[best]):
+            return None
+        return self._keys[best], float(scores[best])
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        ttl: float,
+        max_chatbots: int,
+        max_entries: int,
+        max_bytes: int,
+        similarity: float,
+        dimensions: int,
+        short_question_words: int = 0,
+        short_question_similarity: float = 1.0,
+    ):
+        self.ttl = ttl
+        self.max_chatbots = max_chatbots
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.similarity = similarity
+        self.short_question_words = short_question_words
+        self.short_question_similarity = short_question_similarity
+        self.embed = HashingEmbedder(dimensions, tokenizer=question_words)
+        self._chatbots: "OrderedDict[str, _ChatbotAnswers]" = OrderedDict()
+        # Bumped on invalidation, so an answer computed from the old knowledge base is not stored.
+        self._generations: Dict[str, int] = {}
+        self.lookups = 0
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.seconds_saved = 0.0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def lookup(self, chatbot_id: str, question: str, knowledge: Hashable) -> Optional[CachedAnswer]:
+        self.lookups += 1
+        answers = self._chatbots.get(chatbot_id)
+        if answers is None:
+            return None
+        if answers.knowledge != knowledge:
+            # Changed in another worker process.
+            del self._chatbots[chatbot_id]
+            self.invalidations += 1
+            return None
+        self._chatbots.move_to_end(chatbot_id)
+
+        now = time.monotonic()
+        for key in [key for key, entry in answers.entries.items() if entry.expires_at <= now]:
+            answers.remove(key)
+        if not answers.entries:
+            return None
+
+        words = question_words(question)
+        key = " ".join(words)
+        entry = answers.entries.get(key)
+        if entry is not None:
+            self.exact_hits += 1
+        else:
+            vector = self.embed([question])[0]
+            if not vector.any():
+                return None
+            match = answers.most_similar(vector, negations(words))
+            if match is None:
+                return None
+            key, score = match
+            if score < self._threshold(words):
+                return None
+            entry = answers.entries[key]
+            self.similar_hits += 1
+        answers.entries.move_to_end(key)
+        self.seconds_saved += entry.cost
+        return entry
+
+    def _threshold(self, words: List[str]) -> float:
+        if len(words) <= self.short_question_words:
+            return max(self.similarity, self.short_question_similarity)
+        return self.similarity
+
+    def generation(self, chatbot_id: str) -> int:
+        """Read before computing an answer, and pass to `store`."""
+        return self._generations.get(chatbot_id, 0)
+
+    def store(
+        self, chatbot_id: str, generation: int, knowledge: Hashable, question: str, answer: str, sources: List[dict], cost: float
+    ) -> None:
+        """`knowledge` is the knowledge-base version read before computing the answer, as passed to `lookup`."""
+        words = question_words(question)
+        key = " ".join(words)
+        if not key or generation != self.generation(chatbot_id):
+            return
+        vector = self.embed([question])[0]
+        size = len(key) + len(answer.encode()) + vector.nbytes + 64 * (len(sources) + 1)
+        if size > self.max_bytes:
+            return
+
+        answers = self._chatbots.get(chatbot_id)
+        if answers is not None and answers.knowledge != knowledge:
+            # Whichever version is stale, the next lookup drops it.
+            del self._chatbots[chatbot_id]
+            answers = None
+        if answers is None:
+            answers = self._chatbots[chatbot_id] = _ChatbotAnswers(knowledge)
+            while len(self._chatbots) > self.max_chatbots:
+                _, evicted = self._chatbots.popitem(last=False)
+                self.evictions += len(evicted.entries)
+        self._chatbots.move_to_end(chatbot_id)
+
+        if key in answers.entries:
+            answers.remove(key)
+        while answers.entries and (len(answers.entries) >= self.max_entries or answers.bytes + size > self.max_bytes):
+            answers.remove(next(iter(answers.entries)))
+            self.evictions += 1
+        answers.add(key, CachedAnswer(answer, sources, cost, vector, negations(words), time.monotonic() + self.ttl, size))
+
+    def invalidate(self, chatbot_id: str) -> None:
+        self._generations[chatbot_id] = self.generation(chatbot_id) + 1
+        if self._chatbots.pop(chatbot_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, float]:
+        hits = self.exact_hits + self.similar_hits
+        return {
+            "chatbots": len(self._chatbots),
+            "entries": sum(len(answers.entries) for answers in self._chatbots.values()),
+            "bytes": sum(answers.bytes for answers in self._chatbots.values()),
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "hit_ratio": hits / self.lookups if self.lookups else 0.0,
+            "seconds_saved": self.seconds_saved,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+answer_cache = AnswerCache(
+    ttl=settings.ANSWER_CACHE_TTL_SECONDS,
+    max_chatbots=settings.ANSWER_CACHE_MAX_CHATBOTS,
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    max_bytes=settings.ANSWER_CACHE_MAX_BYTES_PER_CHATBOT,
+    similarity=settings.ANSWER_CACHE_SIMILARITY,
+    dimensions=settings.ANSWER_CACHE_DIMENSIONS,
+    short_question_words=settings.ANSWER_CACHE_SHORT_QUESTION_WORDS,
+    short_question_similarity=settings.ANSWER_CACHE_SHORT_QUESTION_SIMILARITY,
+)
@@ -0,0 +1,85 @@
+"""
+Answers to widget visitors, composed from a chatbot's knowledge base.
+
+Passages are retrieved from both the lexical (BM25) and the vector index and
+merged with reciprocal rank fusion. The answer is extractive: the sentences of
+the top passages that best cover the question, in passage order. It is
+produced as a stream of small text pieces so the widget can render it while
+it is still being composed.
+"""
+import asyncio
+import re
+from dataclasses import dataclass
+from typing import Iterator, List
+
+from app.core.config import settings
+from app.db.supabase import get_service_postgrest_client
+from app.services.chunking import tokenize
+from app.services.search import search_indexes
+from app.services.vectors import vector_store
+
+NO_ANSWER_TEXT = "Sorry, I couldn't find anything about that in my knowledge base."
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+_RRF_K = 60
+
+
+@dataclass
+class Passage:
+    document_id: str
+    chunk_index: int
+    text: str
+    score: float
+
+
+async def retrieve_passages(chatbot_id: str, question: str, limit: int) -> List[Passage]:
+    """Returns the top passages for a question, fusing lexical and semantic rankings."""
+    if settings.SUPABASE_SERVICE_ROLE_KEY:
+        index = await search_indexes.get(chatbot_id, get_service_postgrest_client())
+    else:
+        # Visitors are anonymous, and without the service role RLS hides the
+        # documents; use the lexical index only if an owner's search loaded it.
+        index = search_indexes.loaded(chatbot_id)
+
+    lexical = index.search(question, limit) if index is not None else []
+    semantic = await asyncio.to_thread(vector_store.search, chatbot_id, question, limit)
+
+    fused = {}
+    for hits in (lexical, semantic):
+        for rank, hit in enumerate(hits):
+            key = (hit.document_id, hit.chunk_index)
+            passage = fused.get(key)
+            if passage is None:
+                passage = fused[key] = Passage(hit.document_id, hit.chunk_index, hit.text, 0.0)
+            passage.score += 1.0 / (_RRF_K + rank + 1)
+    return sorted(fused.values(), key=lambda p: p.score, reverse=True)[:limit]
+
+
+def compose_answer(question: str, passages: List[Passage], max_sentences: int) -> str:
+    """Picks the sentences that share the most terms with the question."""
+    question_terms = set(tokenize(question))
+    candidates = []
+    for passage_rank, passage in enumerate(passages):
+        for position, sentence in enumerate(_SENTENCE_BOUNDARY.split(passage.text)):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            overlap = len(question_terms.intersection(tokenize(sentence)))
+            if overlap:
+                candidates.append((overlap, -passage_rank, -position, sentence))
+
+    if not candidates:
+        # Nothing matches term-for-term (e.g. a semantic-only hit): lead with the best passage.
+        return passages[0].text.strip() if passages else NO_ANSWER_TEXT
+
+    best = sorted(candidates, reverse=True)[:max_sentences]
+    best.sort(key=lambda c: (-c[1], -c[2]))
+    sentences = list(dict.fromkeys(c[3] for c in best))
+    return " ".join(sentences)
+
+
+def stream_text(text: str, words_per_piece: int) -> Iterator[str]:
+    """Splits an answer into pieces of a few words, keeping the original spacing."""
+    pieces = re.findall(r"\S+\s*", text)
+    for start in range(0, len(pieces), words_per_piece):
+        yield "".join(pieces[start:start + words_per_piece])
@@ -0,0 +1,219 @@
+"""
+Widget bootstrap bundles.
+
+A bundle holds everything the widget needs to start, in one response: the
+widget config (including `initialMessages`) and answers to the chatbot's FAQ
+questions, precomputed from its knowledge base. The bundle is serialized and
+compressed once when it is built: gzip always, brotli when the `brotli` package
+is installed. After that, serving it is a dictionary lookup.
+
+A bundle's version is the chatbot's revision, the time it was last saved,
+followed by a hash of the bundle's content. That makes the versioned URL
+`/api/widget/{bot_id}/bootstrap/{version}` immutable, so browsers and CDNs can
+cache it for good, and versions sort by when the chatbot was saved. A bundle
+is rebuilt when its chatbot is saved. It is dropped when the chatbot's
+documents change, because the answers depend on them, and the next request
+rebuilds it. Both only happen in the worker that handled the change. Other
+workers catch up when their bundle expires after BOOTSTRAP_TTL_SECONDS, or
+sooner when they are asked for a version they do not have (see `reload`).
+"""
+import asyncio
+import gzip
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+import orjson
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.supabase import get_postgrest_client
+from app.services.answers import compose_answer, retrieve_passages
+
+try:
+    import brotli
+except ImportError:  # Optional: without it, bundles are offered gzipped only.
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+BOOTSTRAP_COLUMNS = (
+    "name, greeting, placeholder, primary_color, position, size, show_avatar, "
+    "enable_typing, initial_messages, faq_questions, last_updated"
+)
+# A bundle younger than this is not reloaded for a version it does not match,
+# so requests for unknown versions cannot make every request a rebuild.
+RELOAD_MIN_AGE_SECONDS = 1.0
+
+
+def chatbot_revision(chatbot: dict) -> int:
+    """The chatbot's `last_updated` in microseconds since the epoch, or 0 if it has none."""
+    try:
+        return int(datetime.fromisoformat(chatbot["last_updated"].replace("Z", "+00:00")).timestamp() * 1_000_000)
+    except (KeyError, AttributeError, ValueError):
+        return 0
+
+
+def version_revision(version: str) -> Optional[int]:
+    """The chatbot revision a bundle version was built from, or None for a malformed version."""
+    revision, separator, _ = version.partition("-")
+    if not separator:
+        return None
+    try:
+        return int(revision, 16)
+    except ValueError:
+        return None
+
+
+def widget_config_data(chatbot: dict) -> dict:
+    """The widget's view of a `chatbots` row."""
+    return {
+        "name": chatbot.get("name"),
+        "greeting": chatbot.get("greeting"),
+        "placeholder": chatbot.get("placeholder"),
+        "primaryColor": chatbot.get("primary_color"),
+        "position": chatbot.get("position"),
+        "size": chatbot.get("size"),
+        "showAvatar": chatbot.get("show_avatar"),
+        "enableTyping": chatbot.get("enable_typing"),
+        "initialMessages": chatbot.get("initial_messages", [])
+    }
+
+
+@dataclass(frozen=True)
+class Bundle:
+    version: str
+    # Content-Encoding ("identity", "gzip", "br") -> body
+    bodies: Dict[str, bytes]
+    revision: int
+    # time.monotonic() when it was built.
+    built_at: float
+
+
+def _encode(body: bytes) -> Dict[str, bytes]:
+    # mtime=0 keeps the gzip bytes a pure function of the content.
+    bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(body, quality=11)
+    return bodies
+
+
+def choose_encoding(accept_encoding: Optional[str], available) -> str:
+    """Picks the smallest encoding the client accepts: brotli, then gzip, else identity."""
+    accepted: Dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+async def build_bundle(bot_id: str, chatbot: dict) -> Bundle:
+    faqs = []
+    for question in (chatbot.get("faq_questions") or [])[:settings.BOOTSTRAP_MAX_FAQS]:
+        passages = await retrieve_passages(bot_id, question, settings.WIDGET_ANSWER_PASSAGES)
+        faqs.append({
+            "question": question,
+            "answer": compose_answer(question, passages, settings.WIDGET_ANSWER_MAX_SENTENCES),
+            "sources": [{"documentId": p.document_id, "chunkIndex": p.chunk_index} for p in passages],
+        })
+
+    content = {"botId": bot_id, "config": widget_config_data(chatbot), "faqs": faqs}
+    revision = chatbot_revision(chatbot)
+    digest = hashlib.blake2b(orjson.dumps(content, option=orjson.OPT_SORT_KEYS), digest_size=8).hexdigest()
+    version = f"{revision:x}-{digest}"
+    body = orjson.dumps({**content, "version": version})
+    return Bundle(version, await asyncio.to_thread(_encode, body), revision, time.monotonic())
+
+
+class BootstrapBundles:
+    """The current bundle per active chatbot, built on demand and at most once at a time per chatbot."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._bundles = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._building: Dict[str, asyncio.Task] = {}
+        # Bumped on every change, so a build that started before it is not stored.
+        self._generations: Dict[str, int] = {}
+        self.builds = 0
+
+    async def get(self, bot_id: str) -> Optional[Bundle]:
+        """Returns the bundle of an active chatbot, or None if there is no such chatbot."""
+        bundle = self._bundles.get(bot_id)
+        if bundle is not None:
+            return bundle
+        task = self._building.get(bot_id)
+        if task is None:
+            task = self._building[bot_id] = asyncio.create_task(self._load(bot_id))
+            task.add_done_callback(lambda _: self._building.pop(bot_id, None))
+        return await asyncio.shield(task)
+
+    async def reload(self, bot_id: str) -> Optional[Bundle]:
+        """
+        Loads the chatbot's bundle again from the database, for when a client
+        asks for a version this worker does not have: the chatbot may have been
+        saved through another worker. Returns the current bundle instead if it
+        was built less than RELOAD_MIN_AGE_SECONDS ago.
+        """
+        bundle = self._bundles.get(bot_id)
+        if bundle is not None and time.monotonic() - bundle.built_at < RELOAD_MIN_AGE_SECONDS:
+            return bundle
+        self.invalidate(bot_id)
+        return await self.get(bot_id)
+
+    async def _load(self, bot_id: str) -> Optional[Bundle]:
+        generation = self._generations.get(bot_id, 0)
+        response = await (
+            get_postgrest_client().table('chatbots')
+            .select(BOOTSTRAP_COLUMNS)
+            .eq('id', bot_id)
+            .eq('status', 'active')
+            .limit(1).execute()
+        )
+        if not response.data:
+            return None
+        bundle = await build_bundle(bot_id, response.data[0])
+        self.builds += 1
+        if self._generations.get(bot_id, 0) == generation:
+            self._bundles.set(bot_id, bundle)
+        return bundle
+
+    async def rebuild(self, bot_id: str, chatbot: dict) -> None:
+        """Rebuilds a chatbot's bundle from its saved row; a failed build just leaves it to be built on demand."""
+        self.invalidate(bot_id)
+        if chatbot.get("status") != "active":
+            return
+        generation = self._generations[bot_id]
+        try:
+            bundle = await build_bundle(bot_id, chatbot)
+        except Exception as e:
+            logger.warning("Could not rebuild the bootstrap bundle of chatbot %s: %s", bot_id, e)
+            return
+        self.builds += 1
+        if self._generations[bot_id] == generation:
+            self._bundles.set(bot_id, bundle)
+
+    def invalidate(self, bot_id: str) -> None:
+        self._generations[bot_id] = self._generations.get(bot_id, 0) + 1
+        self._bundles.invalidate(bot_id)
+
+    def stats(self) -> dict:
+        return {**self._bundles.stats(), "builds": self.builds, "building": len(self._building), "brotli": brotli is not None}
+
+
+bootstrap_bundles = BootstrapBundles(
+    maxsize=settings.BOOTSTRAP_CACHE_SIZE,
+    ttl=settings.BOOTSTRAP_TTL_SECONDS,
+)
@@ -0,0 +1,59 @@
+import hashlib
+import re
+from typing import List
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how i if in into is it its me my
+no not of on or our so that the their them then there these they this to was we
+what when where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercases the text and splits it into word tokens, dropping stopwords."""
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def text_hash(text: str) -> str:
+    """A short, stable fingerprint of a document's or chunk's text, for change detection."""
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def chunk_text(text: str, max_words: int = 200, overlap_words: int = 40) -> List[str]:
+    """
+    Splits a document into passages of roughly `max_words` words.
+
+    Paragraphs are packed together until the budget is reached; paragraphs
+    longer than the budget are split with `overlap_words` of overlap so an
+    answer spanning the boundary still lands whole in one chunk.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    current_words = 0
+
+    def flush():
+        nonlocal current, current_words
+        if current:
+            chunks.append("\n\n".join(current))
+        current, current_words = [], 0
+
+    for paragraph in (p.strip() for p in text.split("\n\n")):
+        if not paragraph:
+            continue
+        words = paragraph.split()
+        if len(words) > max_words:
+            flush()
+            step = max(max_words - overlap_words, 1)
+            for start in range(0, len(words), step):
+                chunks.append(" ".join(words[start:start + max_words]))
+                if start + max_words >= len(words):
+                    break
+            continue
+        if current_words + len(words) > max_words:
+            flush()
+        current.append(paragraph)
+        current_words += len(words)
+    flush()
+    return chunks
@@ -0,0 +1,352 @@
+"""
+Fetching web pages for URL documents.
+
+Every URL fetch goes through one `Crawler`, which bounds how hard a customer's
+site is hit: at most `max_concurrency` requests are in flight overall and
+`per_host_concurrency` per host. Fetches are conditional when a document
+already carries the `ETag` / `Last-Modified` of an earlier crawl, so
+re-crawling an unchanged page costs a 304 and no extraction. HTML pages also
+yield their same-site links, which ingestion follows up to the depth the user
+asked for, within the page budget of a `CrawlSession`.
+
+URLs come from users, so every connection, including each redirect hop, must
+go to a public address: loopback, private, link-local (cloud metadata) and
+other reserved ranges are refused. The check lives in the network backend
+that opens the connections. It resolves the host, vets every address, and
+connects to a vetted address itself, so a DNS answer that changes between the
+check and the connect (DNS rebinding) cannot redirect the fetch. TLS still
+verifies, and sends SNI for, the host name. Redirects are followed by hand
+and must stay on the host of the URL that was asked for.
+
+The HTTP transport can be injected, e.g. an `httpx.ASGITransport` wrapping
+`benchmarks/fake_site.py`. An injected transport is trusted to do its own
+address checks.
+"""
+import asyncio
+import contextlib
+import ipaddress
+import socket
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Set
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import httpcore
+import httpx
+
+from app.core.config import settings
+from app.services.extraction import ExtractionError
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+
+class UnsafeURLError(ExtractionError):
+    """Raised for URLs the crawler refuses to fetch. Retrying will not help."""
+
+
+def is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+class _PublicAddressBackend(httpcore.AsyncNetworkBackend):
+    """Opens TCP connections only to public addresses, connecting to the address it vetted."""
+
+    def __init__(self):
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        vetted = list(dict.fromkeys(sockaddr[0] for *_, sockaddr in addresses))
+        if not vetted or not all(is_public_address(address) for address in vetted):
+            raise UnsafeURLError(f"Refusing to connect to {host}: it does not resolve to a public address.")
+        error: Optional[Exception] = None
+        for address in vetted:
+            try:
+                stream = await self._backend.connect_tcp(
+                    address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+                continue
+            peer = stream.get_extra_info("server_addr")
+            if not peer or not is_public_address(peer[0]):
+                await stream.aclose()
+                raise UnsafeURLError(f"Refusing the connection to {host}: its peer is not a public address.")
+            return stream
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        raise UnsafeURLError("Refusing to connect to a Unix socket.")
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+class _PublicAddressTransport(httpx.AsyncHTTPTransport):
+    """The default transport, with its connection pool on `_PublicAddressBackend` and no proxies from the environment."""
+
+    def __init__(self):
+        super().__init__(trust_env=False)
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(trust_env=False),
+            # httpx's default limits.
+            max_connections=100,
+            max_keepalive_connections=20,
+            keepalive_expiry=5.0,
+            network_backend=_PublicAddressBackend(),
+        )
+
+
+@dataclass
+class Page:
+    url: str
+    status_code: int
+    body: bytes = b""
+    content_type: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status_code == 304
+
+    @property
+    def is_html(self) -> bool:
+        return (self.content_type or "").split(";")[0].strip().lower() in HTML_CONTENT_TYPES
+
+
+def normalize_url(url: str) -> str:
+    """Drops the fragment and lower-cases scheme and host, so one page has one URL."""
+    url, _ = urldefrag(url.strip())
+    parsed = urlparse(url)
+    return parsed._replace(scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower()).geturl()
+
+
+class _LinkParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.base: Optional[str] = None
+        self.hrefs: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.hrefs.append(href)
+        elif tag == "base" and self.base is None:
+            self.base = dict(attrs).get("href")
+
+
+def same_site_links(page_url: str, body: bytes, host: str) -> List[str]:
+    """
+    Returns the distinct http(s) links of an HTML page that stay on `host`, in
+    document order. Free of app state so it can run in a worker process.
+    """
+    parser = _LinkParser()
+    parser.feed(body.decode("utf-8", errors="replace"))
+    base = urljoin(page_url, parser.base) if parser.base else page_url
+
+    links: List[str] = []
+    seen: Set[str] = set()
+    for href in parser.hrefs:
+        url = normalize_url(urljoin(base, href))
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or parsed.hostname != host or url in seen:
+            continue
+        seen.add(url)
+        links.append(url)
+    return links
+
+
+class CrawlSession:
+    """
+    State shared by every page of one site crawl: the host it is confined to,
+    how many more pages it may add, and the URLs it has already claimed.
+    """
+
+    def __init__(self, root_url: str, max_pages: int):
+        root = normalize_url(root_url)
+        self.host = urlparse(root).hostname
+        self.remaining = max_pages - 1
+        self.seen: Set[str] = {root}
+
+    def claim(self, urls: List[str]) -> List[str]:
+        """Returns the URLs not crawled yet, up to the remaining page budget."""
+        claimed = []
+        for url in urls:
+            if self.remaining <= 0:
+                break
+            if url not in self.seen:
+                self.seen.add(url)
+                self.remaining -= 1
+                claimed.append(url)
+        return claimed
+
+
+class Crawler:
+    """Bounded-concurrency, conditional HTTP fetching."""
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        per_host_concurrency: int,
+        max_bytes: int,
+        timeout: float,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        allow_private_addresses: bool = False,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.transport = transport
+        self.allow_private_addresses = allow_private_addresses
+        self._client: Optional[httpx.AsyncClient] = None
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._host_users: Dict[str, int] = {}
+        self.in_flight = 0
+        self.fetched = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.refused = 0
+
+    def start(self) -> None:
+        if self._client is None:
+            transport = self.transport
+            if transport is None and not self.allow_private_addresses:
+                transport = _PublicAddressTransport()
+            self._client = httpx.AsyncClient(
+                transport=transport,
+                follow_redirects=False,
+                timeout=httpx.Timeout(self.timeout),
+                headers={"User-Agent": "ChatFlowBot/1.0"},
+            )
+
+    async def stop(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, host: str):
+        """Holds a per-host slot, then a global one, so a busy host never ties up global slots while it waits."""
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = self._hosts[host] = asyncio.Semaphore(self.per_host_concurrency)
+        self._host_users[host] = self._host_users.get(host, 0) + 1
+        try:
+            async with semaphore, self._global:
+                self.in_flight += 1
+                try:
+                    yield
+                finally:
+                    self.in_flight -= 1
+        finally:
+            self._host_users[host] -= 1
+            if not self._host_users[host]:
+                del self._host_users[host]
+                del self._hosts[host]
+
+    @staticmethod
+    def _check_url(url: str, host: str) -> None:
+        """Raises `UnsafeURLError` unless `url` is http(s) on `host`. Addresses are checked when connecting."""
+        parsed = urlparse(url)
+        try:
+            parsed.port
+        except ValueError:
+            raise UnsafeURLError(f"{url} has an invalid port.")
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise UnsafeURLError(f"{url} is not an http(s) URL.")
+        if parsed.hostname != host:
+            raise UnsafeURLError(f"Refusing to follow a redirect from {host} to {parsed.hostname}.")
+
+    async def _send(self, url: str, headers: Dict[str, str]) -> httpx.Response:
+        """
+        Sends the GET with a streamed body, following redirects on the same host.
+        The caller closes the response.
+        """
+        host = urlparse(url).hostname or ""
+        target = url
+        for _ in range(MAX_REDIRECTS + 1):
+            self._check_url(target, host)
+            response = await self._client.send(self._client.build_request("GET", target, headers=headers), stream=True)
+            location = response.headers.get("location")
+            if response.status_code not in REDIRECT_STATUSES or not location:
+                return response
+            await response.aclose()
+            target = urljoin(target, location)
+        raise UnsafeURLError(f"{url} redirected more than {MAX_REDIRECTS} times.")
+
+    async def fetch(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> Page:
+        """
+        GETs a page, conditionally when validators from an earlier crawl are given.
+        A 304 comes back as a `Page` with `not_modified` set and no body. Raises
+        `UnsafeURLError` for URLs that are not safe to fetch (see above).
+        """
+        self.start()
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        async with self._slot(urlparse(url).hostname or ""):
+            try:
+                response = await self._send(url, headers)
+                async with contextlib.aclosing(response):
+                    if response.status_code == 304:
+                        self.not_modified += 1
+                        return Page(
+                            url,
+                            304,
+                            etag=response.headers.get("etag", etag),
+                            last_modified=response.headers.get("last-modified", last_modified),
+                        )
+                    response.raise_for_status()
+                    chunks, size = [], 0
+                    async for chunk in response.aiter_bytes():
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise ExtractionError(f"{url} is larger than {self.max_bytes} bytes.")
+                        chunks.append(chunk)
+            except UnsafeURLError:
+                self.refused += 1
+                raise
+            except Exception:
+                self.errors += 1
+                raise
+
+        self.fetched += 1
+        return Page(
+            url,
+            response.status_code,
+            b"".join(chunks),
+            response.headers.get("content-type"),
+            response.headers.get("etag"),
+            response.headers.get("last-modified"),
+        )
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "active_hosts": len(self._hosts),
+            "fetched": self.fetched,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "refused": self.refused,
+        }
+
+
+crawler = Crawler(
+    max_concurrency=settings.CRAWLER_MAX_CONCURRENCY,
+    per_host_concurrency=settings.CRAWLER_PER_HOST_CONCURRENCY,
+    max_bytes=settings.MAX_UPLOAD_SIZE_BYTES,
+    timeout=settings.CRAWLER_TIMEOUT_SECONDS,
+    allow_private_addresses=settings.CRAWLER_ALLOW_PRIVATE_ADDRESSES,
+)
@@ -0,0 +1,187 @@
+"""
+Text extraction for knowledge-base documents.
+
+Everything here is CPU-bound and free of app state, so the ingestion pipeline
+can run it inside worker processes.
+"""
+import io
+import re
+import unicodedata
+import zipfile
+from html.parser import HTMLParser
+from typing import Optional
+from xml.etree import ElementTree
+
+
+class ExtractionError(Exception):
+    """Raised when a document's text cannot be extracted."""
+
+
+EXTENSION_FORMATS = {
+    "pdf": "pdf",
+    "docx": "docx",
+    "html": "html",
+    "htm": "html",
+    "md": "markdown",
+    "markdown": "markdown",
+    "txt": "text",
+    "text": "text",
+    "csv": "text",
+}
+
+CONTENT_TYPE_FORMATS = {
+    "application/pdf": "pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+    "text/html": "html",
+    "application/xhtml+xml": "html",
+    "text/markdown": "markdown",
+    "text/plain": "text",
+}
+
+
+def detect_format(source_name: str, content_type: Optional[str] = None) -> str:
+    """Picks an extractor from the content type, falling back to the file extension."""
+    if content_type:
+        mime = content_type.split(";", 1)[0].strip().lower()
+        if mime in CONTENT_TYPE_FORMATS:
+            return CONTENT_TYPE_FORMATS[mime]
+    name = source_name.lower().split("?", 1)[0].split("#", 1)[0]
+    if "." in name.rsplit("/", 1)[-1]:
+        extension = name.rsplit(".", 1)[1]
+        if extension in EXTENSION_FORMATS:
+            return EXTENSION_FORMATS[extension]
+    if name.startswith(("http://", "https://")):
+        return "html"
+    return "text"
+
+
+def _decode(data: bytes) -> str:
+    for encoding in ("utf-8-sig", "utf-16"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("latin-1")
+
+
+def extract_pdf(data: bytes) -> str:
+    try:
+        from pypdf import PdfReader
+    except ImportError as e:
+        raise ExtractionError("PDF extraction requires the 'pypdf' package.") from e
+    try:
+        reader = PdfReader(io.BytesIO(data))
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+    except Exception as e:
+        raise ExtractionError(f"Could not read PDF: {e}") from e
+
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def extract_docx(data: bytes) -> str:
+    """Reads paragraph text straight from the document XML; no python-docx needed."""
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            root = ElementTree.fromstring(archive.read("word/document.xml"))
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise ExtractionError(f"Could not read DOCX: {e}") from e
+
+    paragraphs = []
+    for paragraph in root.iter(f"{WORD_NAMESPACE}p"):
+        parts = []
+        for node in paragraph.iter():
+            if node.tag == f"{WORD_NAMESPACE}t" and node.text:
+                parts.append(node.text)
+            elif node.tag == f"{WORD_NAMESPACE}tab":
+                parts.append("\t")
+            elif node.tag in (f"{WORD_NAMESPACE}br", f"{WORD_NAMESPACE}cr"):
+                parts.append("\n")
+        paragraphs.append("".join(parts))
+    return "\n".join(paragraphs)
+
+
+class _HTMLTextParser(HTMLParser):
+    SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "head"}
+    BLOCK_TAGS = {"p", "div", "br", "li", "ul", "ol", "tr", "table", "section", "article",
+                  "header", "footer", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def extract_html(data: bytes) -> str:
+    parser = _HTMLTextParser()
+    parser.feed(_decode(data))
+    parser.close()
+    return "".join(parser.parts)
+
+
+MARKDOWN_PATTERNS = [
+    (re.compile(r"```.*?\n(.*?)```", re.S), r"\1"),         # fenced code: keep the code
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"\1"),          # images: keep alt text
+    (re.compile(r"\[([^\]]+)\]\([^)]*\)"), r"\1"),           # links: keep link text
+    (re.compile(r"^[ \t]{0,3}#{1,6}[ \t]*", re.M), ""),        # headings
+    (re.compile(r"^[ \t]{0,3}>[ \t]?", re.M), ""),            # blockquotes
+    (re.compile(r"^[ \t]*([-*+]|\d+\.)[ \t]+", re.M), ""),    # list markers
+    (re.compile(r"(?<!\w)(\*\*|__|\*|_|~~|`)(?=\S)(.+?)(?<=\S)\1(?!\w)"), r"\2"),  # emphasis and inline code
+    (re.compile(r"^[ \t]*([-*_][ \t]*){3,}$", re.M), ""),     # horizontal rules
+]
+
+
+def extract_markdown(data: bytes) -> str:
+    text = _decode(data)
+    for pattern, replacement in MARKDOWN_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def extract_plain_text(data: bytes) -> str:
+    return _decode(data)
+
+
+EXTRACTORS = {
+    "pdf": extract_pdf,
+    "docx": extract_docx,
+    "html": extract_html,
+    "markdown": extract_markdown,
+    "text": extract_plain_text,
+}
+
+_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+_INLINE_WHITESPACE = re.compile(r"[ \t]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalizes the text and collapses runs of whitespace and blank lines."""
+    text = unicodedata.normalize("NFKC", text).replace("\r\n", "\n").replace("\r", "\n")
+    text = _CONTROL_CHARS.sub("", text)
+    text = _INLINE_WHITESPACE.sub(" ", text)
+    lines = (line.strip() for line in text.split("\n"))
+    text = "\n".join(lines)
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def extract_text(data: bytes, source_name: str, content_type: Optional[str] = None) -> str:
+    """Extracts and normalizes the text of a document. Runs in a worker process."""
+    document_format = detect_format(source_name, content_type)
+    return normalize_text(EXTRACTORS[document_format](data))
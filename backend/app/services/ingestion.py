@@ -0,0 +1,345 @@
+"""
+Background ingestion of knowledge-base documents.
+
+Uploads and URLs are queued as jobs after their `documents` row is created.
+A fixed number of async workers drain the queue: they fetch the raw bytes
+(from Storage or the web), hand text extraction to a bounded process pool so
+parsing never blocks the event loop, then write `content` and move the row to
+`completed` or, after retries are exhausted, `failed`. Completed documents are
+chunked into the chatbot's lexical index and embedded into its vector index.
+
+URLs are fetched through the shared `crawler`, which bounds load on customer
+sites and makes re-crawls conditional: a page that answers 304 is left as it
+is. Pages that do change, but whose extracted text hashes the same as what
+was indexed last time, are skipped too; otherwise only the chunks that
+changed are re-indexed and re-embedded. Jobs that belong to a site crawl add the page's same-site links as new
+documents, one level shallower, until the crawl's page budget runs out.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from app.core.config import settings
+from app.db.supabase import get_service_postgrest_client, get_service_storage_client
+from app.services.answer_cache import answer_cache
+from app.services.bootstrap import bootstrap_bundles
+from app.services.chunking import chunk_text, text_hash
+from app.services.crawler import CrawlSession, Page, crawler, same_site_links
+from app.services.extraction import ExtractionError, extract_text
+from app.services.search import search_indexes
+from app.services.vectors import vector_store
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IngestionJob:
+    document_id: str
+    chatbot_id: str
+    source_type: str
+    source_name: str
+    storage_path: Optional[str] = None
+    bucket: Optional[str] = None
+    content_type: Optional[str] = None
+    # Used for the job's database writes when no service role key is configured.
+    access_token: Optional[str] = None
+    user_id: Optional[str] = None
+    # Validators from the last crawl of a URL, sent to make the fetch conditional.
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # Hash of the text indexed for the document so far, if any, and the
+    # document's status when the job was queued (None if unknown).
+    text_hash: Optional[str] = None
+    status: Optional[str] = None
+    # Set on the jobs of a site crawl: how many more levels of links to follow.
+    crawl: Optional[CrawlSession] = None
+    crawl_depth: int = 0
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class IngestionPipeline:
+    """A bounded job queue drained by async workers backed by a process pool."""
+
+    def __init__(
+        self,
+        queue_size: int,
+        concurrency: int,
+        processes: int,
+        max_retries: int,
+        retry_backoff: float,
+        job_timeout: float,
+    ):
+        self.concurrency = concurrency
+        self.processes = processes
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.job_timeout = job_timeout
+        self._queue: "asyncio.Queue[IngestionJob]" = asyncio.Queue(maxsize=queue_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._workers = []
+        self._retry_tasks = set()
+        self._feeds: Dict[str, asyncio.Task] = {}
+        self.completed = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.retried = 0
+        self.discovered = 0
+        self.indexed_chunks = 0
+        self.embedded_chunks = 0
+        self.in_progress = 0
+        self.total_seconds = {"queued": 0.0, "fetch": 0.0, "extract": 0.0, "store": 0.0}
+
+    @property
+    def is_saturated(self) -> bool:
+        """True when the queue is full; callers should shed new work instead of waiting."""
+        return self._queue.full()
+
+    def has_room_for(self, count: int) -> bool:
+        """True if `count` more jobs fit in the queue right now."""
+        return self._queue.maxsize <= 0 or self._queue.maxsize - self._queue.qsize() >= count
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.processes)
+        crawler.start()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        tasks = [*self._workers, *self._retry_tasks, *self._feeds.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._retry_tasks.clear()
+        self._feeds.clear()
+        await crawler.stop()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def enqueue(self, job: IngestionJob) -> None:
+        """Queues a job, waiting for room if the queue is momentarily full."""
+        await self._queue.put(job)
+
+    def enqueue_later(self, jobs: List[IngestionJob], key: str) -> bool:
+        """
+        Feeds jobs into the queue from a background task as room frees up, for
+        batches larger than the queue (e.g. re-crawling a whole site). Only one
+        feed per `key` runs at a time; returns False if one is already running.
+        """
+        running = self._feeds.get(key)
+        if running is not None and not running.done():
+            return False
+        self._feeds[key] = asyncio.create_task(self._feed(key, jobs))
+        return True
+
+    async def _feed(self, key: str, jobs: Iterable[IngestionJob]) -> None:
+        try:
+            for job in jobs:
+                job.enqueued_at = time.monotonic()
+                await self._queue.put(job)
+        finally:
+            if self._feeds.get(key) is asyncio.current_task():
+                del self._feeds[key]
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            self.in_progress += 1
+            try:
+                await asyncio.wait_for(self._process(job), timeout=self.job_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._handle_failure(job, e)
+            finally:
+                self.in_progress -= 1
+                self._queue.task_done()
+
+    async def _process(self, job: IngestionJob) -> None:
+        started = time.monotonic()
+        queued = started - job.enqueued_at
+
+        page = await self._fetch(job)
+        fetched = time.monotonic()
+        if page.not_modified:
+            self.unchanged += 1
+            if job.status != "completed":
+                # An earlier refresh may have failed; the indexed text is still current.
+                db = get_service_postgrest_client(job.access_token)
+                await db.table('documents').update({"status": "completed"}).eq('id', job.document_id).execute()
+            logger.info("Document %s is unchanged since its last crawl", job.document_id)
+            return
+
+        loop = asyncio.get_running_loop()
+        text = await loop.run_in_executor(
+            self._executor, extract_text, page.body, job.source_name, page.content_type or job.content_type
+        )
+        extracted = time.monotonic()
+
+        db = get_service_postgrest_client(job.access_token)
+        digest = text_hash(text)
+        validators = {"etag": page.etag, "last_modified": page.last_modified} if job.source_type == "url" else {}
+        if digest == job.text_hash:
+            self.unchanged += 1
+            changes = dict(validators) if (page.etag, page.last_modified) != (job.etag, job.last_modified) else {}
+            if job.status != "completed":
+                changes["status"] = "completed"
+            if changes:
+                await db.table('documents').update(changes).eq('id', job.document_id).execute()
+            logger.info("Document %s was fetched again but its text is unchanged", job.document_id)
+            return
+
+        response = await db.table('documents').update(
+            {"content": text, "text_hash": digest, "status": "completed", **validators}
+        ).eq('id', job.document_id).execute()
+        if not response.data:
+            # Deleted, alone or with its chatbot, while the job was queued or running.
+            logger.info("Document %s was deleted before it was indexed", job.document_id)
+            return
+        indexed = search_indexes.add_document(job.chatbot_id, job.document_id, text)
+        chunks = chunk_text(text, settings.SEARCH_CHUNK_WORDS)
+
+        def still_exists() -> bool:
+            # Runs under the index's write lock, on a worker thread; deletes remove rows under it afterwards.
+            return asyncio.run_coroutine_threadsafe(self._document_exists(db, job.document_id), loop).result()
+
+        embedded = await asyncio.to_thread(vector_store.add_document, job.chatbot_id, job.document_id, chunks, still_exists)
+        # Cached widget answers, and the FAQ answers in the bootstrap bundle, depend on the documents.
+        answer_cache.invalidate(job.chatbot_id)
+        bootstrap_bundles.invalidate(job.chatbot_id)
+        self.indexed_chunks += indexed
+        self.embedded_chunks += embedded
+        stored = time.monotonic()
+
+        timings = {
+            "queued": queued,
+            "fetch": fetched - started,
+            "extract": extracted - fetched,
+            "store": stored - extracted,
+        }
+        for stage, seconds in timings.items():
+            self.total_seconds[stage] += seconds
+        self.completed += 1
+        logger.info(
+            "Ingested document %s (%d chars, %d/%d chunks embedded): %s",
+            job.document_id,
+            len(text),
+            embedded,
+            len(chunks),
+            ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings.items()),
+        )
+
+        if job.crawl is not None and job.crawl_depth > 0 and page.is_html:
+            links = await loop.run_in_executor(self._executor, same_site_links, page.url, page.body, job.crawl.host)
+            await self._follow_links(job, links)
+
+    @staticmethod
+    async def _document_exists(db, document_id: str) -> bool:
+        response = await db.table('documents').select('id').eq('id', document_id).limit(1).execute()
+        return bool(response.data)
+
+    async def _fetch(self, job: IngestionJob) -> Page:
+        if job.source_type == "file":
+            storage = get_service_storage_client(job.access_token)
+            data = await storage.from_(job.bucket).download(job.storage_path)
+            return Page(job.source_name, 200, data, job.content_type)
+        return await crawler.fetch(job.source_name, job.etag, job.last_modified)
+
+    async def _follow_links(self, job: IngestionJob, links: List[str]) -> None:
+        """Adds a crawled page's new same-site links as documents and queues them one level shallower."""
+        links = job.crawl.claim(links)
+        if not links:
+            return
+
+        db = get_service_postgrest_client(job.access_token)
+        known = set()
+        for start in range(0, len(links), settings.BULK_DOCUMENTS_BATCH_SIZE):
+            response = await (
+                db.table('documents').select('source_name')
+                .eq('chatbot_id', job.chatbot_id)
+                .in_('source_name', links[start:start + settings.BULK_DOCUMENTS_BATCH_SIZE])
+                .execute()
+            )
+            known.update(row["source_name"] for row in response.data or [])
+
+        new_links = [url for url in links if url not in known]
+        jobs = []
+        for start in range(0, len(new_links), settings.BULK_DOCUMENTS_BATCH_SIZE):
+            response = await db.table('documents').insert([
+                {"chatbot_id": job.chatbot_id, "user_id": job.user_id, "source_type": "url", "source_name": url}
+                for url in new_links[start:start + settings.BULK_DOCUMENTS_BATCH_SIZE]
+            ]).execute()
+            jobs += [
+                IngestionJob(
+                    document_id=row["id"],
+                    chatbot_id=job.chatbot_id,
+                    source_type="url",
+                    source_name=row["source_name"],
+                    access_token=job.access_token,
+                    user_id=job.user_id,
+                    crawl=job.crawl,
+                    crawl_depth=job.crawl_depth - 1,
+                )
+                for row in response.data or []
+            ]
+        self.discovered += len(jobs)
+        # Workers must never block on a full queue, or they could all wait on each other.
+        if jobs:
+            self.enqueue_later(jobs, key=f"links:{job.document_id}")
+
+    async def _handle_failure(self, job: IngestionJob, error: Exception) -> None:
+        job.attempts += 1
+        # Extraction errors are deterministic; retrying the same bytes will not help.
+        if job.attempts <= self.max_retries and not isinstance(error, ExtractionError):
+            self.retried += 1
+            delay = self.retry_backoff * (2 ** (job.attempts - 1))
+            logger.warning("Ingestion of document %s failed (attempt %d), retrying in %.1fs: %s", job.document_id, job.attempts, delay, error)
+            task = asyncio.create_task(self._retry_later(job, delay))
+            self._retry_tasks.add(task)
+            task.add_done_callback(self._retry_tasks.discard)
+            return
+
+        self.failed += 1
+        logger.error("Ingestion of document %s failed: %s", job.document_id, error)
+        try:
+            db = get_service_postgrest_client(job.access_token)
+            await db.table('documents').update({"status": "failed"}).eq('id', job.document_id).execute()
+        except Exception as e:
+            logger.error("Could not mark document %s as failed: %s", job.document_id, e)
+
+    async def _retry_later(self, job: IngestionJob, delay: float) -> None:
+        await asyncio.sleep(delay)
+        job.enqueued_at = time.monotonic()
+        await self._queue.put(job)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "in_progress": self.in_progress,
+            "completed": self.completed,
+            "unchanged": self.unchanged,
+            "failed": self.failed,
+            "retried": self.retried,
+            "discovered": self.discovered,
+            "indexed_chunks": self.indexed_chunks,
+            "embedded_chunks": self.embedded_chunks,
+            "feeds": len(self._feeds),
+            "total_seconds": dict(self.total_seconds),
+        }
+
+
+ingestion_pipeline = IngestionPipeline(
+    queue_size=settings.INGESTION_QUEUE_SIZE,
+    concurrency=settings.INGESTION_CONCURRENCY,
+    processes=settings.INGESTION_PROCESSES,
+    max_retries=settings.INGESTION_MAX_RETRIES,
+    retry_backoff=settings.INGESTION_RETRY_BACKOFF_SECONDS,
+    job_timeout=settings.INGESTION_JOB_TIMEOUT_SECONDS,
+)
@@ -0,0 +1,327 @@
+"""
+Real-time live chat between widget visitors and the agents who own a chatbot.
+
+Visitors join a single conversation of a chatbot; agents watch every
+conversation of a chatbot. Events are published to a `Broker` under a
+`<chatbot_id>/<conversation_id>` channel and delivered to the local sockets of
+that conversation and to the chatbot's watchers. The default `LocalBroker`
+delivers in-process; a cross-worker broker (e.g. Redis pub/sub) plugs in
+through `LIVE_CHAT_BROKER`.
+
+Connections are kept small so a worker can hold tens of thousands of idle
+sockets: state lives in a `__slots__` object, the send queue is created on
+first use, and a sender task only exists while the queue has something in
+it. One sweeper task pings quiet connections and evicts idle ones.
+"""
+import asyncio
+import importlib
+from abc import ABC, abstractmethod
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, Optional, Set
+
+from fastapi import WebSocket
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Close codes, from RFC 6455 and the IANA registry.
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_CLOSE = "close"
+
+DeliverCallback = Callable[[str, str, Optional[str]], None]
+
+# Events are serialized with "type" first, so typing indicators can be told
+# apart from chat messages without parsing the payload again.
+_TYPING_PREFIX = '{"type":"typing"'
+
+
+class Broker(ABC):
+    """Carries published events to every worker, including the publishing one."""
+
+    @abstractmethod
+    async def start(self, deliver: DeliverCallback) -> None:
+        ...
+
+    @abstractmethod
+    async def publish(self, channel: str, payload: str, exclude: Optional[str] = None) -> None:
+        ...
+
+    async def stop(self) -> None:
+        pass
+
+
+class LocalBroker(Broker):
+    """Delivers events within this process only. Used for single-worker deployments and tests."""
+
+    def __init__(self):
+        self._deliver: Optional[DeliverCallback] = None
+
+    async def start(self, deliver: DeliverCallback) -> None:
+        self._deliver = deliver
+
+    async def publish(self, channel: str, payload: str, exclude: Optional[str] = None) -> None:
+        if self._deliver is not None:
+            self._deliver(channel, payload, exclude)
+
+
+def load_broker(path: Optional[str]) -> Broker:
+    """Resolves a `module:callable` broker factory, or returns a `LocalBroker` when unset."""
+    if not path:
+        return LocalBroker()
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+class Connection:
+    __slots__ = (
+        "id", "websocket", "role", "chatbot_id", "conversation_id", "typing_enabled",
+        "queue", "ephemeral", "sender", "last_seen", "last_typing", "dropped", "closed",
+    )
+
+    def __init__(self, websocket: WebSocket, role: str, chatbot_id: str, conversation_id: Optional[str], typing_enabled: bool):
+        self.id = uuid.uuid4().hex
+        self.websocket = websocket
+        self.role = role
+        self.chatbot_id = chatbot_id
+        self.conversation_id = conversation_id
+        self.typing_enabled = typing_enabled
+        self.queue: Optional[deque] = None
+        # Number of queued ephemeral events (typing, pings); they are shed first.
+        self.ephemeral = 0
+        self.sender: Optional[asyncio.Task] = None
+        self.last_seen = time.monotonic()
+        self.last_typing = 0.0
+        self.dropped = 0
+        self.closed = False
+
+
+class ConnectionManager:
+    """Tracks live sockets per chatbot and conversation and fans events out to them."""
+
+    def __init__(
+        self,
+        broker: Broker,
+        queue_size: int,
+        overflow_policy: str,
+        send_timeout: float,
+        heartbeat_interval: float,
+        idle_timeout: float,
+        max_connections: int,
+        typing_interval: float = 1.0,
+    ):
+        self.broker = broker
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.send_timeout = send_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.typing_interval = typing_interval
+        self._connections: Dict[str, Connection] = {}
+        self._conversations: Dict[str, Set[Connection]] = {}
+        self._watchers: Dict[str, Set[Connection]] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        # Closes started from synchronous code; referenced until done so they are not collected.
+        self._closing: Set[asyncio.Task] = set()
+        self.delivered = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.slow_closed = 0
+
+    @staticmethod
+    def channel(chatbot_id: str, conversation_id: str) -> str:
+        return f"{chatbot_id}/{conversation_id}"
+
+    async def start(self) -> None:
+        await self.broker.start(self._deliver)
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        for connection in list(self._connections.values()):
+            await self.close(connection, CLOSE_GOING_AWAY)
+        await asyncio.gather(*self._closing, return_exceptions=True)
+        await self.broker.stop()
+
+    @property
+    def is_full(self) -> bool:
+        return len(self._connections) >= self.max_connections
+
+    def register(self, connection: Connection) -> None:
+        self._connections[connection.id] = connection
+        if connection.role == "agent":
+            self._watchers.setdefault(connection.chatbot_id, set()).add(connection)
+        else:
+            key = self.channel(connection.chatbot_id, connection.conversation_id)
+            self._conversations.setdefault(key, set()).add(connection)
+
+    def unregister(self, connection: Connection) -> None:
+        connection.closed = True
+        if self._connections.pop(connection.id, None) is None:
+            return
+        if connection.role == "agent":
+            index, key = self._watchers, connection.chatbot_id
+        else:
+            index, key = self._conversations, self.channel(connection.chatbot_id, connection.conversation_id)
+        members = index.get(key)
+        if members is not None:
+            members.discard(connection)
+            if not members:
+                del index[key]
+        if connection.sender is not None and connection.sender is not asyncio.current_task():
+            connection.sender.cancel()
+        connection.queue = None
+
+    async def close(self, connection: Connection, code: int) -> None:
+        self.unregister(connection)
+        try:
+            await connection.websocket.close(code=code)
+        except Exception:
+            pass  # The socket is already gone.
+
+    async def publish(self, chatbot_id: str, conversation_id: str, event: dict, exclude: Optional[Connection] = None) -> None:
+        """Serializes an event once and hands it to the broker for every worker."""
+        payload = json.dumps(event, separators=(",", ":"))
+        await self.broker.publish(
+            self.channel(chatbot_id, conversation_id), payload, exclude.id if exclude is not None else None
+        )
+
+    def _deliver(self, channel: str, payload: str, exclude: Optional[str]) -> None:
+        chatbot_id, _, _ = channel.partition("/")
+        ephemeral = payload.startswith(_TYPING_PREFIX)
+        for members in (self._conversations.get(channel), self._watchers.get(chatbot_id)):
+            for connection in tuple(members or ()):
+                if connection.id != exclude:
+                    self.send(connection, payload, ephemeral)
+
+    def send(self, connection: Connection, payload: str, ephemeral: bool = False) -> None:
+        """
+        Queues a payload without waiting. When the queue is full, queued ephemeral
+        events are shed first; after that the overflow policy either drops the
+        oldest event or disconnects the slow consumer.
+        """
+        if connection.closed:
+            return
+        if connection.queue is None:
+            connection.queue = deque()
+        queue = connection.queue
+
+        if len(queue) >= self.queue_size:
+            if ephemeral:
+                self._record_drop(connection)
+                return
+            if connection.ephemeral:
+                self._shed_ephemeral(connection)
+            elif self.overflow_policy == OVERFLOW_CLOSE:
+                self.slow_closed += 1
+                connection.closed = True
+                logger.info("Closing slow live chat connection %s (%d events queued)", connection.id, len(queue))
+                task = asyncio.create_task(self.close(connection, CLOSE_TRY_AGAIN_LATER))
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+                return
+            else:
+                _, dropped_ephemeral = queue.popleft()
+                connection.ephemeral -= dropped_ephemeral
+                self._record_drop(connection)
+
+        queue.append((payload, ephemeral))
+        connection.ephemeral += ephemeral
+        self.delivered += 1
+        if connection.sender is None:
+            connection.sender = asyncio.create_task(self._drain(connection))
+
+    def _shed_ephemeral(self, connection: Connection) -> None:
+        queue = connection.queue
+        for position, (_, ephemeral) in enumerate(queue):
+            if ephemeral:
+                del queue[position]
+                connection.ephemeral -= 1
+                self._record_drop(connection)
+                return
+
+    def _record_drop(self, connection: Connection) -> None:
+        connection.dropped += 1
+        self.dropped += 1
+
+    async def _drain(self, connection: Connection) -> None:
+        """Writes queued payloads to the socket; exits as soon as the queue is empty."""
+        try:
+            while connection.queue:
+                payload, ephemeral = connection.queue.popleft()
+                connection.ephemeral -= ephemeral
+                await asyncio.wait_for(connection.websocket.send_text(payload), timeout=self.send_timeout)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.info("Dropping live chat connection %s after a failed send: %s", connection.id, e)
+            await self.close(connection, CLOSE_TRY_AGAIN_LATER)
+        finally:
+            connection.sender = None
+
+    def touch(self, connection: Connection) -> None:
+        connection.last_seen = time.monotonic()
+
+    def allow_typing(self, connection: Connection, is_typing: bool) -> bool:
+        """
+        Typing indicators follow the chatbot's `enable_typing` flag. "Started
+        typing" events are rate limited; "stopped typing" always goes through.
+        """
+        if not connection.typing_enabled:
+            return False
+        if not is_typing:
+            connection.last_typing = 0.0
+            return True
+        now = time.monotonic()
+        if now - connection.last_typing < self.typing_interval:
+            return False
+        connection.last_typing = now
+        return True
+
+    async def _sweep(self) -> None:
+        ping = json.dumps({"type": "ping"}, separators=(",", ":"))
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            for connection in list(self._connections.values()):
+                quiet = now - connection.last_seen
+                if quiet >= self.idle_timeout:
+                    self.evicted += 1
+                    await self.close(connection, CLOSE_GOING_AWAY)
+                elif quiet >= self.heartbeat_interval:
+                    self.send(connection, ping, ephemeral=True)
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self._connections),
+            "conversations": len(self._conversations),
+            "watched_chatbots": len(self._watchers),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "slow_closed": self.slow_closed,
+        }
+
+
+live_chat = ConnectionManager(
+    broker=load_broker(settings.LIVE_CHAT_BROKER),
+    queue_size=settings.LIVE_CHAT_SEND_QUEUE_SIZE,
+    overflow_policy=settings.LIVE_CHAT_OVERFLOW_POLICY,
+    send_timeout=settings.LIVE_CHAT_SEND_TIMEOUT_SECONDS,
+    heartbeat_interval=settings.LIVE_CHAT_HEARTBEAT_SECONDS,
+    idle_timeout=settings.LIVE_CHAT_IDLE_TIMEOUT_SECONDS,
+    max_connections=settings.LIVE_CHAT_MAX_CONNECTIONS,
+)
@@ -0,0 +1,402 @@
+"""
+Routing of live chat conversations to a chatbot's human agents.
+
+Each chatbot has agents, who belong to one or more departments and take up to
+`capacity` conversations at once. Conversations ask for a department and wait
+there until an agent of that department is free:
+
+- Per department, waiting conversations are kept in a heap. They are ordered by
+  when they started waiting, moved earlier by `ROUTING_PRIORITY_BOOST_SECONDS`
+  per priority level and by the boost of the visitor's plan. Everyone waits at
+  the same rate, so the order never has to be recomputed: an urgent chat is
+  served first, but not ahead of a normal one that has waited much longer.
+- Per department, the online agents with free capacity are kept in a heap
+  ordered by load (share of capacity in use), then by how long ago they were
+  last assigned, which spreads chats evenly.
+
+Both are indexed heaps, so an entry can be updated or removed in place.
+Assigning, releasing and changing an agent's status cost O(d log n) for an
+agent in d departments; nothing scans all agents or all waiting chats.
+
+Routing state is in memory, in one process: unlike live chat, which relays
+events between workers through its broker, nothing shares agents or queues
+between processes. So routing must be served by a single worker process. On
+start the router takes a lock on ROUTING_LOCK_FILE, and a second worker on the
+same host refuses to start. Deployments that run several workers, or several
+hosts, set ROUTING_ENABLED to false.
+"""
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Generic, Hashable, List, Optional, Sequence, Set, Tuple, TypeVar
+
+from app.core.config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: the single-worker check is skipped.
+    fcntl = None
+
+PRIORITIES = ("low", "normal", "high", "urgent")
+
+STATUS_ONLINE = "online"
+STATUS_OFFLINE = "offline"
+
+K = TypeVar("K", bound=Hashable)
+
+
+class IndexedHeap(Generic[K]):
+    """A binary min-heap of keys whose priorities can be changed or removed in O(log n)."""
+
+    def __init__(self):
+        self._heap: List[Tuple[tuple, K]] = []
+        self._positions: Dict[K, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._positions
+
+    def peek(self) -> Optional[K]:
+        return self._heap[0][1] if self._heap else None
+
+    def push(self, key: K, priority: tuple) -> None:
+        """Adds `key`, or moves it if already present."""
+        position = self._positions.get(key)
+        if position is None:
+            self._heap.append((priority, key))
+            self._positions[key] = len(self._heap) - 1
+            self._sift_up(len(self._heap) - 1)
+        else:
+            self._heap[position] = (priority, key)
+            self._sift_up(position)
+            self._sift_down(self._positions[key])
+
+    def pop(self) -> K:
+        key = self._heap[0][1]
+        self.remove(key)
+        return key
+
+    def remove(self, key: K) -> bool:
+        position = self._positions.pop(key, None)
+        if position is None:
+            return False
+        last = self._heap.pop()
+        if position < len(self._heap):
+            self._heap[position] = last
+            self._positions[last[1]] = position
+            self._sift_up(position)
+            self._sift_down(self._positions[last[1]])
+        return True
+
+    def _swap(self, i: int, j: int) -> None:
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._positions[heap[i][1]] = i
+        self._positions[heap[j][1]] = j
+
+    def _sift_up(self, i: int) -> None:
+        heap = self._heap
+        while i > 0:
+            parent = (i - 1) // 2
+            if heap[i][0] >= heap[parent][0]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i: int) -> None:
+        heap, size = self._heap, len(self._heap)
+        while True:
+            smallest, left = i, 2 * i + 1
+            if left < size and heap[left][0] < heap[smallest][0]:
+                smallest = left
+            if left + 1 < size and heap[left + 1][0] < heap[smallest][0]:
+                smallest = left + 1
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
+
+
+@dataclass
+class Agent:
+    id: str
+    departments: Tuple[str, ...]
+    capacity: int
+    status: str
+    conversations: Set[str] = field(default_factory=set)
+    last_assigned_at: float = 0.0
+
+    @property
+    def available(self) -> bool:
+        return self.status == STATUS_ONLINE and len(self.conversations) < self.capacity
+
+    @property
+    def load(self) -> float:
+        return len(self.conversations) / self.capacity
+
+
+@dataclass
+class RoutedConversation:
+    id: str
+    department: str
+    priority: str
+    plan: str
+    waiting_since: float
+    # Queue order: when it started waiting, less the priority and plan boosts.
+    rank: float
+    agent_id: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Assignment:
+    conversation_id: str
+    agent_id: str
+    waited: float
+
+
+class _ChatbotRouting:
+    def __init__(self):
+        self.agents: Dict[str, Agent] = {}
+        # department -> online agents with free capacity
+        self.pools: Dict[str, IndexedHeap[str]] = {}
+        # department -> waiting conversation ids
+        self.queues: Dict[str, IndexedHeap[str]] = {}
+        # Waiting and assigned conversations
+        self.conversations: Dict[str, RoutedConversation] = {}
+
+    def is_empty(self) -> bool:
+        return not (self.agents or self.conversations)
+
+
+class ChatRouter:
+    def __init__(
+        self,
+        priority_boost: float,
+        plan_boosts: Dict[str, float],
+        clock: Callable[[], float] = time.time,
+        lock_path: Optional[str] = None,
+    ):
+        self.priority_boost = priority_boost
+        self.plan_boosts = plan_boosts
+        self.clock = clock
+        self.lock_path = lock_path
+        self._lock_file = None
+        self._chatbots: Dict[str, _ChatbotRouting] = {}
+        self.assignments = 0
+        self.requeued = 0
+        self.seconds_waited = 0.0
+
+    def _routing(self, chatbot_id: str) -> _ChatbotRouting:
+        routing = self._chatbots.get(chatbot_id)
+        if routing is None:
+            routing = self._chatbots[chatbot_id] = _ChatbotRouting()
+        return routing
+
+    def _forget_if_empty(self, chatbot_id: str) -> None:
+        routing = self._chatbots.get(chatbot_id)
+        if routing is not None and routing.is_empty():
+            del self._chatbots[chatbot_id]
+
+    def start(self) -> None:
+        """Takes the routing lock; raises RuntimeError if another process on this host holds it."""
+        if self.lock_path is None or self._lock_file is not None:
+            return
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        lock_file = open(self.lock_path, "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise RuntimeError(
+                    f"Another process holds {self.lock_path}. Routing state is kept per process, so it "
+                    "needs a single worker; run one, or set ROUTING_ENABLED=false."
+                )
+        self._lock_file = lock_file
+
+    def stop(self) -> None:
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    # --- Agent pools ---
+
+    @staticmethod
+    def _refresh(routing: _ChatbotRouting, agent: Agent) -> None:
+        """Puts an agent in (or takes it out of) its departments' pools according to its load."""
+        for department in agent.departments:
+            pool = routing.pools.setdefault(department, IndexedHeap())
+            if agent.available:
+                pool.push(agent.id, (agent.load, agent.last_assigned_at, agent.id))
+            else:
+                pool.remove(agent.id)
+
+    @staticmethod
+    def _leave_pools(routing: _ChatbotRouting, agent: Agent) -> None:
+        for department in agent.departments:
+            pool = routing.pools.get(department)
+            if pool is not None:
+                pool.remove(agent.id)
+
+    def _assign(self, routing: _ChatbotRouting, agent: Agent, conversation: RoutedConversation) -> Assignment:
+        now = self.clock()
+        conversation.agent_id = agent.id
+        agent.conversations.add(conversation.id)
+        agent.last_assigned_at = now
+        self._refresh(routing, agent)
+        waited = max(0.0, now - conversation.waiting_since)
+        self.assignments += 1
+        self.seconds_waited += waited
+        return Assignment(conversation.id, agent.id, waited)
+
+    def _drain(self, routing: _ChatbotRouting, agent: Agent) -> List[Assignment]:
+        """Gives a newly free agent the longest-waiting (by rank) conversations of its departments."""
+        assignments = []
+        while agent.available:
+            best: Optional[RoutedConversation] = None
+            for department in agent.departments:
+                queue = routing.queues.get(department)
+                if queue:
+                    candidate = routing.conversations[queue.peek()]
+                    if best is None or candidate.rank < best.rank:
+                        best = candidate
+            if best is None:
+                break
+            routing.queues[best.department].remove(best.id)
+            assignments.append(self._assign(routing, agent, best))
+        return assignments
+
+    def _requeue(self, routing: _ChatbotRouting, agent: Agent) -> List[Assignment]:
+        """
+        Reroutes an agent's conversations. They keep the time they first
+        started waiting, so they go ahead of newer arrivals.
+        """
+        assignments = []
+        for conversation_id in list(agent.conversations):
+            agent.conversations.discard(conversation_id)
+            self.requeued += 1
+            assignment = self._route(routing, routing.conversations[conversation_id])
+            if assignment is not None:
+                assignments.append(assignment)
+        return assignments
+
+    def _route(self, routing: _ChatbotRouting, conversation: RoutedConversation) -> Optional[Assignment]:
+        conversation.agent_id = None
+        pool = routing.pools.get(conversation.department)
+        if pool:
+            return self._assign(routing, routing.agents[pool.peek()], conversation)
+        routing.queues.setdefault(conversation.department, IndexedHeap()).push(conversation.id, (conversation.rank, conversation.id))
+        return None
+
+    # --- Operations ---
+
+    def set_agent(self, chatbot_id: str, agent_id: str, departments: Sequence[str], capacity: int, status: str) -> List[Assignment]:
+        """
+        Adds or updates an agent. Agents going offline hand their conversations
+        back for rerouting; agents that come online or gain capacity pick up
+        waiting conversations. Returns the assignments this caused.
+        """
+        routing = self._routing(chatbot_id)
+        agent = routing.agents.get(agent_id)
+        assignments: List[Assignment] = []
+        if agent is None:
+            agent = routing.agents[agent_id] = Agent(agent_id, tuple(dict.fromkeys(departments)), capacity, status)
+        else:
+            self._leave_pools(routing, agent)
+            agent.departments = tuple(dict.fromkeys(departments))
+            agent.capacity = capacity
+            agent.status = status
+        if status == STATUS_OFFLINE:
+            assignments += self._requeue(routing, agent)
+        self._refresh(routing, agent)
+        assignments += self._drain(routing, agent)
+        return assignments
+
+    def remove_agent(self, chatbot_id: str, agent_id: str) -> Optional[List[Assignment]]:
+        """Removes an agent, rerouting its conversations. None if there is no such agent."""
+        routing = self._chatbots.get(chatbot_id)
+        agent = routing.agents.get(agent_id) if routing is not None else None
+        if agent is None:
+            return None
+        self._leave_pools(routing, agent)
+        agent.status = STATUS_OFFLINE
+        del routing.agents[agent_id]
+        assignments = self._requeue(routing, agent)
+        self._forget_if_empty(chatbot_id)
+        return assignments
+
+    def enqueue(self, chatbot_id: str, conversation_id: str, department: str, priority: str = "normal", plan: str = "free") -> Optional[Assignment]:
+        """
+        Routes a conversation to the least loaded available agent of its
+        department, or queues it. Returns the assignment, or None if it waits.
+        A conversation already routed keeps its place.
+        """
+        routing = self._routing(chatbot_id)
+        conversation = routing.conversations.get(conversation_id)
+        if conversation is not None:
+            return Assignment(conversation_id, conversation.agent_id, 0.0) if conversation.agent_id is not None else None
+        now = self.clock()
+        rank = now - self.priority_boost * PRIORITIES.index(priority) - self.plan_boosts.get(plan, 0.0)
+        conversation = routing.conversations[conversation_id] = RoutedConversation(conversation_id, department, priority, plan, now, rank)
+        return self._route(routing, conversation)
+
+    def release(self, chatbot_id: str, conversation_id: str) -> Optional[List[Assignment]]:
+        """
+        Ends a conversation, or withdraws it from its queue. Its agent picks up
+        the next waiting conversation. None if the conversation is not routed.
+        """
+        routing = self._chatbots.get(chatbot_id)
+        if routing is None:
+            return None
+        conversation = routing.conversations.pop(conversation_id, None)
+        if conversation is None:
+            return None
+        assignments: List[Assignment] = []
+        if conversation.agent_id is None:
+            routing.queues[conversation.department].remove(conversation_id)
+        else:
+            agent = routing.agents[conversation.agent_id]
+            agent.conversations.discard(conversation_id)
+            self._refresh(routing, agent)
+            assignments = self._drain(routing, agent)
+        self._forget_if_empty(chatbot_id)
+        return assignments
+
+    def drop(self, chatbot_id: str) -> None:
+        self._chatbots.pop(chatbot_id, None)
+
+    # --- Reads ---
+
+    def agents(self, chatbot_id: str) -> List[Agent]:
+        routing = self._chatbots.get(chatbot_id)
+        return sorted(routing.agents.values(), key=lambda agent: agent.id) if routing is not None else []
+
+    def agent(self, chatbot_id: str, agent_id: str) -> Optional[Agent]:
+        routing = self._chatbots.get(chatbot_id)
+        return routing.agents.get(agent_id) if routing is not None else None
+
+    def waiting_by_department(self, chatbot_id: str) -> Dict[str, int]:
+        routing = self._chatbots.get(chatbot_id)
+        if routing is None:
+            return {}
+        return {department: len(queue) for department, queue in routing.queues.items() if queue}
+
+    def stats(self) -> dict:
+        return {
+            "chatbots": len(self._chatbots),
+            "agents": sum(len(routing.agents) for routing in self._chatbots.values()),
+            "waiting": sum(len(queue) for routing in self._chatbots.values() for queue in routing.queues.values()),
+            "assigned": sum(len(agent.conversations) for routing in self._chatbots.values() for agent in routing.agents.values()),
+            "assignments": self.assignments,
+            "requeued": self.requeued,
+            "mean_wait_seconds": self.seconds_waited / self.assignments if self.assignments else 0.0,
+        }
+
+
+chat_router = ChatRouter(
+    priority_boost=settings.ROUTING_PRIORITY_BOOST_SECONDS,
+    plan_boosts=settings.ROUTING_PLAN_BOOST_SECONDS,
+    lock_path=settings.ROUTING_LOCK_FILE,
+)
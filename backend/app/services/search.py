@@ -0,0 +1,257 @@
+"""
+Lexical retrieval over a chatbot's knowledge base.
+
+Each chatbot gets a BM25 index over the chunks of its completed documents.
+Postings are stored in typed arrays (`array('I')` chunk ids and `array('H')`
+term frequencies) so scoring can view them as NumPy arrays without copying,
+and a whole query is scored with a handful of vectorized operations.
+"""
+import asyncio
+import math
+import time
+from array import array
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+from postgrest import AsyncPostgrestClient
+
+from app.core.config import settings
+from app.core.pagination import UNPAGED_PAGE_SIZE
+from app.services.chunking import chunk_text, tokenize
+
+
+@dataclass
+class SearchHit:
+    document_id: str
+    chunk_index: int
+    text: str
+    score: float
+
+
+class BM25Index:
+    """An incrementally updatable BM25 inverted index over document chunks."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, max_chunk_words: int = 200):
+        self.k1 = k1
+        self.b = b
+        self.max_chunk_words = max_chunk_words
+        self._reset()
+
+    def _reset(self) -> None:
+        self.vocabulary: Dict[str, int] = {}
+        self.postings: List[array] = []
+        self.frequencies: List[array] = []
+        self.chunk_lengths = array("I")
+        self.chunk_alive = bytearray()
+        self.chunk_documents: List[str] = []
+        self.chunk_positions = array("I")
+        self.chunk_texts: List[Optional[str]] = []
+        self.document_chunks: Dict[str, List[int]] = {}
+        self.live_chunks = 0
+        self.live_length = 0
+
+    def __len__(self) -> int:
+        return self.live_chunks
+
+    @property
+    def document_count(self) -> int:
+        return len(self.document_chunks)
+
+    def add_document(self, document_id: str, text: str) -> int:
+        """
+        Indexes a document, replacing any previous version of it. Chunks whose
+        text is unchanged keep their postings; only new chunks are tokenized and
+        indexed. Returns how many chunks were.
+        """
+        previous: Dict[str, List[int]] = {}
+        for chunk_id in self.document_chunks.pop(document_id, []):
+            if self.chunk_alive[chunk_id]:
+                previous.setdefault(self.chunk_texts[chunk_id], []).append(chunk_id)
+
+        chunk_ids = []
+        indexed = 0
+        for position, chunk in enumerate(chunk_text(text, self.max_chunk_words)):
+            reusable = previous.get(chunk)
+            if reusable:
+                chunk_id = reusable.pop()
+                self.chunk_positions[chunk_id] = position
+            else:
+                chunk_id = self._add_chunk(document_id, position, chunk)
+                indexed += 1
+            chunk_ids.append(chunk_id)
+        self.document_chunks[document_id] = chunk_ids
+        self._tombstone([chunk_id for stale in previous.values() for chunk_id in stale])
+        return indexed
+
+    def _add_chunk(self, document_id: str, position: int, chunk: str) -> int:
+        chunk_id = len(self.chunk_texts)
+        tokens = tokenize(chunk)
+        for term, count in Counter(tokens).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                term_id = self.vocabulary[term] = len(self.postings)
+                self.postings.append(array("I"))
+                self.frequencies.append(array("H"))
+            self.postings[term_id].append(chunk_id)
+            self.frequencies[term_id].append(min(count, 0xFFFF))
+        self.chunk_lengths.append(len(tokens))
+        self.chunk_alive.append(1)
+        self.chunk_documents.append(document_id)
+        self.chunk_positions.append(position)
+        self.chunk_texts.append(chunk)
+        self.live_chunks += 1
+        self.live_length += len(tokens)
+        return chunk_id
+
+    def remove_document(self, document_id: str) -> None:
+        """Tombstones a document's chunks; postings are reclaimed by `compact`."""
+        self._tombstone(self.document_chunks.pop(document_id, []))
+
+    def _tombstone(self, chunk_ids: List[int]) -> None:
+        for chunk_id in chunk_ids:
+            if self.chunk_alive[chunk_id]:
+                self.chunk_alive[chunk_id] = 0
+                self.chunk_texts[chunk_id] = None
+                self.live_chunks -= 1
+                self.live_length -= self.chunk_lengths[chunk_id]
+        dead = len(self.chunk_texts) - self.live_chunks
+        if dead > 64 and dead > self.live_chunks:
+            self.compact()
+
+    def compact(self) -> None:
+        """Rebuilds the postings without tombstoned chunks."""
+        documents = [
+            (document_id, [(self.chunk_positions[c], self.chunk_texts[c]) for c in chunk_ids])
+            for document_id, chunk_ids in self.document_chunks.items()
+        ]
+        self._reset()
+        for document_id, chunks in documents:
+            self.document_chunks[document_id] = [
+                self._add_chunk(document_id, position, chunk) for position, chunk in chunks
+            ]
+
+    def search(self, query: str, limit: int = 5) -> List[SearchHit]:
+        if not self.live_chunks:
+            return []
+        term_ids = {self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary}
+        if not term_ids:
+            return []
+
+        alive = np.frombuffer(self.chunk_alive, dtype=np.uint8).astype(bool)
+        lengths = np.frombuffer(self.chunk_lengths, dtype=np.uint32).astype(np.float32)
+        average_length = self.live_length / self.live_chunks or 1.0
+        length_norm = self.k1 * (1.0 - self.b + self.b * lengths / average_length)
+        scores = np.zeros(len(self.chunk_texts), dtype=np.float32)
+
+        for term_id in term_ids:
+            chunk_ids = np.frombuffer(self.postings[term_id], dtype=np.uint32)
+            live = alive[chunk_ids]
+            document_frequency = int(live.sum())
+            if not document_frequency:
+                continue
+            chunk_ids = chunk_ids[live]
+            tf = np.frombuffer(self.frequencies[term_id], dtype=np.uint16)[live].astype(np.float32)
+            idf = math.log(1.0 + (self.live_chunks - document_frequency + 0.5) / (document_frequency + 0.5))
+            # Chunk ids are unique within one posting list, so plain fancy-index addition is safe.
+            scores[chunk_ids] += idf * tf * (self.k1 + 1.0) / (tf + length_norm[chunk_ids])
+
+        candidates = np.flatnonzero(scores)
+        if not len(candidates):
+            return []
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(scores[candidates], -limit)[-limit:]]
+        candidates = candidates[np.argsort(scores[candidates])[::-1]]
+        return [
+            SearchHit(
+                document_id=self.chunk_documents[c],
+                chunk_index=self.chunk_positions[c],
+                text=self.chunk_texts[c],
+                score=float(scores[c]),
+            )
+            for c in candidates
+        ]
+
+
+class SearchIndexRegistry:
+    """
+    Holds the BM25 indexes of recently searched chatbots, loading them from
+    `documents.content` on first use. The least recently used index is evicted
+    past `max_indexes`, and loaded indexes are rebuilt after `ttl` seconds so
+    documents ingested by other workers are picked up.
+    """
+
+    def __init__(self, max_indexes: int, ttl: float):
+        self.max_indexes = max_indexes
+        self.ttl = ttl
+        self._indexes: "OrderedDict[str, tuple[float, BM25Index]]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def loaded(self, chatbot_id: str) -> Optional[BM25Index]:
+        entry = self._indexes.get(chatbot_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        self._indexes.move_to_end(chatbot_id)
+        return entry[1]
+
+    async def get(self, chatbot_id: str, db: AsyncPostgrestClient) -> BM25Index:
+        index = self.loaded(chatbot_id)
+        if index is not None:
+            return index
+        lock = self._locks.setdefault(chatbot_id, asyncio.Lock())
+        async with lock:
+            index = self.loaded(chatbot_id)
+            if index is None:
+                index = await self._load(chatbot_id, db)
+                self._indexes[chatbot_id] = (time.monotonic() + self.ttl, index)
+                self._indexes.move_to_end(chatbot_id)
+                while len(self._indexes) > self.max_indexes:
+                    evicted, _ = self._indexes.popitem(last=False)
+                    self._locks.pop(evicted, None)
+        return index
+
+    async def _load(self, chatbot_id: str, db: AsyncPostgrestClient) -> BM25Index:
+        # Read in pages by id, so chatbots with many documents stay under PostgREST's row limit.
+        rows: List[dict] = []
+        while True:
+            query = db.table('documents').select('id, content').eq('chatbot_id', chatbot_id).eq('status', 'completed')
+            if rows:
+                query = query.gt('id', rows[-1]["id"])
+            response = await query.order('id').limit(UNPAGED_PAGE_SIZE).execute()
+            page = response.data or []
+            rows += page
+            if len(page) < UNPAGED_PAGE_SIZE:
+                break
+        documents = [(row["id"], row["content"]) for row in rows if row.get("content")]
+
+        def build() -> BM25Index:
+            index = BM25Index(max_chunk_words=settings.SEARCH_CHUNK_WORDS)
+            for document_id, content in documents:
+                index.add_document(document_id, content)
+            return index
+
+        # Building is CPU-bound; keep the event loop responsive while it runs.
+        return await asyncio.to_thread(build)
+
+    def add_document(self, chatbot_id: str, document_id: str, text: str) -> int:
+        """Applies a newly ingested document to the chatbot's index, if it is loaded; returns the chunks indexed."""
+        index = self.loaded(chatbot_id)
+        if index is None:
+            return 0
+        return index.add_document(document_id, text)
+
+    def remove_document(self, chatbot_id: str, document_id: str) -> None:
+        index = self.loaded(chatbot_id)
+        if index is not None:
+            index.remove_document(document_id)
+
+    def drop(self, chatbot_id: str) -> None:
+        self._indexes.pop(chatbot_id, None)
+        self._locks.pop(chatbot_id, None)
+
+
+search_indexes = SearchIndexRegistry(
+    max_indexes=settings.SEARCH_INDEX_MAX_CHATBOTS,
+    ttl=settings.SEARCH_INDEX_TTL_SECONDS,
+)
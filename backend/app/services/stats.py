@@ -0,0 +1,52 @@
+"""
+Per-user dashboard statistics.
+
+Totals are not aggregated on read. Database triggers keep a `user_stats`
+rollup row per user up to date as chatbots are created or deleted,
+conversations are counted and ratings are recorded (see SUPABASE.md, section
+7), so the dashboard reads a single row. Ratings are recorded through a
+SECURITY DEFINER function, which lets the anonymous widget submit them
+without seeing any other data; conversation counts arrive in bulk from the
+analytics buffer.
+"""
+from postgrest import AsyncPostgrestClient
+
+from app.core.cache import dashboard_stats_cache
+from app.db.supabase import get_service_postgrest_client
+from app.models.dashboard import DashboardStats
+
+USER_STATS_COLUMNS = "total_chatbots, total_conversations, ratings_count, positive_ratings"
+
+
+def satisfaction_rate(ratings_count: int, positive_ratings: int) -> int:
+    """
+    Percentage of rated conversations rated 4 or 5 (out of 5); 0 before any rating.
+    """
+    if not ratings_count:
+        return 0
+    return round(100 * positive_ratings / ratings_count)
+
+
+async def get_user_stats(db: AsyncPostgrestClient, user_id: str) -> DashboardStats:
+    cached = dashboard_stats_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    response = await db.table('user_stats').select(USER_STATS_COLUMNS).eq('user_id', user_id).limit(1).execute()
+    # Users without chatbots have no rollup row yet.
+    row = response.data[0] if response.data else {}
+    stats = DashboardStats(
+        totalChatbots=row.get("total_chatbots", 0),
+        totalConversations=row.get("total_conversations", 0),
+        satisfactionRate=satisfaction_rate(row.get("ratings_count", 0), row.get("positive_ratings", 0)),
+    )
+    dashboard_stats_cache.set(user_id, stats)
+    return stats
+
+
+async def record_rating(chatbot_id: str, conversation_id: str, rating: int) -> None:
+    """Stores a visitor's rating of a conversation; rating the same conversation again replaces it."""
+    await get_service_postgrest_client().rpc(
+        'record_rating',
+        {"p_chatbot_id": chatbot_id, "p_conversation_id": conversation_id, "p_rating": rating},
+    ).execute()
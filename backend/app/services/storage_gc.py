@@ -0,0 +1,437 @@
+"""
+Deferred garbage collection of uploaded files.
+
+Deleting a document or a chatbot does not wait for Storage. The route puts the
+object paths (for a chatbot, its whole `{user_id}/{chatbot_id}/` folder) in an
+outbox and returns. A sweeper task drains the outbox: up to `batch_size` paths
+per removal call, with failed removals retried after an exponential backoff,
+up to `max_attempts` times.
+
+The outbox is journaled to a local file, so entries queued before a restart
+are swept after it. Each worker process appends to its own journal,
+`<STORAGE_GC_JOURNAL>.<pid>`, and holds a lock on it while it runs. On start,
+a worker adopts the journals whose lock is free, because their process has
+exited: it copies their entries into its own journal and deletes them, so each
+entry is swept by one worker. Access tokens are never written to disk. Entries
+recovered from a journal are swept with the service role key, or dropped if it
+is not configured.
+
+With the service role key, a reconciler also lists the bucket every
+`reconcile_interval` and queues every object that no `documents.storage_path`
+refers to. Those are orphans left by retries that gave up, crashes, or deletes
+made outside the API. Objects younger than `reconcile_grace` are left alone,
+because uploads land in Storage before their document row is inserted. Only
+the worker holding `<STORAGE_GC_JOURNAL>.reconcile.lock` reconciles; the others
+try to take it over at each interval.
+
+Locks use `fcntl` where it is available; elsewhere a single process is assumed.
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import IO, Dict, Iterable, List, Optional
+
+from app.core.config import settings
+from app.db.storage import BUCKET_NAME
+from app.db.supabase import get_service_postgrest_client, get_service_storage_client
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LIST_PAGE_SIZE = 1000
+
+
+@dataclass
+class _Entry:
+    # An object path, or a folder prefix ending in "/".
+    path: str
+    token: Optional[str]
+    attempts: int = 0
+    not_before: float = 0.0
+
+
+def _created_at(item: dict) -> Optional[float]:
+    value = item.get("created_at")
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def _try_lock(path: str) -> Optional[IO]:
+    """Opens `path` and locks it without waiting; None if another process holds the lock."""
+    f = open(path, "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+    return f
+
+
+class StorageGarbageCollector:
+    def __init__(
+        self,
+        bucket: str,
+        journal_path: str,
+        batch_size: int,
+        sweep_interval: float,
+        max_attempts: int,
+        retry_backoff: float,
+        reconcile_interval: float,
+        reconcile_grace: float,
+    ):
+        self.bucket = bucket
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.sweep_interval = sweep_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.reconcile_interval = reconcile_interval
+        self.reconcile_grace = reconcile_grace
+        self._outbox: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        # Entries queued since the last sweep; enough of them wake the sweeper early.
+        self._fresh = 0
+        # Set when entries leave the outbox, so the journal is rewritten.
+        self._journal_stale = False
+        self._tasks: List[asyncio.Task] = []
+        # Held for as long as this process runs: the lock on its own journal,
+        # and once this worker is the reconciler, the reconcile lock.
+        self._journal_lock: Optional[IO] = None
+        self._reconcile_lock: Optional[IO] = None
+        self.removed = 0
+        self.failed_removals = 0
+        self.abandoned = 0
+        self.orphans_found = 0
+        self.reconciles = 0
+
+    # --- Journal ---
+
+    @property
+    def _own_journal(self) -> str:
+        # Resolved on use, so a process forked after import gets its own.
+        return f"{self.journal_path}.{os.getpid()}"
+
+    def _journal_paths(self) -> List[str]:
+        """This process's journal, the other workers' ones, and the single journal of earlier versions."""
+        directory = os.path.dirname(self.journal_path) or "."
+        prefix = os.path.basename(self.journal_path) + "."
+        paths = [self.journal_path]
+        with contextlib.suppress(FileNotFoundError):
+            for name in os.listdir(directory):
+                if name.startswith(prefix) and name[len(prefix):].isdigit():
+                    paths.append(os.path.join(directory, name))
+        return paths
+
+    @staticmethod
+    def _read_journal(path: str) -> List[str]:
+        paths = []
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        paths.append(json.loads(line)["add"])
+                    except (ValueError, KeyError, TypeError):
+                        continue  # A line cut short by a crash.
+        except FileNotFoundError:
+            pass
+        return paths
+
+    def _recover(self, paths: List[str]) -> None:
+        recovered = [path for path in dict.fromkeys(paths) if path not in self._outbox]
+        for path in recovered:
+            self._outbox[path] = _Entry(path, None)
+        self._journal(recovered)
+
+    def _adopt_journals(self) -> None:
+        """
+        Locks this process's journal and takes over its entries and those of
+        every journal whose process has exited. An adopted journal is deleted
+        only once its entries are in this process's journal.
+        """
+        own = self._own_journal
+        os.makedirs(os.path.dirname(own) or ".", exist_ok=True)
+        self._journal_lock = _try_lock(f"{own}.lock")
+        if self._journal_lock is None:
+            raise OSError(f"{own}.lock is held by another process")
+        before = len(self._outbox)
+        for path in self._journal_paths():
+            if path == own:
+                self._recover(self._read_journal(path))
+                continue
+            lock = _try_lock(f"{path}.lock")
+            if lock is None:
+                continue  # Its worker is running.
+            try:
+                self._recover(self._read_journal(path))
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(f"{path}.lock")
+            finally:
+                lock.close()
+        if len(self._outbox) > before:
+            logger.info("Recovered %d pending storage deletions", len(self._outbox) - before)
+
+    def _journal(self, paths: List[str]) -> None:
+        lines = "".join(json.dumps({"add": path}) + "\n" for path in paths)
+        if lines:
+            os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+            with open(self._own_journal, "a") as f:
+                f.write(lines)
+
+    def _rewrite_journal(self) -> None:
+        """Replaces the journal with just the pending entries, so it does not grow without bound."""
+        own = self._own_journal
+        tmp_path = f"{own}.tmp"
+        os.makedirs(os.path.dirname(own) or ".", exist_ok=True)
+        with open(tmp_path, "w") as f:
+            f.write("".join(json.dumps({"add": path}) + "\n" for path in self._outbox))
+        os.replace(tmp_path, own)
+
+    # --- Outbox ---
+
+    def enqueue(self, paths: Iterable[str], access_token: Optional[str] = None) -> None:
+        """Schedules objects (or folders, given with a trailing "/") for removal."""
+        added = []
+        for path in paths:
+            if not path:
+                continue
+            entry = self._outbox.get(path)
+            if entry is None:
+                self._outbox[path] = _Entry(path, access_token)
+                added.append(path)
+            elif access_token is not None:
+                entry.token = access_token
+        try:
+            self._journal(added)
+        except OSError as e:
+            logger.warning("Could not journal %d storage deletions: %s", len(added), e)
+        self._fresh += len(added)
+        if self._fresh >= self.batch_size:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._outbox)
+
+    def _credentials(self, entry: _Entry) -> Optional[str]:
+        return settings.SUPABASE_SERVICE_ROLE_KEY or entry.token
+
+    def _finish(self, entries: List[_Entry]) -> None:
+        for entry in entries:
+            self._outbox.pop(entry.path, None)
+        self._journal_stale = True
+
+    def _retry_later(self, entries: List[_Entry], error: Exception) -> None:
+        now = time.monotonic()
+        self.failed_removals += len(entries)
+        for entry in entries:
+            entry.attempts += 1
+            if entry.attempts >= self.max_attempts:
+                logger.warning("Giving up on removing %s from storage after %d attempts: %s", entry.path, entry.attempts, error)
+                self.abandoned += 1
+                self._finish([entry])
+            else:
+                entry.not_before = now + self.retry_backoff * 2 ** (entry.attempts - 1)
+
+    async def _folder_files(self, bucket, prefix: str) -> List[str]:
+        """Every object path under `prefix`, in subfolders too."""
+        files = []
+        for item in await self._list_all(bucket, prefix.rstrip("/")):
+            if item.get("id") is None:
+                files += await self._folder_files(bucket, f"{prefix}{item['name']}/")
+            else:
+                files.append(f"{prefix}{item['name']}")
+        return files
+
+    async def _remove_folder(self, storage, prefix: str) -> int:
+        bucket = storage.from_(self.bucket)
+        files = await self._folder_files(bucket, prefix)
+        for start in range(0, len(files), self.batch_size):
+            await bucket.remove(files[start:start + self.batch_size])
+        return len(files)
+
+    async def sweep(self) -> int:
+        """Removes every due entry; returns how many objects were removed."""
+        now = time.monotonic()
+        self._fresh = 0
+        due: Dict[str, List[_Entry]] = {}
+        for entry in list(self._outbox.values()):
+            if entry.not_before > now:
+                continue
+            credentials = self._credentials(entry)
+            if credentials is None:
+                logger.warning("Dropping storage deletion of %s: no token, and no service role key is configured", entry.path)
+                self.abandoned += 1
+                self._finish([entry])
+                continue
+            due.setdefault(credentials, []).append(entry)
+
+        removed = 0
+        for credentials, entries in due.items():
+            storage = get_service_storage_client(credentials)
+            files = [entry for entry in entries if not entry.path.endswith("/")]
+            for start in range(0, len(files), self.batch_size):
+                batch = files[start:start + self.batch_size]
+                try:
+                    await storage.from_(self.bucket).remove([entry.path for entry in batch])
+                except Exception as e:
+                    self._retry_later(batch, e)
+                else:
+                    removed += len(batch)
+                    self._finish(batch)
+            for entry in entries:
+                if not entry.path.endswith("/"):
+                    continue
+                try:
+                    removed += await self._remove_folder(storage, entry.path)
+                except Exception as e:
+                    self._retry_later([entry], e)
+                else:
+                    self._finish([entry])
+
+        self.removed += removed
+        if self._journal_stale:
+            self._journal_stale = False
+            try:
+                self._rewrite_journal()
+            except OSError as e:
+                logger.warning("Could not rewrite the storage deletion journal: %s", e)
+        return removed
+
+    # --- Reconciliation ---
+
+    async def _list_all(self, bucket, prefix: str) -> List[dict]:
+        items: List[dict] = []
+        while True:
+            page = await bucket.list(prefix, {"limit": LIST_PAGE_SIZE, "offset": len(items)})
+            items.extend(page)
+            if len(page) < LIST_PAGE_SIZE:
+                return items
+
+    async def reconcile(self) -> int:
+        """
+        Queues objects under `{user_id}/{chatbot_id}/` that no document refers
+        to; returns how many were found. Needs the service role key to see every
+        user's files and rows.
+        """
+        storage = get_service_storage_client()
+        db = get_service_postgrest_client()
+        bucket = storage.from_(self.bucket)
+        cutoff = time.time() - self.reconcile_grace
+        orphans: List[str] = []
+        for user_folder in await self._list_all(bucket, ""):
+            if user_folder.get("id") is not None:
+                continue
+            for chatbot_folder in await self._list_all(bucket, user_folder["name"]):
+                if chatbot_folder.get("id") is not None:
+                    continue
+                prefix = f"{user_folder['name']}/{chatbot_folder['name']}"
+                candidates = []
+                for item in await self._list_all(bucket, prefix):
+                    created_at = _created_at(item)
+                    path = f"{prefix}/{item['name']}"
+                    if item.get("id") is not None and created_at is not None and created_at < cutoff and path not in self._outbox:
+                        candidates.append(path)
+                for start in range(0, len(candidates), settings.BULK_DOCUMENTS_BATCH_SIZE):
+                    batch = candidates[start:start + settings.BULK_DOCUMENTS_BATCH_SIZE]
+                    response = await db.table("documents").select("storage_path").in_("storage_path", batch).execute()
+                    referenced = {row["storage_path"] for row in response.data}
+                    orphans.extend(path for path in batch if path not in referenced)
+
+        self.reconciles += 1
+        self.orphans_found += len(orphans)
+        if orphans:
+            logger.info("Reconciliation found %d orphaned files in storage", len(orphans))
+            self.enqueue(orphans)
+        return len(orphans)
+
+    # --- Background tasks ---
+
+    def start(self) -> None:
+        if not self._tasks:
+            try:
+                self._adopt_journals()
+            except OSError as e:
+                logger.warning("Could not recover pending storage deletions: %s", e)
+            self._tasks.append(asyncio.create_task(self._run_sweeper()))
+            if settings.SUPABASE_SERVICE_ROLE_KEY and self.reconcile_interval > 0:
+                self._tasks.append(asyncio.create_task(self._run_reconciler()))
+
+    async def stop(self) -> None:
+        """Stops the background tasks. Pending entries stay in the journal for the next start."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Released, the journal can be adopted by the next worker to start.
+        for lock in (self._journal_lock, self._reconcile_lock):
+            if lock is not None:
+                lock.close()
+        self._journal_lock = self._reconcile_lock = None
+
+    async def _run_sweeper(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.sweep_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._outbox:
+                continue
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning("Storage sweep failed: %s", e)
+
+    async def _run_reconciler(self) -> None:
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            if self._reconcile_lock is None:
+                try:
+                    self._reconcile_lock = _try_lock(f"{self.journal_path}.reconcile.lock")
+                except OSError as e:
+                    logger.warning("Could not open the storage reconciliation lock: %s", e)
+                if self._reconcile_lock is None:
+                    continue  # Another worker reconciles.
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning("Storage reconciliation failed: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._outbox),
+            "removed": self.removed,
+            "failed_removals": self.failed_removals,
+            "abandoned": self.abandoned,
+            "reconciles": self.reconciles,
+            "orphans_found": self.orphans_found,
+            "reconciler": self._reconcile_lock is not None,
+        }
+
+
+storage_gc = StorageGarbageCollector(
+    bucket=BUCKET_NAME,
+    journal_path=settings.STORAGE_GC_JOURNAL,
+    batch_size=settings.STORAGE_GC_BATCH_SIZE,
+    sweep_interval=settings.STORAGE_GC_SWEEP_INTERVAL_SECONDS,
+    max_attempts=settings.STORAGE_GC_MAX_ATTEMPTS,
+    retry_backoff=settings.STORAGE_GC_RETRY_BACKOFF_SECONDS,
+    reconcile_interval=settings.STORAGE_GC_RECONCILE_INTERVAL_SECONDS,
+    reconcile_grace=settings.STORAGE_GC_RECONCILE_GRACE_SECONDS,
+)
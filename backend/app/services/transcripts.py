@@ -0,0 +1,531 @@
+"""
+Conversation transcripts.
+
+Messages are kept per conversation on local disk, next to the vector index,
+under `<TRANSCRIPT_DIR>/<chatbot_id>/`:
+
+- `<conversation_id>.tail`: the newest messages, one JSON line each, appended
+  as they arrive.
+- `<conversation_id>.<generation>.seg`: sealed blocks. Once the tail holds
+  `block_messages` messages they are compressed into one block and appended.
+- `<conversation_id>.idx`: a header naming the segment generation, then one
+  fixed-size record per block: its offset and length in the segment, the
+  sequence number of its first message, its message count and the time of its
+  last message.
+- `.recent`: one `<conversation_id>\t<time>` line per append, the time of its
+  newest message. Listings replay it incrementally into an ordered index, so a
+  page costs a bisect however many conversations the chatbot has. When it has
+  grown well past one line per conversation, compaction rewrites it.
+
+Messages are numbered per conversation, so history is read newest first, one
+page at a time: the tail, then blocks from the end as located through the
+index, decompressing only the blocks a page touches. A background task seals
+the tails of conversations that have gone quiet and merges their blocks into
+fewer, larger ones compressed harder. It writes them to a new segment
+generation and switches the index over with a rename, so a crash leaves either
+the old transcript or the new one.
+
+Reads and writes of a conversation are serialized by a lock of its own, which
+also holds across worker processes on the host where `fcntl` is available.
+They hold a shared lock on the chatbot as well, which dropping its transcripts
+or rewriting `.recent` takes exclusively.
+"""
+import asyncio
+import bisect
+import contextlib
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import weakref
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<4sI")  # magic, segment generation
+_RECORD = struct.Struct("<QIIId")  # offset, length, first seq, count, last message time
+_MAGIC = b"CFT1"
+
+@dataclass
+class _Block:
+    offset: int
+    length: int
+    first_seq: int
+    count: int
+    last_at: float
+
+
+_RECENT_HEADER = b"# conversation\tlast message time\n"
+# `.recent` is rewritten once it holds this many lines beyond two per conversation.
+_RECENT_SLACK = 1024
+
+
+@dataclass
+class _Recency:
+    """A chatbot's conversations ordered by last message, as replayed from its `.recent` file."""
+    inode: int = -1
+    offset: int = 0
+    lines: int = 0
+    # Whether the file was written by a rewrite, so it names every conversation.
+    complete: bool = False
+    last_at: Dict[str, float] = field(default_factory=dict)
+    ordered: List[Tuple[float, str]] = field(default_factory=list)
+
+    def update(self, conversation_id: str, at: float) -> None:
+        previous = self.last_at.get(conversation_id)
+        if previous is not None:
+            if at <= previous:
+                return
+            del self.ordered[bisect.bisect_left(self.ordered, (previous, conversation_id))]
+        self.last_at[conversation_id] = at
+        bisect.insort(self.ordered, (at, conversation_id))
+
+
+def _parse_recent(line: str) -> Optional[Tuple[str, float]]:
+    conversation_id, _, at = line.rstrip("\n").partition("\t")
+    try:
+        return conversation_id, float(at)
+    except ValueError:
+        # The header, or a line cut short by a crash.
+        return None
+
+
+def _timestamp(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+def _message(entry: list) -> dict:
+    seq, sent_at, role, text = entry
+    return {"seq": seq, "role": role, "text": text, "sentAt": _timestamp(sent_at)}
+
+
+def _encode_block(entries: Sequence[list], level: int) -> bytes:
+    return zlib.compress("\n".join(json.dumps(e, separators=(",", ":")) for e in entries).encode(), level)
+
+
+def _decode_block(data: bytes) -> List[list]:
+    return [json.loads(line) for line in zlib.decompress(data).decode().split("\n")]
+
+
+class TranscriptStore:
+    def __init__(
+        self,
+        directory: str,
+        block_messages: int,
+        compact_block_messages: int,
+        compact_after: float,
+        compact_interval: float,
+    ):
+        self.directory = directory
+        self.block_messages = block_messages
+        self.compact_block_messages = compact_block_messages
+        self.compact_after = compact_after
+        self.compact_interval = compact_interval
+        # Conversation locks are dropped once no thread holds or waits on them.
+        self._locks: "weakref.WeakValueDictionary[Tuple[str, str], threading.Lock]" = weakref.WeakValueDictionary()
+        self._locks_guard = threading.Lock()
+        self._recency: Dict[str, _Recency] = {}
+        self._recency_guard = threading.Lock()
+        self._compactor: Optional[asyncio.Task] = None
+        self.appended = 0
+        self.sealed_blocks = 0
+        self.compacted = 0
+        os.makedirs(directory, exist_ok=True)
+
+    # --- Files ---
+
+    @staticmethod
+    def _check_name(value: str, what: str) -> None:
+        # Ids become file names; reject anything that could escape the directory.
+        if not value or len(value) > 100 or os.path.basename(value) != value or value.startswith(".") or "." in value:
+            raise ValueError(f"Invalid {what}: {value!r}")
+
+    def _chatbot_dir(self, chatbot_id: str) -> str:
+        self._check_name(chatbot_id, "chatbot id")
+        return os.path.join(self.directory, chatbot_id)
+
+    def _paths(self, chatbot_id: str, conversation_id: str) -> Tuple[str, str]:
+        self._check_name(conversation_id, "conversation id")
+        base = os.path.join(self._chatbot_dir(chatbot_id), conversation_id)
+        return f"{base}.idx", f"{base}.tail"
+
+    @staticmethod
+    def _segment_path(idx_path: str, generation: int) -> str:
+        return f"{idx_path[:-len('.idx')]}.{generation}.seg"
+
+    def _recent_path(self, chatbot_id: str) -> str:
+        return os.path.join(self._chatbot_dir(chatbot_id), ".recent")
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _flock(path: str, exclusive: bool):
+        # flock() conflicts between separately opened files of one process too,
+        # so this orders threads as well as worker processes.
+        with open(path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def _chatbot_lock(self, chatbot_id: str, exclusive: bool):
+        directory = self._chatbot_dir(chatbot_id)
+        os.makedirs(directory, exist_ok=True)
+        with self._flock(os.path.join(directory, ".lock"), exclusive):
+            yield
+
+    @contextlib.contextmanager
+    def _lock(self, chatbot_id: str, conversation_id: str):
+        idx_path, _ = self._paths(chatbot_id, conversation_id)
+        with self._locks_guard:
+            lock = self._locks.get((chatbot_id, conversation_id))
+            if lock is None:
+                lock = self._locks[(chatbot_id, conversation_id)] = threading.Lock()
+        with self._chatbot_lock(chatbot_id, exclusive=False), lock:
+            with self._flock(f"{idx_path[:-len('.idx')]}.lock", exclusive=True):
+                yield
+
+    @staticmethod
+    def _read_index(idx_path: str) -> Tuple[int, List[_Block]]:
+        try:
+            with open(idx_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0, []
+        if len(data) < _HEADER.size:
+            return 0, []
+        magic, generation = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError(f"{idx_path} is not a transcript index")
+        # A trailing partial record is a write cut short by a crash; ignore it.
+        count = (len(data) - _HEADER.size) // _RECORD.size
+        return generation, [_Block(*_RECORD.unpack_from(data, _HEADER.size + i * _RECORD.size)) for i in range(count)]
+
+    @staticmethod
+    def _read_tail(tail_path: str, sealed: int) -> List[list]:
+        """The unsealed messages; lines already sealed, or cut short by a crash, are skipped."""
+        try:
+            with open(tail_path) as f:
+                lines = f.read().split("\n")
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry[0] == sealed + len(entries):
+                entries.append(entry)
+        return entries
+
+    @staticmethod
+    def _sealed(blocks: List[_Block]) -> int:
+        return blocks[-1].first_seq + blocks[-1].count if blocks else 0
+
+    def _seal(self, idx_path: str, tail_path: str, generation: int, blocks: List[_Block], tail: List[list]) -> None:
+        payload = _encode_block(tail, zlib.Z_DEFAULT_COMPRESSION)
+        end = blocks[-1].offset + blocks[-1].length if blocks else 0
+        with open(self._segment_path(idx_path, generation), "ab") as f:
+            # Discard bytes a crashed writer appended without indexing them.
+            f.truncate(end)
+            f.write(payload)
+        with open(idx_path, "ab") as f:
+            if blocks:
+                f.truncate(_HEADER.size + len(blocks) * _RECORD.size)
+            else:
+                f.truncate(0)
+                f.write(_HEADER.pack(_MAGIC, generation))
+            f.write(_RECORD.pack(end, len(payload), tail[0][0], len(tail), tail[-1][1]))
+        open(tail_path, "w").close()
+        self.sealed_blocks += 1
+
+    # --- Writes ---
+
+    def append(self, chatbot_id: str, conversation_id: str, messages: Sequence[Tuple[str, str]]) -> int:
+        """Appends `(role, text)` messages to a conversation; returns the sequence number of the last one."""
+        idx_path, tail_path = self._paths(chatbot_id, conversation_id)
+        with self._lock(chatbot_id, conversation_id):
+            generation, blocks = self._read_index(idx_path)
+            sealed = self._sealed(blocks)
+            tail = self._read_tail(tail_path, sealed)
+            seq, now = sealed + len(tail), time.time()
+            lines = []
+            for role, text in messages:
+                entry = [seq, now, role, text]
+                tail.append(entry)
+                lines.append(json.dumps(entry, separators=(",", ":")) + "\n")
+                seq += 1
+            with open(tail_path, "a") as f:
+                f.write("".join(lines))
+            if len(tail) >= self.block_messages:
+                self._seal(idx_path, tail_path, generation, blocks, tail)
+            # One short write in append mode, so concurrent appenders don't interleave.
+            with open(self._recent_path(chatbot_id), "a") as f:
+                f.write(f"{conversation_id}\t{now!r}\n")
+        self.appended += len(messages)
+        return seq - 1
+
+    async def record(self, chatbot_id: str, conversation_id: str, messages: Sequence[Tuple[str, str]]) -> None:
+        """`append` off the event loop. A failure is logged, not raised, so it never breaks a chat."""
+        try:
+            await asyncio.to_thread(self.append, chatbot_id, conversation_id, messages)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not record messages of conversation %s of chatbot %s: %s", conversation_id, chatbot_id, e)
+
+    def compact(self, chatbot_id: str, conversation_id: str) -> bool:
+        """
+        Rewrites a conversation as few large, maximally compressed blocks,
+        including its tail. Returns False if it was already compact.
+        """
+        idx_path, tail_path = self._paths(chatbot_id, conversation_id)
+        with self._lock(chatbot_id, conversation_id):
+            generation, blocks = self._read_index(idx_path)
+            tail = self._read_tail(tail_path, self._sealed(blocks))
+            if not tail and sum(block.count < self.compact_block_messages for block in blocks) <= 1:
+                return False
+
+            entries: List[list] = []
+            if blocks:
+                with open(self._segment_path(idx_path, generation), "rb") as f:
+                    for block in blocks:
+                        f.seek(block.offset)
+                        entries += _decode_block(f.read(block.length))
+            entries += tail
+
+            new_generation = generation + 1
+            records, offset = [], 0
+            with open(self._segment_path(idx_path, new_generation), "wb") as f:
+                for start in range(0, len(entries), self.compact_block_messages):
+                    chunk = entries[start:start + self.compact_block_messages]
+                    payload = _encode_block(chunk, 9)
+                    f.write(payload)
+                    records.append(_RECORD.pack(offset, len(payload), chunk[0][0], len(chunk), chunk[-1][1]))
+                    offset += len(payload)
+            with open(f"{idx_path}.tmp", "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, new_generation) + b"".join(records))
+            os.replace(f"{idx_path}.tmp", idx_path)
+            open(tail_path, "w").close()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._segment_path(idx_path, generation))
+            # Idle conversations are found by modification time; keep it at the last message.
+            last_at = entries[-1][1]
+            os.utime(idx_path, (last_at, last_at))
+            os.utime(tail_path, (last_at, last_at))
+        self.compacted += 1
+        return True
+
+    def drop(self, chatbot_id: str) -> None:
+        """
+        Deletes every transcript of a chatbot. Its lock file stays, so a writer
+        already waiting on it cannot lock a file the next writer does not see.
+        """
+        directory = self._chatbot_dir(chatbot_id)
+        if not os.path.isdir(directory):
+            return
+        with self._chatbot_lock(chatbot_id, exclusive=True), os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name != ".lock":
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(entry.path)
+        with self._recency_guard:
+            self._recency.pop(chatbot_id, None)
+
+    def _rewrite_recent(self, chatbot_id: str) -> None:
+        """
+        Rewrites a chatbot's `.recent` with one line per conversation, oldest
+        first, adding any conversation it does not name from file modification
+        times.
+        """
+        directory = self._chatbot_dir(chatbot_id)
+        path = self._recent_path(chatbot_id)
+        with self._chatbot_lock(chatbot_id, exclusive=True):
+            latest: Dict[str, float] = {}
+            with contextlib.suppress(FileNotFoundError), open(path) as f:
+                for line in f:
+                    parsed = _parse_recent(line)
+                    if parsed is not None:
+                        latest[parsed[0]] = max(latest.get(parsed[0], 0.0), parsed[1])
+            unnamed: Dict[str, float] = {}
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    name, extension = os.path.splitext(entry.name)
+                    if extension in (".idx", ".tail") and name not in latest:
+                        unnamed[name] = max(unnamed.get(name, 0.0), entry.stat().st_mtime)
+            latest.update(unnamed)
+            lines = "".join(f"{name}\t{at!r}\n" for at, name in sorted((at, name) for name, at in latest.items()))
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(_RECENT_HEADER + lines.encode())
+            os.replace(f"{path}.tmp", path)
+
+    # --- Reads ---
+
+    def exists(self, chatbot_id: str, conversation_id: str) -> bool:
+        """Whether the conversation has any recorded messages."""
+        return any(os.path.exists(path) for path in self._paths(chatbot_id, conversation_id))
+
+    def history(self, chatbot_id: str, conversation_id: str, limit: int, before: Optional[int] = None) -> Optional[Tuple[List[dict], Optional[int]]]:
+        """
+        Returns up to `limit` messages older than sequence number `before` (the
+        newest when None), oldest first, and the `before` of the next older page
+        if there is one. None if the conversation does not exist.
+        """
+        idx_path, tail_path = self._paths(chatbot_id, conversation_id)
+        if not os.path.exists(tail_path) and not os.path.exists(idx_path):
+            return None
+        with self._lock(chatbot_id, conversation_id):
+            generation, blocks = self._read_index(idx_path)
+            sealed = self._sealed(blocks)
+            tail = self._read_tail(tail_path, sealed)
+            if before is None:
+                before = sealed + len(tail)
+
+            page = [entry for entry in tail if entry[0] < before][-limit:]
+            if len(page) < limit and blocks and min(before, sealed) > 0:
+                # The last block holding a message older than `before`.
+                i = bisect.bisect_left([block.first_seq for block in blocks], min(before, sealed)) - 1
+                with open(self._segment_path(idx_path, generation), "rb") as f:
+                    while i >= 0 and len(page) < limit:
+                        f.seek(blocks[i].offset)
+                        older = [entry for entry in _decode_block(f.read(blocks[i].length)) if entry[0] < before]
+                        page = older[-(limit - len(page)):] + page
+                        i -= 1
+
+        next_before = page[0][0] if page and page[0][0] > 0 else None
+        return [_message(entry) for entry in page], next_before
+
+    def _replay_recent(self, chatbot_id: str) -> _Recency:
+        """Brings the chatbot's ordered index up to date with its `.recent`. Hold `_recency_guard`."""
+        recency = self._recency.get(chatbot_id)
+        try:
+            f = open(self._recent_path(chatbot_id), "rb")
+        except FileNotFoundError:
+            self._recency.pop(chatbot_id, None)
+            return _Recency()
+        with f:
+            stat = os.fstat(f.fileno())
+            # A rewrite or a drop replaced the file; start over.
+            if recency is None or recency.inode != stat.st_ino or stat.st_size < recency.offset:
+                recency = self._recency[chatbot_id] = _Recency(inode=stat.st_ino)
+            f.seek(recency.offset)
+            data = f.read()
+        if recency.offset == 0:
+            recency.complete = data.startswith(_RECENT_HEADER)
+        # A line still being written is picked up on the next replay.
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode().splitlines():
+            parsed = _parse_recent(line)
+            if parsed is not None:
+                recency.update(*parsed)
+                recency.lines += 1
+        recency.offset += end
+        return recency
+
+    def list_conversations(
+        self, chatbot_id: str, limit: int, after: Optional[Tuple[float, str]] = None
+    ) -> Tuple[List[dict], Optional[Tuple[float, str]]]:
+        """
+        Returns a page of a chatbot's conversations, most recently active first,
+        and the `(last message time, id)` position to pass as `after` for the
+        next page. Only the conversations on the page are opened.
+        """
+        if not os.path.isdir(self._chatbot_dir(chatbot_id)):
+            return [], None
+        with self._recency_guard:
+            complete = self._replay_recent(chatbot_id).complete
+        if not complete:
+            # Written by appends alone, e.g. for a new chatbot or after a drop.
+            self._rewrite_recent(chatbot_id)
+        with self._recency_guard:
+            ordered = self._replay_recent(chatbot_id).ordered
+            end = bisect.bisect_left(ordered, after) if after is not None else len(ordered)
+            page = ordered[max(0, end - limit):end][::-1]
+
+        rows = []
+        for last_at, conversation_id in page:
+            idx_path, tail_path = self._paths(chatbot_id, conversation_id)
+            with self._lock(chatbot_id, conversation_id):
+                _, blocks = self._read_index(idx_path)
+                sealed = self._sealed(blocks)
+                count = sealed + len(self._read_tail(tail_path, sealed))
+            rows.append({"id": conversation_id, "messageCount": count, "lastMessageAt": _timestamp(last_at)})
+        return rows, (page[-1] if end > limit else None)
+
+    # --- Background compaction ---
+
+    def compact_idle(self) -> int:
+        """Compacts every conversation that has been quiet for `compact_after` seconds."""
+        cutoff = time.time() - self.compact_after
+        compacted = 0
+        with os.scandir(self.directory) as chatbots:
+            chatbot_ids = [entry.name for entry in chatbots if entry.is_dir()]
+        for chatbot_id in chatbot_ids:
+            quiet: Dict[str, bool] = {}
+            with contextlib.suppress(FileNotFoundError), os.scandir(os.path.join(self.directory, chatbot_id)) as entries:
+                for entry in entries:
+                    name, extension = os.path.splitext(entry.name)
+                    if extension in (".idx", ".tail"):
+                        quiet[name] = quiet.get(name, True) and entry.stat().st_mtime < cutoff
+            for conversation_id, is_quiet in quiet.items():
+                if not is_quiet:
+                    continue
+                try:
+                    compacted += self.compact(chatbot_id, conversation_id)
+                except (OSError, ValueError) as e:
+                    logger.warning("Could not compact conversation %s of chatbot %s: %s", conversation_id, chatbot_id, e)
+            try:
+                with self._recency_guard:
+                    recency = self._replay_recent(chatbot_id)
+                if recency.lines > 2 * len(recency.last_at) + _RECENT_SLACK:
+                    self._rewrite_recent(chatbot_id)
+            except (OSError, ValueError) as e:
+                logger.warning("Could not rewrite the conversation list of chatbot %s: %s", chatbot_id, e)
+        return compacted
+
+    def start(self) -> None:
+        if self._compactor is None:
+            self._compactor = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._compactor is not None:
+            self._compactor.cancel()
+            await asyncio.gather(self._compactor, return_exceptions=True)
+            self._compactor = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                compacted = await asyncio.to_thread(self.compact_idle)
+            except Exception as e:
+                logger.warning("Transcript compaction failed: %s", e)
+            else:
+                if compacted:
+                    logger.info("Compacted %d conversation transcripts", compacted)
+
+    def stats(self) -> dict:
+        return {"appended": self.appended, "sealed_blocks": self.sealed_blocks, "compacted": self.compacted}
+
+
+transcript_store = TranscriptStore(
+    directory=settings.TRANSCRIPT_DIR,
+    block_messages=settings.TRANSCRIPT_BLOCK_MESSAGES,
+    compact_block_messages=settings.TRANSCRIPT_COMPACT_BLOCK_MESSAGES,
+    compact_after=settings.TRANSCRIPT_COMPACT_AFTER_SECONDS,
+    compact_interval=settings.TRANSCRIPT_COMPACT_INTERVAL_SECONDS,
+)
@@ -0,0 +1,398 @@
+"""
+Semantic retrieval over a chatbot's knowledge base.
+
+Chunk embeddings for each chatbot live on disk as a raw float32 matrix
+(`<chatbot_id>.<generation>.f32`, one row per chunk) next to a JSON sidecar
+(`<chatbot_id>.ids.json`) holding the matrix generation, the row ids, chunk
+texts and chunk hashes, and the identity of the embedder that produced the
+rows. A rewrite goes to a new generation, which the sidecar names once it is
+complete, so a reader always maps the matrix its sidecar describes. An index
+written by a different embedder is re-embedded from its stored texts before
+it is searched or changed. Searches memory-map the matrix read-only, so every
+worker on a host shares one page-cached copy and nothing is loaded into the
+Python heap; a top-k query is a single matrix-vector product. When a
+document is re-ingested, chunks whose hash it already has keep their rows, so
+only changed chunks are embedded again.
+"""
+import contextlib
+import importlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.chunking import text_hash, tokenize
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only.
+    fcntl = None
+
+EmbeddingFunction = Callable[[Sequence[str]], np.ndarray]
+
+
+class HashingEmbedder:
+    """
+    A dependency-free embedding: unigrams and bigrams are hashed into `dimensions`
+    signed buckets and the vector is L2-normalized. Deterministic and offline, so
+    it is the default and what tests run against; swap in a learned model with
+    `EMBEDDING_FUNCTION`. `tokenizer` defaults to the stopword-filtered
+    `tokenize` used for passages.
+
+    Each feature lands in two buckets, so one colliding feature of opposite
+    sign cannot cancel a shared term outright.
+    """
+
+    _SEEDS = (0, 0x9E3779B9)
+    # Bump when the features or hashing change, so stored indexes are rebuilt.
+    VERSION = 2
+
+    def __init__(self, dimensions: int, tokenizer: Callable[[str], List[str]] = tokenize):
+        self.dimensions = dimensions
+        self.tokenizer = tokenizer
+        self.identity = f"hashing/{self.VERSION}"
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = self.tokenizer(text)
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                encoded = feature.encode()
+                for seed in self._SEEDS:
+                    hashed = zlib.crc32(encoded, seed)
+                    sign = 1.0 if hashed & 0x80000000 else -1.0
+                    matrix[row, hashed % self.dimensions] += sign
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+def load_embedding_function(path: Optional[str], dimensions: int) -> EmbeddingFunction:
+    """Resolves a `module:callable` path, or returns the hashing embedder when unset."""
+    if not path:
+        return HashingEmbedder(dimensions)
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def embedder_identity(embed: EmbeddingFunction, path: Optional[str], version: str) -> str:
+    """Names the embedder in index sidecars: its own `identity`, else its path and the configured version."""
+    identity = getattr(embed, "identity", None)
+    return identity if identity else f"{path}@{version}"
+
+
+@dataclass
+class VectorHit:
+    document_id: str
+    chunk_index: int
+    text: str
+    score: float
+
+
+class _OpenIndex:
+    __slots__ = ("version", "matrix", "ids", "texts")
+
+    def __init__(self, version, matrix, ids, texts):
+        self.version = version
+        self.matrix = matrix
+        self.ids = ids
+        self.texts = texts
+
+
+class VectorStore:
+    """Per-chatbot memory-mapped embedding matrices with batched writes."""
+
+    def __init__(self, directory: str, embed: EmbeddingFunction, embedder: str, dimensions: int, batch_size: int, max_open: int):
+        self.directory = directory
+        self.embed = embed
+        self.embedder = embedder
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.max_open = max_open
+        self._open: "OrderedDict[str, _OpenIndex]" = OrderedDict()
+        # Searches run on threadpool threads, so the open-index cache has its own lock.
+        self._open_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, chatbot_id: str):
+        # Chatbot ids are UUIDs; reject anything that could escape the directory.
+        if not chatbot_id or os.path.basename(chatbot_id) != chatbot_id or chatbot_id.startswith("."):
+            raise ValueError(f"Invalid chatbot id: {chatbot_id!r}")
+        base = os.path.join(self.directory, chatbot_id)
+        return f"{base}.f32", f"{base}.ids.json", f"{base}.lock"
+
+    def _matrix_path(self, chatbot_id: str, sidecar: dict) -> str:
+        """The matrix file a sidecar describes; sidecars written before generations name `<chatbot_id>.f32`."""
+        legacy_path, _, _ = self._paths(chatbot_id)
+        generation = sidecar.get("generation")
+        if generation is None:
+            return legacy_path
+        return os.path.join(self.directory, f"{chatbot_id}.{int(generation)}.f32")
+
+    @contextlib.contextmanager
+    def _write_lock(self, chatbot_id: str):
+        """Serializes writers across threads and, where supported, across worker processes."""
+        _, _, lock_path = self._paths(chatbot_id)
+        with self._thread_lock, open(lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_sidecar(self, chatbot_id: str) -> dict:
+        _, sidecar_path, _ = self._paths(chatbot_id)
+        try:
+            with open(sidecar_path) as f:
+                sidecar = json.load(f)
+        except FileNotFoundError:
+            return {"embedder": self.embedder, "dimensions": self.dimensions, "generation": 0, "ids": [], "texts": [], "hashes": []}
+        if "hashes" not in sidecar:
+            # Written before chunk hashes were stored.
+            sidecar["hashes"] = [text_hash(text) for text in sidecar["texts"]]
+        return sidecar
+
+    def _is_current(self, sidecar: dict) -> bool:
+        # Sidecars written before the embedder was recorded have no "embedder" and count as stale.
+        return sidecar.get("embedder") == self.embedder and sidecar.get("dimensions") == self.dimensions
+
+    def _read_current_sidecar(self, chatbot_id: str) -> dict:
+        """
+        Reads the sidecar under the write lock, first re-embedding every row
+        from the stored texts if the index was built by another embedder.
+        """
+        sidecar = self._read_sidecar(chatbot_id)
+        if self._is_current(sidecar):
+            return sidecar
+        sidecar["embedder"] = self.embedder
+        sidecar["dimensions"] = self.dimensions
+        self._write_files(chatbot_id, self._embed_batched(sidecar["texts"]), sidecar)
+        return sidecar
+
+    def rebuild_stale(self, chatbot_id: str) -> bool:
+        """Re-embeds the chatbot's index if another embedder built it; returns whether it did."""
+        with self._write_lock(chatbot_id):
+            if self._is_current(self._read_sidecar(chatbot_id)):
+                return False
+            self._read_current_sidecar(chatbot_id)
+            return True
+
+    @staticmethod
+    def _document_rows(sidecar: dict, document_id: str) -> Dict[str, int]:
+        """Maps the hashes of a document's chunks to their rows."""
+        return {
+            sidecar["hashes"][row]: row
+            for row, (doc, _) in enumerate(sidecar["ids"])
+            if doc == document_id
+        }
+
+    def _write_files(self, chatbot_id: str, matrix: np.ndarray, sidecar: dict) -> None:
+        """
+        Writes the matrix as the next generation, then publishes it by replacing
+        the sidecar. The previous matrix is unlinked last; open mappings of it
+        stay valid.
+        """
+        _, sidecar_path, _ = self._paths(chatbot_id)
+        old_path = self._matrix_path(chatbot_id, sidecar)
+        sidecar["generation"] = sidecar.get("generation", 0) + 1
+        matrix_path = self._matrix_path(chatbot_id, sidecar)
+        with open(f"{matrix_path}.tmp", "wb") as f:
+            f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        os.replace(f"{matrix_path}.tmp", matrix_path)
+        with open(f"{sidecar_path}.tmp", "w") as f:
+            json.dump(sidecar, f)
+        os.replace(f"{sidecar_path}.tmp", sidecar_path)
+        with contextlib.suppress(OSError):
+            os.remove(old_path)
+
+    def _embed_batched(self, texts: List[str]) -> np.ndarray:
+        batches = [
+            self.embed(texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        if not batches:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return np.vstack(batches).astype(np.float32, copy=False)
+
+    def _embed_missing(self, chunks: List[str], hashes: List[str], known: Dict[str, int], embedded: Dict[str, np.ndarray]) -> None:
+        missing = {h: chunk for chunk, h in zip(chunks, hashes) if h not in known and h not in embedded}
+        if missing:
+            embedded.update(zip(missing, self._embed_batched(list(missing.values()))))
+
+    def add_document(self, chatbot_id: str, document_id: str, chunks: List[str], confirm: Optional[Callable[[], bool]] = None) -> int:
+        """
+        Stores a document's chunk embeddings, replacing older rows for it. Chunks
+        the document already has (by hash) reuse their rows; the rest are
+        embedded in batches. Returns the number of chunks embedded.
+
+        `confirm` is called under the write lock and nothing is stored if it
+        returns False. Removals take the same lock after deleting the document
+        row, so checking that the row still exists there means a deleted
+        document is never indexed again.
+        """
+        hashes = [text_hash(chunk) for chunk in chunks]
+        embedded: Dict[str, np.ndarray] = {}
+        # Embed outside the lock; anything a concurrent writer removed meanwhile is embedded under it.
+        self._embed_missing(chunks, hashes, self._document_rows(self._read_sidecar(chatbot_id), document_id), embedded)
+        with self._write_lock(chatbot_id):
+            if confirm is not None and not confirm():
+                return 0
+            sidecar = self._read_current_sidecar(chatbot_id)
+            rows = self._document_rows(sidecar, document_id)
+            current = [sidecar["hashes"][i] for i, (doc, _) in enumerate(sidecar["ids"]) if doc == document_id]
+            if current == hashes:
+                return 0
+            self._embed_missing(chunks, hashes, rows, embedded)
+
+            keep = [i for i, (doc, _) in enumerate(sidecar["ids"]) if doc != document_id]
+            existing = self._load_matrix(chatbot_id, sidecar)
+            embeddings = (
+                np.vstack([existing[rows[h]] if h in rows else embedded[h] for h in hashes]).astype(np.float32, copy=False)
+                if hashes else np.zeros((0, self.dimensions), dtype=np.float32)
+            )
+            if len(keep) == len(sidecar["ids"]):
+                # New document: append rows in place. Readers map the old row count
+                # from the sidecar, which is only swapped once the rows are written.
+                _, sidecar_path, _ = self._paths(chatbot_id)
+                with open(self._matrix_path(chatbot_id, sidecar), "ab") as f:
+                    # Discard rows a crashed writer appended without publishing them.
+                    f.truncate(len(sidecar["ids"]) * self.dimensions * 4)
+                    f.write(embeddings.tobytes())
+                sidecar["ids"] += [[document_id, n] for n in range(len(chunks))]
+                sidecar["texts"] += list(chunks)
+                sidecar["hashes"] += hashes
+                with open(f"{sidecar_path}.tmp", "w") as f:
+                    json.dump(sidecar, f)
+                os.replace(f"{sidecar_path}.tmp", sidecar_path)
+                return len(embedded)
+            matrix = np.vstack([existing[keep], embeddings]) if len(keep) else embeddings
+            sidecar["ids"] = [sidecar["ids"][i] for i in keep] + [[document_id, n] for n in range(len(chunks))]
+            sidecar["texts"] = [sidecar["texts"][i] for i in keep] + list(chunks)
+            sidecar["hashes"] = [sidecar["hashes"][i] for i in keep] + hashes
+            self._write_files(chatbot_id, matrix, sidecar)
+            return len(embedded)
+
+    def remove_document(self, chatbot_id: str, document_id: str) -> None:
+        self.remove_documents(chatbot_id, [document_id])
+
+    def remove_documents(self, chatbot_id: str, document_ids: List[str]) -> None:
+        """Removes several documents' rows with a single rewrite of the index."""
+        removed = set(document_ids)
+        with self._write_lock(chatbot_id):
+            sidecar = self._read_current_sidecar(chatbot_id)
+            keep = [i for i, (doc, _) in enumerate(sidecar["ids"]) if doc not in removed]
+            if len(keep) == len(sidecar["ids"]):
+                return
+            matrix = self._load_matrix(chatbot_id, sidecar)[keep]
+            sidecar["ids"] = [sidecar["ids"][i] for i in keep]
+            sidecar["texts"] = [sidecar["texts"][i] for i in keep]
+            sidecar["hashes"] = [sidecar["hashes"][i] for i in keep]
+            self._write_files(chatbot_id, matrix, sidecar)
+
+    def drop(self, chatbot_id: str) -> None:
+        # The lock file stays: another process may be waiting on it, and a new
+        # one would let the next writer run alongside that process.
+        with self._write_lock(chatbot_id):
+            legacy_path, sidecar_path, _ = self._paths(chatbot_id)
+            matrix_path = self._matrix_path(chatbot_id, self._read_sidecar(chatbot_id))
+            for path in (sidecar_path, matrix_path, legacy_path):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+        with self._open_lock:
+            self._open.pop(chatbot_id, None)
+
+    def _load_matrix(self, chatbot_id: str, sidecar: dict) -> np.ndarray:
+        rows = len(sidecar["ids"])
+        if not rows:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return np.memmap(self._matrix_path(chatbot_id, sidecar), dtype=np.float32, mode="r", shape=(rows, self.dimensions))
+
+    def version(self, chatbot_id: str) -> Optional[int]:
+        """
+        Changes whenever the chatbot's vectors are written or dropped, in every
+        process on this host; None if it has none.
+        """
+        _, sidecar_path, _ = self._paths(chatbot_id)
+        try:
+            return os.stat(sidecar_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _get_open(self, chatbot_id: str) -> Optional[_OpenIndex]:
+        """Returns the mapped index, remapping it if another writer replaced the files."""
+        _, sidecar_path, _ = self._paths(chatbot_id)
+        try:
+            version = os.stat(sidecar_path).st_mtime_ns
+        except FileNotFoundError:
+            with self._open_lock:
+                self._open.pop(chatbot_id, None)
+            return None
+
+        with self._open_lock:
+            cached = self._open.get(chatbot_id)
+            if cached is not None and cached.version == version:
+                self._open.move_to_end(chatbot_id)
+                return cached
+
+        # Map outside the lock; two threads racing here just map the same files twice.
+        for _ in range(3):
+            sidecar = self._read_sidecar(chatbot_id)
+            if not self._is_current(sidecar):
+                # Rows from another embedder would be scored against incompatible query vectors.
+                self.rebuild_stale(chatbot_id)
+                with contextlib.suppress(FileNotFoundError):
+                    version = os.stat(sidecar_path).st_mtime_ns
+                sidecar = self._read_sidecar(chatbot_id)
+                if not self._is_current(sidecar):
+                    return None
+            try:
+                matrix = self._load_matrix(chatbot_id, sidecar)
+                break
+            except FileNotFoundError:
+                # A writer published and removed a newer generation after the sidecar was read.
+                continue
+        else:
+            return None
+        opened = _OpenIndex(version, matrix, sidecar["ids"], sidecar["texts"])
+        with self._open_lock:
+            self._open[chatbot_id] = opened
+            self._open.move_to_end(chatbot_id)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return opened
+
+    def search(self, chatbot_id: str, query: str, limit: int = 5) -> List[VectorHit]:
+        index = self._get_open(chatbot_id)
+        if index is None or not len(index.ids):
+            return []
+        query_vector = self.embed([query])[0].astype(np.float32, copy=False)
+        scores = index.matrix @ query_vector
+        limit = min(limit, len(scores))
+        top = np.argpartition(scores, -limit)[-limit:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [
+            VectorHit(document_id=index.ids[i][0], chunk_index=index.ids[i][1], text=index.texts[i], score=float(scores[i]))
+            for i in top
+            if scores[i] > 0
+        ]
+
+
+_embed = load_embedding_function(settings.EMBEDDING_FUNCTION, settings.EMBEDDING_DIMENSIONS)
+vector_store = VectorStore(
+    directory=settings.VECTOR_INDEX_DIR,
+    embed=_embed,
+    embedder=embedder_identity(_embed, settings.EMBEDDING_FUNCTION, settings.EMBEDDING_VERSION),
+    dimensions=settings.EMBEDDING_DIMENSIONS,
+    batch_size=settings.EMBEDDING_BATCH_SIZE,
+    max_open=settings.VECTOR_INDEX_MAX_OPEN,
+)
@@ -0,0 +1,104 @@
+"""
+Crawls a synthetic documentation site (`benchmarks/fake_site.py`) through
+`app.services.crawler.Crawler`, then re-crawls it with the validators of the
+first pass, after changing a few pages.
+
+Reports pages per second, the peak number of requests the site saw at once,
+and how many re-crawl fetches were answered with 304. Run from `backend/`:
+
+    python -m benchmarks.bench_crawler --pages 5000 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+os.environ.setdefault("SUPABASE_URL", "http://supabase.invalid")
+os.environ.setdefault("SUPABASE_KEY", "benchmark-anon-key")
+
+import httpx
+
+from app.services.crawler import Crawler, CrawlSession, same_site_links
+from benchmarks.fake_site import FakeSite
+
+ROOT = "https://docs.example.com/docs/0"
+
+
+async def crawl_site(crawler: Crawler, workers: int, depth: int, max_pages: int) -> Dict[str, Tuple[str, str]]:
+    """Follows links breadth-first like ingestion does; returns each page's validators."""
+    session = CrawlSession(ROOT, max_pages)
+    queue: "asyncio.Queue[Tuple[str, int]]" = asyncio.Queue()
+    queue.put_nowait((ROOT, depth))
+    validators: Dict[str, Tuple[str, str]] = {}
+
+    async def worker():
+        while True:
+            url, remaining = await queue.get()
+            try:
+                page = await crawler.fetch(url)
+                validators[url] = (page.etag, page.last_modified)
+                if remaining > 0 and page.is_html:
+                    for link in session.claim(same_site_links(page.url, page.body, session.host)):
+                        queue.put_nowait((link, remaining - 1))
+            finally:
+                queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    await queue.join()
+    for task in tasks:
+        task.cancel()
+    return validators
+
+
+async def recrawl(crawler: Crawler, workers: int, validators: Dict[str, Tuple[Optional[str], Optional[str]]]) -> int:
+    """Conditionally re-fetches every page; returns how many had changed."""
+    semaphore = asyncio.Semaphore(workers)
+
+    async def refresh(url, etag, last_modified):
+        async with semaphore:
+            return not (await crawler.fetch(url, etag, last_modified)).not_modified
+
+    results = await asyncio.gather(*(refresh(url, *pair) for url, pair in validators.items()))
+    return sum(results)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the site takes per request")
+    parser.add_argument("--workers", type=int, default=64, help="concurrent fetch tasks (ingestion workers)")
+    parser.add_argument("--per-host", type=int, default=4)
+    parser.add_argument("--global-limit", type=int, default=32)
+    parser.add_argument("--change-every", type=int, default=50, help="change every Nth page before the re-crawl")
+    args = parser.parse_args()
+
+    site = FakeSite(args.pages, args.fanout, args.latency)
+    # The site runs in process, so its host is never resolved.
+    crawler = Crawler(
+        args.global_limit, args.per_host, max_bytes=1 << 20, timeout=30.0,
+        transport=httpx.ASGITransport(app=site), allow_private_addresses=True,
+    )
+    crawler.start()
+    try:
+        started = time.perf_counter()
+        validators = await crawl_site(crawler, args.workers, args.depth, args.pages)
+        elapsed = time.perf_counter() - started
+        print(f"crawl:   {len(validators)} pages in {elapsed:.1f}s ({len(validators) / elapsed:.0f} pages/s), "
+              f"peak {site.max_in_flight} concurrent requests (per-host limit {args.per_host})")
+
+        changed = site.touch(args.change_every)
+        site.requests = site.max_in_flight = 0
+        started = time.perf_counter()
+        refetched = await recrawl(crawler, args.workers, validators)
+        elapsed = time.perf_counter() - started
+        print(f"recrawl: {len(validators)} pages in {elapsed:.1f}s, {site.not_modified} answered 304, "
+              f"{refetched} re-downloaded ({changed} changed), peak {site.max_in_flight} concurrent requests")
+    finally:
+        await crawler.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
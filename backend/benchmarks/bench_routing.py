@@ -0,0 +1,166 @@
+"""
+Replays a simulated support day through `app.services.routing.ChatRouter`.
+
+Chats arrive at `--rate` per simulated second across `--departments`
+departments, with random priorities and plans, and last an exponentially
+distributed time. Agents (each in one or two departments) go away and come
+back now and then. The simulation runs on a virtual clock, so it replays as
+fast as the router allows.
+
+Reports routing operations per second of wall time, per-operation latency, and
+the simulated wait of chats by priority. `--compare-scan` also times picking
+the least loaded agent by scanning every agent, which is what each assignment
+would cost without the agent pools. Run from `backend/`:
+
+    python -m benchmarks.bench_routing --agents 2000 --chats 200000
+"""
+import argparse
+import heapq
+import os
+import random
+import statistics
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+os.environ.setdefault("SUPABASE_URL", "http://supabase.invalid")
+os.environ.setdefault("SUPABASE_KEY", "benchmark-anon-key")
+
+from app.services.routing import PRIORITIES, ChatRouter
+
+CHATBOT = "bench-bot"
+PLANS = ("free", "free", "free", "pro", "enterprise")
+PRIORITY_WEIGHTS = (2, 10, 3, 1)
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(args) -> None:
+    rng = random.Random(args.seed)
+    clock = VirtualClock()
+    router = ChatRouter(priority_boost=120.0, plan_boosts={"free": 0.0, "pro": 60.0, "enterprise": 300.0}, clock=clock)
+    departments = [f"dept-{i}" for i in range(args.departments)]
+
+    agent_departments: Dict[str, List[str]] = {}
+    for i in range(args.agents):
+        picked = rng.sample(departments, min(len(departments), rng.choice((1, 2))))
+        agent_departments[f"agent-{i}"] = picked
+        router.set_agent(CHATBOT, f"agent-{i}", picked, args.capacity, "online")
+
+    # (time, sequence, kind, payload)
+    events: list = []
+    sequence = 0
+
+    def schedule(at: float, kind: str, payload) -> None:
+        nonlocal sequence
+        heapq.heappush(events, (at, sequence, kind, payload))
+        sequence += 1
+
+    at = 0.0
+    for i in range(args.chats):
+        at += rng.expovariate(args.rate)
+        schedule(at, "arrive", i)
+    # Agents stop taking breaks after the last chat has arrived, so the replay ends.
+    last_arrival = at
+    for agent_id in agent_departments:
+        schedule(rng.expovariate(1 / args.away_every), "away", agent_id)
+
+    priority_of: Dict[str, str] = {}
+    arrived_at: Dict[str, float] = {}
+    waits: Dict[str, List[float]] = defaultdict(list)
+    timings: Dict[str, List[float]] = defaultdict(list)
+
+    def record(assignments) -> None:
+        for assignment in assignments:
+            waits[priority_of[assignment.conversation_id]].append(clock.now - arrived_at[assignment.conversation_id])
+            schedule(clock.now + rng.expovariate(1 / args.duration), "end", assignment.conversation_id)
+
+    started = time.perf_counter()
+    while events:
+        clock.now, _, kind, payload = heapq.heappop(events)
+        if kind == "arrive":
+            conversation_id = f"chat-{payload}"
+            priority = rng.choices(PRIORITIES, PRIORITY_WEIGHTS)[0]
+            priority_of[conversation_id] = priority
+            arrived_at[conversation_id] = clock.now
+            t = time.perf_counter()
+            assignment = router.enqueue(CHATBOT, conversation_id, rng.choice(departments), priority, rng.choice(PLANS))
+            timings["enqueue"].append(time.perf_counter() - t)
+            record([assignment] if assignment is not None else [])
+        elif kind == "end":
+            t = time.perf_counter()
+            assignments = router.release(CHATBOT, payload)
+            timings["release"].append(time.perf_counter() - t)
+            record(assignments)
+        elif kind in ("away", "back"):
+            status = "away" if kind == "away" else "online"
+            t = time.perf_counter()
+            assignments = router.set_agent(CHATBOT, payload, agent_departments[payload], args.capacity, status)
+            timings["status"].append(time.perf_counter() - t)
+            record(assignments)
+            if kind == "away":
+                schedule(clock.now + rng.expovariate(1 / args.away_for), "back", payload)
+            elif clock.now < last_arrival:
+                schedule(clock.now + rng.expovariate(1 / args.away_every), "away", payload)
+    elapsed = time.perf_counter() - started
+
+    operations = sum(len(samples) for samples in timings.values())
+    print(f"{args.chats} chats, {args.agents} agents x {args.capacity} seats, {args.departments} departments, "
+          f"{args.rate:.0f} chats per simulated second over {clock.now:.0f}s")
+    print(f"replayed {operations} routing operations in {elapsed:.2f}s: "
+          f"{operations / elapsed:,.0f} ops/s, {args.chats / elapsed:,.0f} chats/s")
+    for name, samples in timings.items():
+        print(f"  {name:<8} n={len(samples):<8} p50={percentile(samples, 0.5) * 1e6:7.1f}us  "
+              f"p99={percentile(samples, 0.99) * 1e6:7.1f}us")
+    print("simulated wait by priority:")
+    for priority in PRIORITIES:
+        samples = waits[priority]
+        if samples:
+            print(f"  {priority:<7} n={len(samples):<8} mean={statistics.fmean(samples):7.2f}s  "
+                  f"p95={percentile(samples, 0.95):7.2f}s")
+    print(f"router stats: {router.stats()}")
+
+    if args.compare_scan:
+        agents = router.agents(CHATBOT)
+        department = departments[0]
+        t = time.perf_counter()
+        rounds = 1000
+        for _ in range(rounds):
+            min(
+                (agent for agent in agents if department in agent.departments and agent.available),
+                key=lambda agent: (agent.load, agent.last_assigned_at),
+                default=None,
+            )
+        scan = (time.perf_counter() - t) / rounds
+        print(f"scanning all {len(agents)} agents for one assignment: {scan * 1e6:.1f}us "
+              f"(enqueue p50 above: {percentile(timings['enqueue'], 0.5) * 1e6:.1f}us)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=2000)
+    parser.add_argument("--capacity", type=int, default=3, help="concurrent chats per agent")
+    parser.add_argument("--departments", type=int, default=10)
+    parser.add_argument("--chats", type=int, default=200000)
+    parser.add_argument("--rate", type=float, default=20.0, help="chat arrivals per simulated second")
+    parser.add_argument("--duration", type=float, default=300.0, help="mean chat length, simulated seconds")
+    parser.add_argument("--away-every", type=float, default=1800.0, help="mean simulated seconds between an agent's breaks")
+    parser.add_argument("--away-for", type=float, default=300.0, help="mean simulated break length")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compare-scan", action="store_true")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
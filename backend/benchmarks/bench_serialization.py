@@ -0,0 +1,120 @@
+"""
+Compares the two ways a list endpoint can turn database rows into a response
+body:
+
+- `response_model`: build a model per row, let FastAPI validate and serialize
+  the list again against `response_model`, then encode it with the response
+  class (stdlib `json` via `JSONResponse`, or `orjson` via `ORJSONResponse`).
+- `fast path`: `app.core.serialization.model_list_response`, one
+  `TypeAdapter` validation and pydantic-core's own JSON encoder.
+
+Run from `backend/`:
+
+    python -m benchmarks.bench_serialization --rows 1000
+"""
+import argparse
+import json
+import time
+from typing import Callable, List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app.core.serialization import model_list_response
+from app.models.chatbot import ChatbotSummary
+from app.models.document import Document
+
+
+def chatbot_rows(count: int) -> List[dict]:
+    return [
+        {
+            "id": f"00000000-0000-4000-8000-{i:012d}",
+            "name": f"Support bot {i}",
+            "status": "active",
+            "description": "Answers questions about orders, shipping and returns.",
+            "conversations": i * 7,
+            "accuracy": 90,
+            "last_updated": "2024-05-01T12:00:00.000000+00:00",
+        }
+        for i in range(count)
+    ]
+
+
+def document_rows(count: int) -> List[dict]:
+    return [
+        {
+            "id": f"00000000-0000-4000-9000-{i:012d}",
+            "chatbot_id": "00000000-0000-4000-8000-000000000000",
+            "source_type": "file",
+            "source_name": f"handbook-{i}.pdf",
+            "status": "completed",
+            "storage_path": f"user/bot/handbook-{i}.pdf",
+            "content_hash": f"{i:064x}",
+            "created_at": "2024-05-01T12:00:00.000000+00:00",
+            "last_updated": "2024-05-01T12:00:00.000000+00:00",
+        }
+        for i in range(count)
+    ]
+
+
+def _resolve(coroutine):
+    """Runs a coroutine that never suspends, without paying for an event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration as done:
+        return done.value
+    raise RuntimeError("coroutine suspended")
+
+
+def response_model_path(model, rows: List[dict], response_class) -> Callable[[], bytes]:
+    field = create_model_field(name="Response", type_=List[model], mode="serialization")
+
+    def run() -> bytes:
+        items = [model.model_validate(row) for row in rows]
+        content = _resolve(serialize_response(field=field, response_content=items, by_alias=False))
+        return response_class(content).body
+
+    return run
+
+
+def fast_path(model, rows: List[dict]) -> Callable[[], bytes]:
+    return lambda: model_list_response(model, rows).body
+
+
+def measure(run: Callable[[], bytes], repeat: int) -> float:
+    """Best per-call time in milliseconds."""
+    run()
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    for model, rows in ((ChatbotSummary, chatbot_rows(args.rows)), (Document, document_rows(args.rows))):
+        variants = {
+            "response_model + JSONResponse": response_model_path(model, rows, JSONResponse),
+            "response_model + ORJSONResponse": response_model_path(model, rows, ORJSONResponse),
+            "fast path": fast_path(model, rows),
+        }
+        decoded = [json.loads(run()) for run in variants.values()]
+        assert all(body == decoded[0] for body in decoded), "variants disagree on the response body"
+
+        print(f"{model.__name__}, {args.rows} rows")
+        baseline = None
+        for name, run in variants.items():
+            elapsed = measure(run, args.repeat)
+            baseline = baseline or elapsed
+            print(f"  {name:<34} {elapsed:8.2f} ms  {baseline / elapsed:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+A synthetic documentation site for exercising the crawler without a network.
+
+Pages form a tree: `/docs/{n}` links to its `fanout` children, plus the home
+page and an off-site link the crawler must ignore. Every page answers
+conditional requests with `ETag` / `Last-Modified`, and `touch` changes some
+pages so a re-crawl has something to pick up. The app records how many requests
+were in flight, so a benchmark can check the crawler's concurrency limits.
+"""
+import asyncio
+from email.utils import formatdate
+from typing import Dict
+
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, Response
+
+
+class FakeSite:
+    def __init__(self, pages: int, fanout: int = 8, latency: float = 0.0):
+        self.pages = pages
+        self.fanout = fanout
+        self.latency = latency
+        self.versions: Dict[int, int] = {}
+        self.requests = 0
+        self.not_modified = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def touch(self, every: int) -> int:
+        """Changes every `every`-th page; returns how many changed."""
+        changed = range(0, self.pages, every)
+        for n in changed:
+            self.versions[n] = self.versions.get(n, 0) + 1
+        return len(changed)
+
+    def _validators(self, n: int):
+        version = self.versions.get(n, 0)
+        return f'"{n}-{version}"', formatdate(1_700_000_000 + version * 60, usegmt=True)
+
+    def _body(self, n: int) -> str:
+        children = range(n * self.fanout + 1, min((n + 1) * self.fanout + 1, self.pages))
+        links = "".join(f'<li><a href="/docs/{c}#top">Page {c}</a></li>' for c in children)
+        return (
+            f"<html><head><title>Page {n}</title></head><body>"
+            f'<a href="/docs/0">Home</a> <a href="https://elsewhere.example/">Elsewhere</a>'
+            f"<h1>Page {n}</h1><p>Version {self.versions.get(n, 0)} of the article about topic {n}.</p>"
+            f"<ul>{links}</ul></body></html>"
+        )
+
+    async def __call__(self, scope, receive, send):
+        request = Request(scope, receive)
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            response = self._respond(request)
+        finally:
+            self.in_flight -= 1
+        await response(scope, receive, send)
+
+    def _respond(self, request: Request) -> Response:
+        parts = request.url.path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "docs" or not parts[1].isdigit() or int(parts[1]) >= self.pages:
+            return Response(status_code=404)
+        n = int(parts[1])
+        etag, last_modified = self._validators(n)
+        headers = {"ETag": etag, "Last-Modified": last_modified}
+        if request.headers.get("if-none-match") == etag:
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(self._body(n), headers=headers)
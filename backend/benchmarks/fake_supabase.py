@@ -0,0 +1,494 @@
+"""
+An in-process stand-in for the parts of Supabase the API talks to: GoTrue
+(`/auth/v1`), PostgREST (`/rest/v1`) and Storage (`/storage/v1`).
+
+It is an ASGI app, so it can be mounted straight into the pooled HTTP transport
+used by `app.db.supabase` and driven without any network. Every request can be
+delayed by a configurable latency (plus random jitter) to approximate a real
+round trip. Row level security is emulated for tables with a `user_id` column,
+and the `record_rating` / `record_analytics` functions update the `user_stats`
+rollup the way the database triggers do (SUPABASE.md).
+"""
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import unquote
+
+import jwt
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+TABLE_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "chatbots": {
+        "description": None,
+        "greeting": "Hello! How can I help you today?",
+        "initial_messages": [],
+        "faq_questions": [],
+        "placeholder": "Type your message...",
+        "primary_color": "#3B82F6",
+        "position": "bottom-right",
+        "size": "medium",
+        "show_avatar": True,
+        "allowed_domain": None,
+        "enable_typing": True,
+        "response_delay": 500,
+        "analytics": {},
+        "status": "draft",
+        "conversations": 0,
+        "accuracy": 0,
+    },
+    "documents": {
+        "storage_path": None,
+        "content": None,
+        "status": "processing",
+    },
+}
+
+# Child table -> (parent table, foreign key column) for embedded selects.
+FOREIGN_KEYS = {
+    "documents": ("chatbots", "chatbot_id"),
+}
+
+# The bound record_analytics clamps every delta to (SUPABASE.md, section 8).
+ANALYTICS_MAX_DELTA = 1000000
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _split_top_level(value: str, sep: str = ",") -> List[str]:
+    """Splits on `sep`, ignoring separators nested in parentheses."""
+    parts, depth, current = [], 0, []
+    for char in value:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == sep and depth == 0:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def _coerce(value: str) -> Any:
+    if value == "null":
+        return None
+    if value == "true":
+        return True
+    if value == "false":
+        return False
+    return value
+
+
+def _compare(left: Any, op: str, right: Any) -> bool:
+    if op == "is":
+        return left is _coerce(right) if right in ("null", "true", "false") else False
+    if op == "in":
+        options = [v.strip().strip('"') for v in right.strip("()").split(",") if v.strip()]
+        return str(left) in options
+    if len(right) >= 2 and right[0] == right[-1] == '"':
+        right = right[1:-1]
+    else:
+        right = _coerce(right)
+    if isinstance(left, bool) and isinstance(right, bool):
+        pass
+    elif isinstance(left, (int, float)) and right is not None and not isinstance(right, bool):
+        right = type(left)(right)
+    elif left is not None and not isinstance(left, str):
+        left = json.dumps(left) if isinstance(left, (list, dict)) else str(left)
+    if op == "eq":
+        return left == right
+    if op == "neq":
+        return left != right
+    if left is None or right is None:
+        return False
+    if op == "lt":
+        return left < right
+    if op == "lte":
+        return left <= right
+    if op == "gt":
+        return left > right
+    if op == "gte":
+        return left >= right
+    raise ValueError(f"Unsupported operator {op}")
+
+
+def _parse_condition(expression: str) -> Callable[[dict], bool]:
+    """Parses `col.op.value`, `and(...)` and `or(...)` expressions."""
+    for logic in ("and", "or"):
+        if expression.startswith(f"{logic}(") and expression.endswith(")"):
+            parts = [_parse_condition(p) for p in _split_top_level(expression[len(logic) + 1:-1])]
+            combine = all if logic == "and" else any
+            return lambda row: combine(p(row) for p in parts)
+    column, op, value = expression.split(".", 2)
+    return lambda row: _compare(row.get(column), op, value)
+
+
+def _filter_param(key: str, value: str) -> Callable[[dict], bool]:
+    if key in ("or", "and"):
+        return _parse_condition(f"{key}{value}")
+    op, operand = value.split(".", 1)
+    return lambda row: _compare(row.get(key), op, operand)
+
+
+def _sort(rows: List[dict], order: Optional[str]) -> List[dict]:
+    if not order:
+        return rows
+    for part in reversed(order.split(",")):
+        pieces = part.split(".")
+        column = pieces[0]
+        desc = "desc" in pieces[1:]
+        rows = sorted(rows, key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+    return rows
+
+
+class FakeSupabase:
+    """State and request handlers for the Supabase stand-in."""
+
+    def __init__(self, jwt_secret: str = "benchmark-secret", latency: float = 0.0, jitter: float = 0.0, anon_key: Optional[str] = None):
+        self.jwt_secret = jwt_secret
+        self.latency = latency
+        self.jitter = jitter
+        self.tables: Dict[str, List[dict]] = {"chatbots": [], "documents": [], "ratings": [], "user_stats": []}
+        self.buckets: Dict[str, Dict[str, bytes]] = {}
+        # "<bucket>/<path>" -> upload time, as Storage lists it
+        self.created_at: Dict[str, str] = {}
+        self.users: Dict[str, dict] = {}
+        self.rpcs: Dict[str, Callable[["FakeSupabase", dict, dict], Any]] = {
+            "record_rating": FakeSupabase._record_rating,
+            "record_analytics": FakeSupabase._record_analytics,
+        }
+        self.request_count = 0
+        self.anon_key = anon_key or jwt.encode({"role": "anon"}, jwt_secret)
+        self.service_key = jwt.encode({"role": "service_role"}, jwt_secret)
+        self.app = Starlette(routes=[
+            Route("/auth/v1/user", self.get_user, methods=["GET"]),
+            Route("/auth/v1/signup", self.signup, methods=["POST"]),
+            Route("/auth/v1/token", self.token, methods=["POST"]),
+            Route("/auth/v1/.well-known/jwks.json", self.jwks, methods=["GET"]),
+            Route("/rest/v1/rpc/{name}", self.rpc, methods=["POST", "GET"]),
+            Route("/rest/v1/{table}", self.rest, methods=["GET", "POST", "PATCH", "DELETE", "HEAD"]),
+            Route("/storage/v1/object/list/{bucket}", self.storage_list, methods=["POST"]),
+            Route("/storage/v1/object/{bucket}/{path:path}", self.storage_object, methods=["GET", "POST", "PUT"]),
+            Route("/storage/v1/object/{bucket}", self.storage_remove, methods=["DELETE"]),
+        ])
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.request_count += 1
+            delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+            if delay:
+                await asyncio.sleep(delay)
+        await self.app(scope, receive, send)
+
+    # --- Auth ---
+
+    def issue_token(self, user_id: str, email: str = "", ttl: int = 3600) -> str:
+        now = int(time.time())
+        return jwt.encode(
+            {
+                "sub": user_id,
+                "aud": "authenticated",
+                "role": "authenticated",
+                "email": email,
+                "iat": now,
+                "exp": now + ttl,
+                "user_metadata": self.users.get(user_id, {}).get("user_metadata", {}),
+            },
+            self.jwt_secret,
+        )
+
+    def create_user(self, email: str, password: str = "password", name: str = "") -> dict:
+        user = {
+            "id": str(uuid.uuid4()),
+            "aud": "authenticated",
+            "role": "authenticated",
+            "email": email,
+            "password": password,
+            "app_metadata": {},
+            "user_metadata": {"full_name": name},
+            "created_at": _now(),
+        }
+        self.users[user["id"]] = user
+        return user
+
+    def _public_user(self, user: dict) -> dict:
+        return {k: v for k, v in user.items() if k != "password"}
+
+    def _claims(self, request: Request) -> dict:
+        header = request.headers.get("authorization", "")
+        token = header[7:] if header.lower().startswith("bearer ") else ""
+        try:
+            return jwt.decode(token, self.jwt_secret, algorithms=["HS256"], options={"verify_aud": False})
+        except jwt.PyJWTError:
+            return {}
+
+    def _session(self, user: dict) -> dict:
+        return {
+            "access_token": self.issue_token(user["id"], user["email"]),
+            "refresh_token": uuid.uuid4().hex,
+            "token_type": "bearer",
+            "expires_in": 3600,
+            "expires_at": int(time.time()) + 3600,
+            "user": self._public_user(user),
+        }
+
+    async def get_user(self, request: Request):
+        claims = self._claims(request)
+        user = self.users.get(claims.get("sub", ""))
+        if not user:
+            return JSONResponse({"code": 401, "error_code": "bad_jwt", "msg": "invalid JWT"}, status_code=401)
+        return JSONResponse(self._public_user(user))
+
+    async def signup(self, request: Request):
+        body = await request.json()
+        name = (body.get("data") or {}).get("full_name", "")
+        user = self.create_user(body["email"], body["password"], name)
+        return JSONResponse(self._session(user))
+
+    async def token(self, request: Request):
+        body = await request.json()
+        for user in self.users.values():
+            if user["email"] == body.get("email") and user["password"] == body.get("password"):
+                return JSONResponse(self._session(user))
+        return JSONResponse({"code": 400, "error_code": "invalid_credentials", "msg": "Invalid login credentials"}, status_code=400)
+
+    async def jwks(self, request: Request):
+        return JSONResponse({"keys": []})
+
+    # --- PostgREST ---
+
+    def _visible(self, table: str, claims: dict, rows: List[dict]) -> List[dict]:
+        role = claims.get("role")
+        if role == "service_role":
+            return rows
+        if role == "authenticated":
+            return [r for r in rows if r.get("user_id", claims["sub"]) == claims["sub"]]
+        if table == "chatbots":
+            return [r for r in rows if r.get("status") == "active"]
+        return []
+
+    def _project(self, table: str, row: dict, select: str, claims: dict, params) -> dict:
+        if not select or select == "*":
+            return dict(row)
+        result = {}
+        for part in _split_top_level(select):
+            part = part.strip()
+            match = re.match(r"^(\w+)(?:!\w+)?\((.*)\)$", part)
+            if match:
+                child, child_select = match.groups()
+                _, fk = FOREIGN_KEYS[child]
+                children = [r for r in self._visible(child, claims, self.tables.get(child, [])) if r.get(fk) == row["id"]]
+                for key, value in params.multi_items():
+                    if key.startswith(f"{child}.") and key not in (f"{child}.order", f"{child}.limit", f"{child}.offset"):
+                        predicate = _filter_param(key[len(child) + 1:], value)
+                        children = [r for r in children if predicate(r)]
+                children = _sort(children, params.get(f"{child}.order"))
+                offset = int(params.get(f"{child}.offset", 0))
+                children = children[offset:]
+                if params.get(f"{child}.limit"):
+                    children = children[:int(params[f"{child}.limit"])]
+                result[child] = [self._project(child, c, child_select, claims, params) for c in children]
+            elif part == "*":
+                result.update(row)
+            else:
+                result[part] = row.get(part)
+        return result
+
+    def _matching(self, table: str, request: Request, claims: dict) -> List[dict]:
+        rows = self._visible(table, claims, self.tables.setdefault(table, []))
+        for key, value in request.query_params.multi_items():
+            if key in ("select", "order", "limit", "offset", "columns", "on_conflict") or "." in key:
+                continue
+            predicate = _filter_param(key, value)
+            rows = [r for r in rows if predicate(r)]
+        return rows
+
+    def _respond(self, request: Request, rows: List[dict], total: Optional[int] = None, status_code: int = 200):
+        accept = request.headers.get("accept", "")
+        headers = {}
+        if total is not None:
+            headers["content-range"] = f"0-{max(len(rows) - 1, 0)}/{total}"
+        if "vnd.pgrst.object" in accept:
+            if len(rows) != 1:
+                return JSONResponse(
+                    {"code": "PGRST116", "details": f"The result contains {len(rows)} rows", "hint": None,
+                     "message": "JSON object requested, multiple (or no) rows returned"},
+                    status_code=406,
+                )
+            return JSONResponse(rows[0], status_code=status_code, headers=headers)
+        return JSONResponse(rows, status_code=status_code, headers=headers)
+
+    async def rest(self, request: Request):
+        table = request.path_params["table"]
+        claims = self._claims(request)
+        prefer = request.headers.get("prefer", "")
+        params = request.query_params
+        select = params.get("select", "*")
+
+        if request.method in ("GET", "HEAD"):
+            rows = _sort(self._matching(table, request, claims), params.get("order"))
+            total = len(rows) if "count=exact" in prefer else None
+            offset = int(params.get("offset", 0))
+            rows = rows[offset:]
+            if params.get("limit"):
+                rows = rows[:int(params["limit"])]
+            return self._respond(request, [self._project(table, r, select, claims, params) for r in rows], total)
+
+        if request.method == "POST":
+            body = await request.json()
+            items = body if isinstance(body, list) else [body]
+            created = []
+            for item in items:
+                row = {"id": str(uuid.uuid4()), "created_at": _now(), "last_updated": _now()}
+                row.update(TABLE_DEFAULTS.get(table, {}))
+                row.update(item)
+                if claims.get("role") == "authenticated" and row.get("user_id", claims["sub"]) != claims["sub"]:
+                    return JSONResponse({"code": "42501", "message": "new row violates row-level security policy", "details": None, "hint": None}, status_code=403)
+                if table in FOREIGN_KEYS:
+                    parent, fk = FOREIGN_KEYS[table]
+                    if row.get(fk) and not any(p["id"] == row[fk] for p in self._visible(parent, claims, self.tables.get(parent, []))):
+                        return JSONResponse({"code": "42501", "message": "new row violates row-level security policy", "details": None, "hint": None}, status_code=403)
+                self.tables.setdefault(table, []).append(row)
+                created.append(row)
+                if table == "chatbots":
+                    self._user_stats(row["id"])["total_chatbots"] += 1
+            return self._respond(request, [self._project(table, r, select, claims, params) for r in created], status_code=201)
+
+        if request.method == "PATCH":
+            body = await request.json()
+            rows = self._matching(table, request, claims)
+            for row in rows:
+                row.update(body)
+                row["last_updated"] = _now()
+            return self._respond(request, [self._project(table, r, select, claims, params) for r in rows])
+
+        if request.method == "DELETE":
+            rows = self._matching(table, request, claims)
+            ids = {r["id"] for r in rows}
+            if table == "chatbots":
+                for row in rows:
+                    self._user_stats(row["id"])["total_chatbots"] -= 1
+            self.tables[table] = [r for r in self.tables[table] if r["id"] not in ids]
+            for child, (parent, fk) in FOREIGN_KEYS.items():
+                if parent == table:
+                    self.tables[child] = [r for r in self.tables.get(child, []) if r.get(fk) not in ids]
+            return self._respond(request, [self._project(table, r, select, claims, params) for r in rows])
+
+        return Response(status_code=405)
+
+    async def rpc(self, request: Request):
+        name = request.path_params["name"]
+        handler = self.rpcs.get(name)
+        if handler is None:
+            return JSONResponse({"code": "PGRST202", "message": f"Could not find the function {name}", "details": None, "hint": None}, status_code=404)
+        body = await request.json() if request.method == "POST" else dict(request.query_params)
+        try:
+            result = handler(self, body, self._claims(request))
+        except PermissionError as e:
+            return JSONResponse({"code": "42501", "message": str(e), "details": None, "hint": None}, status_code=403)
+        return JSONResponse(result)
+
+    def _user_stats(self, chatbot_id: str) -> Optional[dict]:
+        owner = next((bot["user_id"] for bot in self.tables["chatbots"] if bot["id"] == chatbot_id), None)
+        if owner is None:
+            return None
+        for row in self.tables["user_stats"]:
+            if row["user_id"] == owner:
+                return row
+        row = {"user_id": owner, "total_chatbots": 0, "total_conversations": 0, "ratings_count": 0, "positive_ratings": 0}
+        self.tables["user_stats"].append(row)
+        return row
+
+    def _record_rating(self, body: dict, claims: dict) -> None:
+        chatbot_id, conversation_id, rating = body["p_chatbot_id"], body["p_conversation_id"], body["p_rating"]
+        stats = self._user_stats(chatbot_id)
+        if stats is None:
+            return None
+        ratings = self.tables["ratings"]
+        previous = next((r for r in ratings if r["chatbot_id"] == chatbot_id and r["conversation_id"] == conversation_id), None)
+        if previous is None:
+            previous = {"chatbot_id": chatbot_id, "conversation_id": conversation_id, "rating": 0}
+            ratings.append(previous)
+            stats["ratings_count"] += 1
+        stats["positive_ratings"] += (rating >= 4) - (previous["rating"] >= 4)
+        previous["rating"] = rating
+        return None
+
+    def _record_analytics(self, body: dict, claims: dict) -> None:
+        if claims.get("role") != "service_role":
+            raise PermissionError("permission denied for function record_analytics")
+
+        def clamp(value) -> int:
+            return max(0, min(int(value or 0), ANALYTICS_MAX_DELTA))
+
+        for item in body["p_batch"]:
+            conversations = clamp(item["conversations"])
+            for bot in self.tables["chatbots"]:
+                if bot["id"] == item["chatbot_id"]:
+                    bot["conversations"] += conversations
+                    analytics = bot.setdefault("analytics", {})
+                    for event, count in item["events"].items():
+                        analytics[event] = analytics.get(event, 0) + clamp(count)
+            stats = self._user_stats(item["chatbot_id"])
+            if stats is not None:
+                stats["total_conversations"] += conversations
+        return None
+
+    # --- Storage ---
+
+    async def storage_object(self, request: Request):
+        bucket = self.buckets.setdefault(request.path_params["bucket"], {})
+        path = unquote(request.path_params["path"])
+        if request.method == "GET":
+            if path not in bucket:
+                return JSONResponse({"statusCode": "404", "error": "not_found", "message": "Object not found"}, status_code=404)
+            return Response(bucket[path], media_type="application/octet-stream")
+        form = await request.form()
+        upload = form.get("file")
+        data = await upload.read() if upload is not None else await request.body()
+        bucket[path] = data
+        self.created_at[f"{request.path_params['bucket']}/{path}"] = datetime.now(timezone.utc).isoformat()
+        return JSONResponse({"Key": f"{request.path_params['bucket']}/{path}", "Id": str(uuid.uuid4())})
+
+    async def storage_remove(self, request: Request):
+        bucket = self.buckets.setdefault(request.path_params["bucket"], {})
+        body = await request.json()
+        removed = []
+        for prefix in body.get("prefixes", []):
+            if bucket.pop(prefix, None) is not None:
+                removed.append({"name": prefix})
+        return JSONResponse(removed)
+
+    async def storage_list(self, request: Request):
+        bucket = self.buckets.setdefault(request.path_params["bucket"], {})
+        body = await request.json()
+        prefix = body.get("prefix", "").strip("/")
+        limit = int(body.get("limit", 100))
+        offset = int(body.get("offset", 0))
+        entries: Dict[str, dict] = {}
+        for path in sorted(bucket):
+            if prefix and not path.startswith(prefix + "/"):
+                continue
+            rest = path[len(prefix) + 1:] if prefix else path
+            name = rest.split("/", 1)[0]
+            is_folder = "/" in rest
+            entries.setdefault(name, {
+                "name": name,
+                "id": None if is_folder else name,
+                "created_at": None if is_folder else self.created_at.get(f"{request.path_params['bucket']}/{path}"),
+                "metadata": None if is_folder else {"size": len(bucket[path])},
+            })
+        return JSONResponse(list(entries.values())[offset:offset + limit])
@@ -0,0 +1,386 @@
+"""
+Load test for the API. It drives the real FastAPI app, including its lifespan
+(ingestion workers, analytics buffer), in process. Supabase is replaced by
+`benchmarks/fake_supabase.py`, with an injected latency per call.
+
+Every scenario runs for a fixed number of requests at the given concurrency
+(closed loop: each worker sends its next request when the previous one
+finishes). The report gives throughput, p50/p95/p99 latency and unexpected
+statuses. The scenarios cover auth, chatbots, documents, search, widget and
+dashboard. Run from `backend/`:
+
+    python -m benchmarks.load_test --concurrency 32 --requests 500 --latency 0.005
+    python -m benchmarks.load_test --only widget. --only chatbots.get
+
+Use `--save-baseline` to record the results, and `--compare` to check a run
+against them. A comparison exits with status 1 if any scenario regressed by
+more than `--tolerance`. That means p95 or p99 went up, throughput went down,
+or errors appeared. Baselines only mean something on the machine and with the
+parameters that produced them. The stored parameters are printed when they
+differ.
+"""
+import argparse
+import asyncio
+import atexit
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from benchmarks.fake_supabase import FakeSupabase
+
+JWT_SECRET = "load-test-secret"
+fake = FakeSupabase(jwt_secret=JWT_SECRET)
+
+# The app reads its settings at import time, so they are set before importing it.
+os.environ.setdefault("SUPABASE_URL", "http://supabase.local")
+os.environ.setdefault("SUPABASE_KEY", fake.anon_key)
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", fake.service_key)
+os.environ.setdefault("SUPABASE_JWT_SECRET", JWT_SECRET)
+# What the app keeps on local disk (vector indexes, transcripts, the storage
+# cleanup journal, the routing lock) goes to a scratch directory that is removed at exit.
+SCRATCH_DIR = tempfile.mkdtemp(prefix="chatflow-load-test-")
+atexit.register(shutil.rmtree, SCRATCH_DIR, ignore_errors=True)
+for name, path in (
+    ("VECTOR_INDEX_DIR", "vectors"), ("TRANSCRIPT_DIR", "transcripts"), ("STORAGE_GC_JOURNAL", "storage_gc.jsonl"),
+    ("ROUTING_LOCK_FILE", "routing.lock"),
+):
+    os.environ.setdefault(name, os.path.join(SCRATCH_DIR, path))
+# The load test measures what serving a request costs, not the widget rate
+# limits, so admission is opened up unless the caller sets it explicitly.
+for name, value in (
+    ("ADMISSION_BOT_RATE", "1000000"), ("ADMISSION_BOT_BURST", "1000000"),
+    ("ADMISSION_ORIGIN_RATE", "1000000"), ("ADMISSION_ORIGIN_BURST", "1000000"),
+    ("ADMISSION_MAX_IN_FLIGHT", "100000"), ("ADMISSION_LATENCY_THRESHOLD_SECONDS", "1000"),
+):
+    os.environ.setdefault(name, value)
+
+import httpx
+
+import app.db.supabase as supabase
+from app.core.security import conversation_signer
+from app.main import app
+
+supabase.http_transport = httpx.ASGITransport(app=fake)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "load_test.json")
+PASSWORD = "load-test-password"
+DOCUMENT_TEXT = (
+    "ChatFlow answers questions from the documents you upload. Pricing starts with a free plan "
+    "that includes one chatbot. Paid plans add more chatbots, custom domains and priority support. "
+    "Refunds are available within thirty days of purchase. Contact support by email at any time."
+)
+QUESTIONS = ["How much does it cost?", "Can I get a refund?", "How do I contact support?", "What is ChatFlow?"]
+
+
+@dataclass
+class Fixture:
+    """Data created once before the scenarios run; scenarios pick from it round-robin."""
+
+    users: List[dict] = field(default_factory=list)
+    bots: List[str] = field(default_factory=list)
+    headers: Dict[str, dict] = field(default_factory=dict)  # bot id -> its owner's auth headers
+    created_bots: List[tuple] = field(default_factory=list)
+    uploaded_documents: List[tuple] = field(default_factory=list)
+
+    def user(self, i: int) -> dict:
+        return self.users[i % len(self.users)]
+
+    def bot(self, i: int) -> tuple:
+        bot_id = self.bots[i % len(self.bots)]
+        return bot_id, self.headers[bot_id]
+
+
+@dataclass
+class Scenario:
+    name: str
+    expect: int
+    call: Callable[[httpx.AsyncClient, Fixture, int], Awaitable[httpx.Response]]
+
+
+def widget_headers(i: int) -> dict:
+    # Visitors arrive from many embedding sites.
+    return {"Origin": f"https://site{i % 1000}.example.com"}
+
+
+async def signin(c, f, i):
+    user = f.user(i)
+    return await c.post("/api/auth/signin", json={"email": user["email"], "password": PASSWORD})
+
+
+async def signup(c, f, i):
+    return await c.post("/api/auth/signup", json={"name": "Load Test", "email": f"signup-{uuid.uuid4().hex}@example.com", "password": PASSWORD})
+
+
+async def list_chatbots(c, f, i):
+    return await c.get("/api/chatbots", headers=f.user(i)["headers"])
+
+
+async def get_chatbot(c, f, i):
+    bot_id, headers = f.bot(i)
+    return await c.get(f"/api/chatbots/{bot_id}", headers=headers)
+
+
+async def update_chatbot(c, f, i):
+    bot_id, headers = f.bot(i)
+    return await c.patch(f"/api/chatbots/{bot_id}", json={"description": f"Revision {i}"}, headers=headers)
+
+
+async def create_chatbot(c, f, i):
+    headers = f.user(i)["headers"]
+    response = await c.post("/api/chatbots", json={"name": f"Load test bot {i}"}, headers=headers)
+    if response.status_code == 201:
+        f.created_bots.append((response.json()["id"], headers))
+    return response
+
+
+async def delete_chatbot(c, f, i):
+    bot_id, headers = f.created_bots.pop()
+    return await c.delete(f"/api/chatbots/{bot_id}", headers=headers)
+
+
+async def list_documents(c, f, i):
+    bot_id, headers = f.bot(i)
+    return await c.get(f"/api/chatbots/{bot_id}/documents", headers=headers)
+
+
+async def upload_document(c, f, i):
+    bot_id, headers = f.bot(i)
+    files = {"file": (f"notes-{i}.txt", f"{DOCUMENT_TEXT} Revision {uuid.uuid4()}.".encode(), "text/plain")}
+    response = await c.post(f"/api/chatbots/{bot_id}/documents/file", files=files, headers=headers)
+    if response.status_code == 201:
+        f.uploaded_documents.append((response.json()["id"], headers))
+    return response
+
+
+async def delete_document(c, f, i):
+    document_id, headers = f.uploaded_documents.pop()
+    return await c.delete(f"/api/documents/{document_id}", headers=headers)
+
+
+async def search(c, f, i):
+    bot_id, headers = f.bot(i)
+    return await c.get(f"/api/chatbots/{bot_id}/search", params={"q": QUESTIONS[i % len(QUESTIONS)]}, headers=headers)
+
+
+async def widget_config(c, f, i):
+    bot_id, _ = f.bot(i)
+    return await c.get(f"/api/widget/{bot_id}/config", headers=widget_headers(i))
+
+
+async def widget_bootstrap(c, f, i):
+    bot_id, _ = f.bot(i)
+    return await c.get(f"/api/widget/{bot_id}/bootstrap", headers={**widget_headers(i), "Accept-Encoding": "gzip, br"})
+
+
+async def widget_message(c, f, i):
+    bot_id, _ = f.bot(i)
+    response = await c.post(f"/api/widget/{bot_id}/messages", json={"message": QUESTIONS[i % len(QUESTIONS)]}, headers=widget_headers(i))
+    if b"event: done" not in response.content:
+        response.status_code = 599  # The stream ended without an answer.
+    return response
+
+
+async def widget_rating(c, f, i):
+    bot_id, _ = f.bot(i)
+    # Signed in process rather than by asking a question first, so only the rating is timed.
+    conversation_id, token = conversation_signer.issue(bot_id)
+    body = {"conversationId": conversation_id, "conversationToken": token, "rating": 1 + i % 5}
+    return await c.post(f"/api/widget/{bot_id}/ratings", json=body, headers=widget_headers(i))
+
+
+async def dashboard_stats(c, f, i):
+    return await c.get("/api/dashboard/stats", headers=f.user(i)["headers"])
+
+
+# In run order: the delete scenarios consume what the create scenarios before them made.
+SCENARIOS = [
+    Scenario("auth.signin", 200, signin),
+    Scenario("auth.signup", 201, signup),
+    Scenario("chatbots.list", 200, list_chatbots),
+    Scenario("chatbots.get", 200, get_chatbot),
+    Scenario("chatbots.update", 200, update_chatbot),
+    Scenario("chatbots.create", 201, create_chatbot),
+    Scenario("chatbots.delete", 204, delete_chatbot),
+    Scenario("documents.list", 200, list_documents),
+    Scenario("documents.upload", 201, upload_document),
+    Scenario("documents.delete", 204, delete_document),
+    Scenario("search.query", 200, search),
+    Scenario("widget.config", 200, widget_config),
+    Scenario("widget.bootstrap", 200, widget_bootstrap),
+    Scenario("widget.message", 200, widget_message),
+    Scenario("widget.rating", 204, widget_rating),
+    Scenario("dashboard.stats", 200, dashboard_stats),
+]
+
+
+async def wait_for_ingestion(client: httpx.AsyncClient, fixture: Fixture, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    for bot_id in fixture.bots:
+        while True:
+            documents = (await client.get(f"/api/chatbots/{bot_id}/documents", headers=fixture.headers[bot_id])).json()
+            if all(document["status"] != "processing" for document in documents):
+                break
+            if time.monotonic() > deadline:
+                raise RuntimeError("Seed documents were not ingested in time.")
+            await asyncio.sleep(0.1)
+
+
+async def seed(client: httpx.AsyncClient, users: int, bots_per_user: int) -> Fixture:
+    """Creates users with active chatbots, each with one ingested document, through the API itself."""
+    fixture = Fixture()
+    for n in range(users):
+        user = fake.create_user(f"user{n}@example.com", PASSWORD, f"User {n}")
+        headers = {"Authorization": f"Bearer {fake.issue_token(user['id'], user['email'], ttl=86400)}"}
+        fixture.users.append({"email": user["email"], "headers": headers})
+        for b in range(bots_per_user):
+            response = await client.post("/api/chatbots", json={"name": f"Bot {n}.{b}"}, headers=headers)
+            bot_id = response.json()["id"]
+            await client.patch(f"/api/chatbots/{bot_id}", json={"status": "active"}, headers=headers)
+            files = {"file": ("faq.txt", f"{DOCUMENT_TEXT} ({bot_id})".encode(), "text/plain")}
+            await client.post(f"/api/chatbots/{bot_id}/documents/file", files=files, headers=headers)
+            fixture.bots.append(bot_id)
+            fixture.headers[bot_id] = headers
+    await wait_for_ingestion(client, fixture)
+    return fixture
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+
+async def run_scenario(client: httpx.AsyncClient, fixture: Fixture, scenario: Scenario, requests: int, concurrency: int, offset: int = 0) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while (n := next(counter)) < requests:
+            started = time.perf_counter()
+            try:
+                ok = (await scenario.call(client, fixture, offset + n)).status_code == scenario.expect
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Returns a description of every regression beyond `tolerance` (a fraction)."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if result[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {before[key]} -> {result[key]}")
+        if result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput']} -> {result['throughput']} req/s")
+        if result["errors"] > before["errors"]:
+            regressions.append(f"{name}: errors {before['errors']} -> {result['errors']}")
+    return regressions
+
+
+def print_report(results: Dict[str, dict], baseline: Optional[Dict[str, dict]]) -> None:
+    print(f"{'scenario':<20} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, r in results.items():
+        line = f"{name:<20} {r['throughput']:>9} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r['errors']:>7}"
+        before = (baseline or {}).get(name)
+        if before and before["p95_ms"]:
+            line += f"   p95 {100 * (r['p95_ms'] / before['p95_ms'] - 1):+.0f}%, req/s {100 * (r['throughput'] / before['throughput'] - 1):+.0f}%"
+        print(line)
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests per scenario first")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds Supabase takes per call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds per call, uniformly")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--bots-per-user", type=int, default=2)
+    parser.add_argument("--only", action="append", help="run scenarios whose name starts with this (repeatable)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--compare", action="store_true", help="compare with the baseline file; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression when comparing")
+    parser.add_argument("--verbose", action="store_true", help="show the app's warnings (e.g. ingestion retries for documents deleted mid-run)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+
+    scenarios = [s for s in SCENARIOS if not args.only or any(s.name.startswith(prefix) for prefix in args.only)]
+    parameters = {
+        "concurrency": args.concurrency, "requests": args.requests, "latency": args.latency, "jitter": args.jitter,
+        "users": args.users, "bots_per_user": args.bots_per_user,
+    }
+
+    results: Dict[str, dict] = {}
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api", timeout=60.0) as client:
+            # Seeding runs without injected latency.
+            fixture = await seed(client, args.users, args.bots_per_user)
+            fake.latency, fake.jitter = args.latency, args.jitter
+            for scenario in scenarios:
+                if args.warmup:
+                    await run_scenario(client, fixture, scenario, args.warmup, args.concurrency, offset=args.requests)
+                results[scenario.name] = await run_scenario(client, fixture, scenario, args.requests, args.concurrency)
+
+    baseline = None
+    if args.compare:
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        if stored["parameters"] != parameters:
+            print(f"Note: the baseline was recorded with {stored['parameters']}")
+        baseline = stored["results"]
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "parameters": parameters,
+                "python": platform.python_version(),
+                "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+                "results": results,
+            }, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -6,6 +6,7 @@
 
   let state = {
     isOpen: false,
+    elements: [],
   };
 
   function init() {
@@ -15,22 +16,106 @@
       return;
     }
 
-    fetch(`${API_BASE_URL}/widget/${config.botId}/config`)
-      .then(response => {
-        if (!response.ok) {
-          return response.json().then(err => { throw new Error(err.detail || 'Chatbot not found or disabled.') });
+    // The bootstrap bundle (config and FAQ answers) is one request. Once we
+    // know its version, later page loads ask for the immutable versioned URL,
+    // which the browser can answer from its cache without a round trip.
+    const bootstrapUrl = `${API_BASE_URL}/widget/${config.botId}/bootstrap`;
+    const knownVersion = readVersion(config.botId);
+
+    fetchBundle(knownVersion ? `${bootstrapUrl}/${knownVersion}` : bootstrapUrl)
+      .then(bundle => {
+        rememberVersion(config.botId, bundle.version);
+        createUI(config.botId, bundle);
+        if (knownVersion) {
+          // Pick up changes for the next page load, off the critical path. The
+          // versioned bundle may have come from the browser cache after the
+          // chatbot was deleted or disabled, or this site was disallowed; then
+          // forget it and take the widget down again.
+          later(() => fetchBundle(bootstrapUrl)
+            .then(latest => {
+              // Another server may not have seen the latest save yet; never go back.
+              if (revision(latest.version) >= revision(knownVersion)) {
+                rememberVersion(config.botId, latest.version);
+              }
+            })
+            .catch(error => {
+              if (isGone(error)) {
+                forgetVersion(config.botId);
+                removeUI();
+              }
+            }));
         }
-        return response.json();
-      })
-      .then(widgetConfig => {
-        createUI(config.botId, widgetConfig);
       })
       .catch(error => {
+        if (isGone(error)) {
+          forgetVersion(config.botId);
+        }
         console.error("ChatFlow Widget Error:", error.message);
       });
   }
 
-  function createUI(botId, config) {
+  function fetchBundle(url) {
+    return fetch(url).then(response => {
+      if (!response.ok) {
+        return response.json().catch(() => ({})).then(err => {
+          const error = new Error(err.detail || 'Chatbot not found or disabled.');
+          error.status = response.status;
+          throw error;
+        });
+      }
+      return response.json();
+    });
+  }
+
+  function isGone(error) {
+    // 403: this site is not allowed to embed the chatbot; 404: no such active chatbot.
+    return error.status === 403 || error.status === 404;
+  }
+
+  function revision(version) {
+    // Versions are "<revision in hex>-<content hash>"; older ones had no revision.
+    const parts = String(version).split('-');
+    return parts.length > 1 ? parseInt(parts[0], 16) || 0 : 0;
+  }
+
+  function versionKey(botId) {
+    return `chatflow:bootstrap:${botId}`;
+  }
+
+  function readVersion(botId) {
+    try {
+      return window.localStorage.getItem(versionKey(botId));
+    } catch (e) {
+      return null; // Storage can be unavailable, e.g. in private browsing.
+    }
+  }
+
+  function rememberVersion(botId, version) {
+    try {
+      window.localStorage.setItem(versionKey(botId), version);
+    } catch (e) {
+      // Without storage every load uses the short-lived unversioned URL.
+    }
+  }
+
+  function forgetVersion(botId) {
+    try {
+      window.localStorage.removeItem(versionKey(botId));
+    } catch (e) {
+      // Nothing was stored.
+    }
+  }
+
+  function later(fn) {
+    if (window.requestIdleCallback) {
+      window.requestIdleCallback(fn);
+    } else {
+      setTimeout(fn, 2000);
+    }
+  }
+
+  function createUI(botId, bundle) {
+    const config = bundle.config;
     const theme = {
       primary: config.primaryColor || '#3B82F6',
       textOnPrimary: '#FFFFFF',
@@ -106,6 +191,11 @@
     chatWindow.className = 'cf-chat-window';
     const iframe = document.createElement('iframe');
     iframe.src = `${IFRAME_BASE_URL}/chatbot-iframe/${botId}`; // We need to create this page in Next.js
+    // Hand the bundle to the chat page, so it can show the config and answer
+    // the FAQ questions without fetching them again.
+    iframe.addEventListener('load', () => {
+      iframe.contentWindow.postMessage({ type: 'chatflow:bootstrap', config, faqs: bundle.faqs || [] }, IFRAME_BASE_URL);
+    });
     chatWindow.appendChild(iframe);
 
     // Chat Button
@@ -129,6 +219,13 @@
     container.appendChild(chatWindow);
     container.appendChild(chatButton);
     document.body.appendChild(container);
+    state.elements = [style, container];
+  }
+
+  function removeUI() {
+    state.elements.forEach(element => element.remove());
+    state.elements = [];
+    state.isOpen = false;
   }
 
   // --- Run ---
@@ -9,6 +9,7 @@ export default function ChatbotIframePage() {
     const { id } = router.query;
     const [config, setConfig] = useState(null);
     const [messages, setMessages] = useState([]);
+    const [faqs, setFaqs] = useState([]);
     const [inputValue, setInputValue] = useState("");
     const messagesEndRef = useRef(null);
 
@@ -24,17 +25,41 @@ export default function ChatbotIframePage() {
       }
     }, [id]);
 
+    // widget.js posts its bootstrap bundle once this page loads: the same
+    // config, plus precomputed answers to the chatbot's FAQ questions.
+    useEffect(() => {
+      const onMessage = (event) => {
+        if (event.source !== window.parent || event.data?.type !== 'chatflow:bootstrap') return;
+        setConfig(event.data.config);
+        setFaqs(event.data.faqs || []);
+        setMessages(prev => prev.length ? prev : (event.data.config.initialMessages || []).map(msg => ({ text: msg, sender: 'bot' })));
+      };
+      window.addEventListener('message', onMessage);
+      return () => window.removeEventListener('message', onMessage);
+    }, []);
+
     const scrollToBottom = () => {
       messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
     };
     useEffect(scrollToBottom, [messages]);
     
+    const findFaq = (text) => faqs.find(faq => faq.question.trim().toLowerCase() === text.trim().toLowerCase());
+
+    const askFaq = (faq) => {
+      setMessages(prev => [...prev, { text: faq.question, sender: 'user' }, { text: faq.answer, sender: 'bot' }]);
+    };
+
     const handleSendMessage = (e) => {
       e.preventDefault();
       if (!inputValue.trim()) return;
+      const faq = findFaq(inputValue);
+      setInputValue("");
+      if (faq) {
+        askFaq(faq);
+        return;
+      }
       const userMessage = { text: inputValue, sender: 'user' };
       setMessages(prev => [...prev, userMessage]);
-      setInputValue("");
       // TODO: Add API call to get a response from the bot
     };
 
@@ -60,6 +85,15 @@ export default function ChatbotIframePage() {
                         </div>
                     </div>
                 ))}
+                {faqs.length > 0 && !messages.some(message => message.sender === 'user') && (
+                    <div className="flex flex-wrap gap-2">
+                        {faqs.map((faq, index) => (
+                            <button key={index} type="button" onClick={() => askFaq(faq)} style={{ borderColor: config.primaryColor, color: config.primaryColor }} className="rounded-full border px-3 py-1 text-xs hover:bg-gray-50">
+                                {faq.question}
+                            </button>
+                        ))}
+                    </div>
+                )}
                 <div ref={messagesEndRef} />
             </div>
 